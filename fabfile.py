@@ -106,34 +106,221 @@ def backup(*args):
     with hide('status'):
         local(command)
 
+def _is_true(value):
+    return value in (True, 'True', 'true', '1')
+
 def _data_pipeline(context, num_topics):
     dictionary = context.find_dictionary()
     if dictionary is None:
         dictionary = context.build_dictionary()
 
-    if not context.bows_exist(dictionary):
-        context.build_bows(dictionary)
+    # only vectorizes documents that are not vectorized yet
+    context.build_bows(dictionary)
 
-    model, lda = context.build_lda(dictionary, num_topics=num_topics)
-    context.apply_lda(dictionary, model, lda)
-    context.evaluate_lda(dictionary, model, lda)
+    try:
+        model, lda = context.build_lda(dictionary, num_topics=num_topics)
+        context.apply_lda(dictionary, model, lda)
+        context.evaluate_lda(dictionary, model, lda)
+    finally:
+        context.cleanup()
 
-def chat_pipeline(name="chat data, no bert, no punctuation", num_topics=30):
+def chat_pipeline(name="chat data, no bert, no punctuation", num_topics=30, tokenizer_workers=1, weighting='legacy',
+                  corpus_backend='db', inference_workers=1, holdout_fraction=0, eval_sample_size=None,
+                  lda_workers='auto', lda_chunksize=2000, lda_passes=1, lda_batch=False):
     import logging
     logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 
     _setup_django(debug=False)
 
     from textvis.topics.tasks import get_chat_context
-    context = get_chat_context(name)
+    context = get_chat_context(name, tokenizer_workers=tokenizer_workers, weighting=weighting,
+                               corpus_backend=corpus_backend, inference_workers=inference_workers,
+                               holdout_fraction=float(holdout_fraction),
+                               eval_sample_size=int(eval_sample_size) if eval_sample_size else None,
+                               lda_workers=lda_workers, lda_chunksize=lda_chunksize, lda_passes=lda_passes,
+                               lda_batch=_is_true(lda_batch))
     _data_pipeline(context, num_topics=int(num_topics))
 
-def tweet_pipeline(name="tweet data, no punctuation", num_topics=30):
+def tweet_pipeline(name="tweet data, no punctuation", num_topics=30, tokenizer_workers=1, weighting='legacy',
+                   corpus_backend='db', inference_workers=1, holdout_fraction=0, eval_sample_size=None,
+                   lda_workers='auto', lda_chunksize=2000, lda_passes=1, lda_batch=False):
     import logging
     logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO, )
 
     _setup_django(debug=False)
 
     from textvis.topics.tasks import get_twitter_context
-    context = get_twitter_context(name)
+    context = get_twitter_context(name, tokenizer_workers=tokenizer_workers, weighting=weighting,
+                                  corpus_backend=corpus_backend, inference_workers=inference_workers,
+                                  holdout_fraction=float(holdout_fraction),
+                                  eval_sample_size=int(eval_sample_size) if eval_sample_size else None,
+                                  lda_workers=lda_workers, lda_chunksize=lda_chunksize, lda_passes=lda_passes,
+                                  lda_batch=_is_true(lda_batch))
     _data_pipeline(context, num_topics=int(num_topics))
+
+def topic_sweep(dataset='chat', name=None, topics='10,20,30,50', max_workers='auto', holdout_fraction=0.1,
+                eval_sample_size=None, lda_chunksize=2000, lda_passes=1, output=None):
+    """Train models for several topic counts in parallel and compare them"""
+    import csv
+    import logging
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    _setup_django(debug=False)
+
+    from textvis.topics import tasks, sweep
+    options = dict(holdout_fraction=float(holdout_fraction),
+                   eval_sample_size=int(eval_sample_size) if eval_sample_size else None,
+                   lda_chunksize=lda_chunksize, lda_passes=lda_passes)
+    if dataset == 'tweet':
+        context = tasks.get_twitter_context(name or "tweet data, no punctuation", **options)
+    else:
+        context = tasks.get_chat_context(name or "chat data, no bert, no punctuation", **options)
+
+    dictionary = context.find_dictionary()
+    if dictionary is None:
+        dictionary = context.build_dictionary()
+    context.build_bows(dictionary)
+
+    try:
+        results = context.sweep_lda(dictionary, [int(count) for count in topics.split(',')],
+                                    max_workers=max_workers)
+    finally:
+        context.cleanup()
+
+    rows = sweep.report_rows(results)
+
+    print("%6s %6s %10s %23s %12s %9s %9s %10s" % ('model', 'topics', 'bound', 'interval', 'perplexity',
+                                                  'documents', 'train s', 'docs/s'))
+    for model_id, num_topics, bound, lower, upper, perplexity, documents, training_time, docs_per_second in rows:
+        interval = '%.3f to %.3f' % (lower, upper) if lower is not None else '-'
+        print("%6d %6d %10.3f %23s %12.1f %9s %9.1f %10.0f" % (model_id, num_topics, bound, interval, perplexity,
+                                                              documents, training_time, docs_per_second))
+
+    if output:
+        with open(output, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(sweep.REPORT_COLUMNS)
+            writer.writerows(rows)
+        print("Wrote %s" % output)
+
+def tweet_update_dictionary(name="tweet data, no punctuation", reprune=False, tokenizer_workers=1):
+    """Add newly streamed tweets to an existing tweet dictionary"""
+    import logging
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    _setup_django(debug=False)
+
+    from textvis.topics.tasks import get_twitter_context
+    context = get_twitter_context(name, tokenizer_workers=tokenizer_workers)
+    dictionary = context.find_dictionary()
+    if dictionary is None:
+        abort("No dictionary for '%s'; run tweet_pipeline first" % name)
+
+    context.update_dictionary(dictionary, reprune=_is_true(reprune))
+
+def tweet_update(name="tweet data, no punctuation", model_id=None, new_only=True, tokenizer_workers=1,
+                 inference_workers=1):
+    """
+    Add new tweets to the dictionary, vectorize them and update the latest
+    tweet topic model with them. The updated model is applied to and
+    evaluated on the new tweets only, unless new_only is false.
+    """
+    import logging
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    _setup_django(debug=False)
+
+    from textvis.topics.models import TopicModel
+    from textvis.topics.tasks import get_twitter_context
+    context = get_twitter_context(name, tokenizer_workers=tokenizer_workers, inference_workers=inference_workers)
+    dictionary = context.find_dictionary()
+    if dictionary is None:
+        abort("No dictionary for '%s'; run tweet_pipeline first" % name)
+
+    models = TopicModel.objects.filter(dictionary=dictionary)
+    model = models.get(pk=model_id) if model_id else models.latest('time')
+    if model.source_watermark is None:
+        abort("Model %d does not record which tweets it was trained on" % model.id)
+
+    context.update_dictionary(dictionary)
+    context.build_bows(dictionary)
+
+    after = model.source_watermark if _is_true(new_only) else None
+    try:
+        new_model, lda = context.update_lda(dictionary, model)
+        if new_model != model:
+            context.apply_lda(dictionary, new_model, lda, after=after)
+            context.evaluate_lda(dictionary, new_model, lda, after=after)
+    finally:
+        context.cleanup()
+
+def benchmark_bulk_write(dictionary_id, num_rows=100000, batch_size=None):
+    """Compare row throughput of the bulk write backends"""
+    import logging
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    _setup_django(debug=False)
+
+    from textvis.topics.models import Dictionary
+    from textvis.topics import bulk
+
+    dictionary = Dictionary.objects.get(pk=dictionary_id)
+    results = bulk.benchmark(dictionary, num_rows=int(num_rows),
+                             batch_size=int(batch_size) if batch_size else None)
+
+    for backend, rows, seconds in results:
+        print("%-12s %9d rows %8.2fs %10.0f rows/s" % (backend, rows, seconds, rows / max(seconds, 1e-9)))
+
+def benchmark_corpus_storage(dictionary_id, dataset='chat', lda_topics=10):
+    """Compare disk size and pass time of the database and sparse corpus backends"""
+    import logging
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    _setup_django(debug=False)
+
+    from textvis.topics.models import Dictionary, TextPrizmWord, TweetWord
+    from textvis.topics import corpus
+
+    wv_class = TweetWord if dataset == 'tweet' else TextPrizmWord
+    dictionary = Dictionary.objects.get(pk=dictionary_id)
+    results = corpus.benchmark(dictionary, wv_class, lda_topics=int(lda_topics))
+
+    for label, num_docs, size, iteration_time, lda_time in results:
+        print("%-8s %9d docs %14s bytes %8.1fs/pass %8.1fs/LDA pass" % (label, num_docs, size, iteration_time, lda_time))
+
+def benchmark_training(dictionary_id, dataset='chat', num_topics=30, workers='auto', chunksizes='500,1000,2000,4000',
+                       passes=1, sample_size=20000, output='training_benchmark.csv'):
+    """Train on a corpus sample with each workers/chunksize combination and record docs/sec as CSV"""
+    import csv
+    import itertools
+    import logging
+    logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
+
+    _setup_django(debug=False)
+
+    from textvis.topics.models import Dictionary, TextPrizmWord, TweetWord
+    from textvis.topics.corpus import SparseCorpusStore
+    from textvis.topics.tasks import DbWordVectorIterator
+    from textvis.topics import training
+
+    wv_class = TweetWord if dataset == 'tweet' else TextPrizmWord
+    dictionary = Dictionary.objects.get(pk=dictionary_id)
+
+    store = SparseCorpusStore(dictionary)
+    corpus = store.corpus() if store.exists() else DbWordVectorIterator(dictionary, wv_class)
+
+    configs = [training.TrainingConfig(workers=w, chunksize=c, passes=passes)
+               for w, c in itertools.product(workers.split(','), chunksizes.split(','))]
+    results = training.benchmark(corpus, dictionary.gensim_dictionary, configs,
+                                 num_topics=int(num_topics), sample_size=int(sample_size))
+
+    with open(output, 'wb') as f:
+        writer = csv.writer(f)
+        writer.writerow(['workers', 'chunksize', 'passes', 'batch', 'num_topics', 'docs', 'seconds', 'docs_per_second'])
+        for config, num_docs, seconds, docs_per_second in results:
+            writer.writerow([config.workers, config.chunksize, config.passes, config.batch, num_topics,
+                             num_docs, '%.2f' % seconds, '%.1f' % docs_per_second])
+            print("workers %3d chunksize %5d %8.1fs %10.0f docs/s" % (config.workers, config.chunksize,
+                                                                     seconds, docs_per_second))
+
+    print("Wrote %s" % output)
@@ -82,6 +82,8 @@ if DATABASES['default']['ENGINE'] == 'django.db.backends.mysql':
     DATABASES['default']['OPTIONS'] = {
         'charset': 'utf8mb4',
         'init_command': 'SET storage_engine=INNODB',
+        # allow LOAD DATA LOCAL INFILE for bulk writes
+        'local_infile': 1,
     }
 
 # Internationalization
@@ -112,6 +114,47 @@ TEMPLATE_DIRS = (
 
 TWITTER_STREAM_TWEET_MODEL = 'twitter_stream.Tweet'
 
+# Working files for the topic pipeline (token spools, caches, models)
+TOPICS_DATA_DIR = path(environ.get('TOPICS_DATA_DIR', BASE_DIR / 'topics_data'))
+
+# How the topic pipeline inserts rows: auto, orm, executemany or load_data
+TOPICS_BULK_WRITER = environ.get('TOPICS_BULK_WRITER', 'auto')
+TOPICS_BULK_BATCH_SIZE = int(environ['TOPICS_BULK_BATCH_SIZE']) if 'TOPICS_BULK_BATCH_SIZE' in environ else None
+# Background writer threads for vectorization and topic inference (auto: 0 on SQLite, else 1)
+TOPICS_WRITER_THREADS = environ.get('TOPICS_WRITER_THREADS', 'auto')
+# Corpora with up to this many word vectors are cached in memory during a pipeline run
+TOPICS_CORPUS_CACHE_MEMORY_POSTINGS = int(environ.get('TOPICS_CORPUS_CACHE_MEMORY_POSTINGS', 20000000))
+# Saved topic models, one directory each
+TOPICS_MODELS_DIR = path(environ.get('TOPICS_MODELS_DIR', TOPICS_DATA_DIR / 'models'))
+# Loaded topic models kept per process
+TOPICS_MODEL_CACHE_SIZE = int(environ.get('TOPICS_MODEL_CACHE_SIZE', 2))
+# Seconds topic pages and API responses stay in the 'topics' cache
+TOPICS_CACHE_TIMEOUT = int(environ.get('TOPICS_CACHE_TIMEOUT', 24 * 60 * 60))
+
+# The topic pages cache in process memory, or with TOPICS_CACHE_DIR set,
+# in files shared by all processes. Its hit and miss counters are kept
+# apart, per process, so they are never culled with the pages.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'topics': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'topics',
+        'OPTIONS': {'MAX_ENTRIES': 1000},
+    },
+    'topics_stats': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'topics_stats',
+    },
+}
+if environ.get('TOPICS_CACHE_DIR'):
+    CACHES['topics'] = {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': environ['TOPICS_CACHE_DIR'],
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    }
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
@@ -0,0 +1,209 @@
+"""
+Read-only JSON API for the visualization front end.
+
+Responses are compact: lists of values are sent as parallel arrays
+rather than one object per item, and gzip-compressed when the client
+accepts it.
+
+A topic model does not change once its pipeline run finishes, so each
+response carries an ETag derived from the model's version and a
+Last-Modified of its build time, and its body is cached by model
+version (see caching.py).
+"""
+
+import json
+
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse, Http404, JsonResponse
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_GET
+
+import caching
+import models
+from views import get_topicvector_class
+
+
+def _model_stamp(request, model_id=None, *args, **kwargs):
+    """
+    (last modified time, cache key version) of the data behind a
+    request, computed once per request. Without a model_id it covers
+    the list of models.
+    """
+    if not hasattr(request, '_topics_api_stamp'):
+        if model_id is None:
+            last_modified = models.TopicModel.objects.aggregate(time=Max('time'))['time']
+            version = 'all-%s' % caching.models_version()
+        else:
+            try:
+                last_modified, version = models.TopicModel.objects\
+                    .values_list('time', 'version').get(pk=model_id)
+            except models.TopicModel.DoesNotExist:
+                raise Http404("No such model")
+            version = '%s-%d' % (model_id, version)
+        request._topics_api_stamp = (last_modified, version)
+    return request._topics_api_stamp
+
+
+def _last_modified(request, *args, **kwargs):
+    return _model_stamp(request, *args, **kwargs)[0]
+
+
+def _etag(request, *args, **kwargs):
+    return 'topics-api-%s' % _model_stamp(request, *args, **kwargs)[1]
+
+
+def api_view(func):
+    """
+    Make func(request, **kwargs) -> data into a cached, conditional,
+    gzipped JSON view.
+    """
+    def view(request, *args, **kwargs):
+        version = _model_stamp(request, *args, **kwargs)[1]
+        key = caching.make_key(kwargs.get('model_id', 'all'), version, 'api', func.__name__,
+                               request.GET.urlencode())
+
+        body = caching.get_or_set(key, lambda: json.dumps(func(request, *args, **kwargs), separators=(',', ':')))
+        return HttpResponse(body, content_type='application/json')
+
+    view.__name__ = func.__name__
+    view.__doc__ = func.__doc__
+    return require_GET(gzip_page(condition(etag_func=_etag, last_modified_func=_last_modified)(view)))
+
+
+def _int_param(request, name, default, maximum):
+    try:
+        return min(maximum, max(1, int(request.GET.get(name, default))))
+    except ValueError:
+        return default
+
+
+@api_view
+def model_list(request):
+    """All topic models as columns."""
+    rows = models.TopicModel.objects.order_by('id')\
+        .annotate(num_topics=Count('topics'))\
+        .values_list('id', 'name', 'dictionary_id', 'dictionary__dataset', 'time', 'num_topics', 'perplexity')
+
+    columns = ['id', 'name', 'dictionary', 'dataset', 'time', 'num_topics', 'perplexity']
+    data = dict((column, []) for column in columns)
+    for row in rows:
+        for column, value in zip(columns, row):
+            if column == 'time':
+                value = value.isoformat()
+            data[column].append(value)
+    return data
+
+
+@api_view
+def model_detail(request, model_id):
+    """A model and its topics, with their alpha and prevalence."""
+    model = models.TopicModel.objects.select_related('dictionary').get(pk=model_id)
+    topics = list(model.topics.order_by('index').values_list('id', 'index', 'alpha', 'prevalence'))
+
+    return {
+        'id': model.id,
+        'name': model.name,
+        'time': model.time.isoformat(),
+        'dictionary': {'id': model.dictionary.id, 'name': model.dictionary.name,
+                       'dataset': model.dictionary.dataset},
+        'perplexity': model.perplexity,
+        'topics': {
+            'id': [row[0] for row in topics],
+            'index': [row[1] for row in topics],
+            'alpha': [row[2] for row in topics],
+            'prevalence': [row[3] for row in topics],
+        },
+    }
+
+
+@api_view
+def model_words(request, model_id):
+    """
+    The top ?n words of each topic. Word texts are listed once in
+    "words"; each topic has parallel arrays of positions in that list
+    and probabilities.
+    """
+    model = models.TopicModel.objects.get(pk=model_id)
+    grid = models.TopicWordGrid.get_for_model(model)
+    n = _int_param(request, 'n', 20, grid.num_rows or 1)
+
+    words = []
+    positions = {}
+    topic_words = [[] for topic in grid.topics]
+    topic_probabilities = [[] for topic in grid.topics]
+
+    for row in grid.get_rows(0, n):
+        for column, cell in enumerate(row):
+            if cell is None:
+                continue
+            if cell.text not in positions:
+                positions[cell.text] = len(words)
+                words.append(cell.text)
+            topic_words[column].append(positions[cell.text])
+            topic_probabilities[column].append(round(cell.probability, 6))
+
+    return {
+        'topics': [topic_id for topic_id, index in grid.topics],
+        'words': words,
+        'topic_words': topic_words,
+        'topic_probabilities': topic_probabilities,
+    }
+
+
+@api_view
+def topic_examples(request, model_id, topic_id):
+    """The best ?n examples of a topic, as parallel arrays."""
+    model = models.TopicModel.objects.select_related('dictionary').get(pk=model_id)
+    try:
+        topic = model.topics.get(pk=topic_id)
+    except models.Topic.DoesNotExist:
+        raise Http404("No such topic")
+
+    topicvector_class = get_topicvector_class(model)
+    n = _int_param(request, 'n', 20, 100)
+
+    if model.examples_indexed:
+        examples = models.TopicExample.get_examples(topic, topicvector_class, limit=n)
+    else:
+        examples, next_cursor = topicvector_class.get_examples_page(topic, page_size=n)
+
+    fields = [topicvector_class.source_fields(example.source) for example in examples]
+    return {
+        'source_id': [example.source_id for example in examples],
+        'probability': [example.probability for example in examples],
+        'user_name': [user_name for user_name, text, created_at in fields],
+        'text': [text for user_name, text, created_at in fields],
+        'created_at': [created_at.isoformat() if created_at else None for user_name, text, created_at in fields],
+    }
+
+
+@api_view
+def model_prevalence(request, model_id):
+    """
+    Each topic's mean probability over the corpus and number of
+    documents.
+    """
+    model = models.TopicModel.objects.select_related('dictionary').get(pk=model_id)
+    topics = list(model.topics.order_by('index').values_list('id', 'prevalence', 'document_count'))
+
+    if topics and topics[0][1] is None:
+        # models from before _apply_lda recorded prevalence
+        topicvector_class = get_topicvector_class(model)
+        totals = dict((row['topic'], row) for row in topicvector_class.objects.filter(topic_model=model)
+                      .values('topic').annotate(total=Sum('probability'), documents=Count('id')))
+        num_docs = model.dictionary.corpus_num_docs or max([row['documents'] for row in totals.values()] or [1])
+        topics = [(topic_id, totals[topic_id]['total'] / num_docs if topic_id in totals else 0.0,
+                   totals[topic_id]['documents'] if topic_id in totals else 0)
+                  for topic_id, prevalence, document_count in topics]
+
+    return {
+        'topics': [row[0] for row in topics],
+        'prevalence': [row[1] for row in topics],
+        'documents': [row[2] for row in topics],
+    }
+
+
+@require_GET
+def cache_stats(request):
+    """Approximate hit and miss counts of the topics cache (see caching.py). Not cached."""
+    return JsonResponse(caching.stats())
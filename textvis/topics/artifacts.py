@@ -0,0 +1,128 @@
+"""
+Saved gensim models.
+
+Each TopicModel's lda is saved in its own directory:
+
+    TOPICS_MODELS_DIR/model_<id>/lda.model           the pickled model
+    TOPICS_MODELS_DIR/model_<id>/lda.model.*.npy     its numpy arrays
+
+Every array is stored in its own .npy file, so loads can memory-map
+them (mmap='r') and processes that load the same model share the pages.
+A model is written to a temporary directory which is renamed into place
+when complete, so readers never see a partial model.
+
+Models saved before this layout (lda_out_<id>.model in the working
+directory) are still found.
+
+Loaded models are kept in a small per-process LRU cache
+(TOPICS_MODEL_CACHE_SIZE models), so pipeline stages and views reuse a
+warm model. Cached models are shared: do not modify them.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+from django.conf import settings
+from path import path
+
+import logging
+logger = logging.getLogger(__name__)
+
+MODEL_FILENAME = 'lda.model'
+
+
+def models_dir():
+    return path(getattr(settings, 'TOPICS_MODELS_DIR', None) or settings.TOPICS_DATA_DIR / 'models')
+
+
+def artifact_dir(model_id):
+    return models_dir() / ('model_%d' % model_id)
+
+
+def legacy_model_path(model_id):
+    return path("lda_out_%d.model" % model_id)
+
+
+def model_path(model_id):
+    """Where model_id's lda is saved, falling back to the legacy location."""
+    new_path = artifact_dir(model_id) / MODEL_FILENAME
+    if not new_path.exists() and legacy_model_path(model_id).exists():
+        return legacy_model_path(model_id)
+    return new_path
+
+
+def save_model(model_id, lda):
+    target = artifact_dir(model_id)
+    tmp_dir = path(target + '.tmp-%d' % os.getpid())
+    tmp_dir.rmtree_p()
+    tmp_dir.makedirs()
+
+    try:
+        # sep_limit=0 stores every numpy array in its own file
+        lda.save(tmp_dir / MODEL_FILENAME, sep_limit=0)
+
+        if target.exists():
+            old_dir = path(target + '.old-%d' % os.getpid())
+            target.rename(old_dir)
+            tmp_dir.rename(target)
+            old_dir.rmtree_p()
+        else:
+            tmp_dir.rename(target)
+    except:
+        tmp_dir.rmtree_p()
+        raise
+
+    model_cache.discard(model_id)
+    logger.info("Saved model %d to %s" % (model_id, target))
+
+
+def load_model(model_id, mmap='r'):
+    from gensim.models import LdaModel
+
+    # the pickle knows whether this is an LdaModel or an LdaMulticore
+    return LdaModel.load(model_path(model_id), mmap=mmap)
+
+
+class ModelCache(object):
+    """Least recently used loaded models, by model id."""
+
+    def __init__(self, max_size=None):
+        self.max_size = max_size
+        self.models = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_max_size(self):
+        if self.max_size is not None:
+            return self.max_size
+        return getattr(settings, 'TOPICS_MODEL_CACHE_SIZE', 2)
+
+    def get(self, model_id):
+        with self.lock:
+            lda = self.models.pop(model_id, None)
+            if lda is not None:
+                self.models[model_id] = lda
+                self.hits += 1
+                return lda
+            self.misses += 1
+
+        lda = load_model(model_id)
+
+        with self.lock:
+            self.models[model_id] = lda
+            while len(self.models) > self.get_max_size():
+                self.models.popitem(last=False)
+        return lda
+
+    def discard(self, model_id):
+        with self.lock:
+            self.models.pop(model_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.models.clear()
+
+
+model_cache = ModelCache()
@@ -0,0 +1,419 @@
+"""
+Bulk insertion of plain row tuples, without building model instances.
+
+Use get_bulk_writer(model_class, fields) to get a writer for the current
+database. Rows are tuples of values in the order of fields, where a
+foreign key field takes the related object's id.
+
+Backends:
+
+    orm          Model.objects.bulk_create (the original code path)
+    executemany  one multi-row executemany per batch, in a transaction
+    load_data    MySQL LOAD DATA LOCAL INFILE from a temporary file
+
+The default ('auto', or settings.TOPICS_BULK_WRITER) picks load_data on
+MySQL and executemany everywhere else.
+
+With threads > 0, batches are handed to background writer threads
+through a bounded queue, so the caller can keep computing while the
+database works (see ThreadedBulkWriter).
+"""
+
+import os
+import Queue
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.db import connections, transaction
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def _timing_summary(writer, elapsed):
+    """Split a stage's elapsed time into compute and database time."""
+    return "%.1fs compute, %.1fs database writes, %.1fs blocked on writes" % (
+        elapsed - writer.blocked_time, writer.write_time, writer.blocked_time)
+
+
+class BulkWriter(object):
+    """
+    Collects rows into batches and passes each full batch (a list of
+    row tuples) to write_batch. The backends below are BulkWriters
+    with their own write_batch.
+    """
+    default_batch_size = 1000
+
+    def __init__(self, model_class, fields, write_batch, batch_size=None, using='default'):
+        self.model_class = model_class
+        self.fields = [model_class._meta.get_field(name) for name in fields]
+        self.write_batch = write_batch
+        self.batch_size = int(batch_size or self.default_batch_size)
+        self.using = using
+        self.connection = connections[using]
+
+        self.batch = []
+        self.rows_written = 0
+        self.write_time = 0.0
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, rows):
+        self.batch.extend(rows)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+
+        rows = self.batch
+        self.batch = []
+
+        start = time.time()
+        self.write_batch(rows)
+        self.write_time += time.time() - start
+        self.rows_written += len(rows)
+
+        if settings.DEBUG:
+            # prevent memory leaks
+            self.connection.queries = []
+
+    def close(self):
+        self.flush()
+
+    def sync(self):
+        """Write everything so far before returning."""
+        self.flush()
+
+    @property
+    def blocked_time(self):
+        """Time the caller spent waiting on the database."""
+        return self.write_time
+
+    def timing_summary(self, elapsed):
+        return _timing_summary(self, elapsed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.batch = []
+
+
+class OrmBulkWriter(BulkWriter):
+    default_batch_size = 1000
+
+    def __init__(self, model_class, fields, batch_size=None, using='default'):
+        super(OrmBulkWriter, self).__init__(model_class, fields, self._bulk_create,
+                                            batch_size=batch_size, using=using)
+
+    def _bulk_create(self, rows):
+        attnames = [field.attname for field in self.fields]
+        objs = [self.model_class(**dict(zip(attnames, row))) for row in rows]
+        self.model_class.objects.using(self.using).bulk_create(objs)
+
+
+class ExecuteManyBulkWriter(BulkWriter):
+    default_batch_size = 10000
+
+    def __init__(self, model_class, fields, batch_size=None, using='default'):
+        super(ExecuteManyBulkWriter, self).__init__(model_class, fields, self._execute_many,
+                                                    batch_size=batch_size, using=using)
+
+        qn = self.connection.ops.quote_name
+        self.sql = "INSERT INTO %s (%s) VALUES (%s)" % (
+            qn(self.model_class._meta.db_table),
+            ', '.join(qn(field.column) for field in self.fields),
+            ', '.join(['%s'] * len(self.fields)))
+
+    def _execute_many(self, rows):
+        with transaction.atomic(using=self.using):
+            cursor = self.connection.cursor()
+            try:
+                cursor.executemany(self.sql, rows)
+            finally:
+                cursor.close()
+
+
+class MysqlLoadDataBulkWriter(BulkWriter):
+    """
+    Needs local_infile enabled on both the client connection
+    (see DATABASES in settings) and the server.
+    """
+    default_batch_size = 100000
+
+    def __init__(self, model_class, fields, batch_size=None, using='default'):
+        super(MysqlLoadDataBulkWriter, self).__init__(model_class, fields, self._load_data,
+                                                      batch_size=batch_size, using=using)
+
+        qn = self.connection.ops.quote_name
+        charset = self.connection.settings_dict.get('OPTIONS', {}).get('charset', 'utf8')
+        # default field/line terminators: tab, newline, backslash escapes
+        self.sql = "LOAD DATA LOCAL INFILE %%s INTO TABLE %s CHARACTER SET %s (%s)" % (
+            qn(self.model_class._meta.db_table),
+            charset,
+            ', '.join(qn(field.column) for field in self.fields))
+
+    @staticmethod
+    def _format_value(value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, float):
+            return repr(value)
+        if isinstance(value, unicode):
+            value = value.encode('utf-8')
+        elif not isinstance(value, str):
+            return str(value)
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n')
+
+    def _load_data(self, rows):
+        fd, filename = tempfile.mkstemp(suffix='.tsv', prefix='bulk-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                format_value = self._format_value
+                for row in rows:
+                    f.write('\t'.join([format_value(value) for value in row]))
+                    f.write('\n')
+
+            with transaction.atomic(using=self.using):
+                cursor = self.connection.cursor()
+                try:
+                    cursor.execute(self.sql, [filename])
+                finally:
+                    cursor.close()
+        finally:
+            os.remove(filename)
+
+
+class ThreadedBulkWriter(object):
+    """
+    Same interface as BulkWriter, but full batches go into a queue
+    that holds at most max_pending batches, and background threads
+    write them. Each thread has its own database connection.
+
+    When the queue is full, write() blocks until a thread frees a slot.
+    A failed write is re-raised in the caller on its next
+    write/flush/close, and any batches still queued are dropped.
+    """
+
+    def __init__(self, model_class, fields, batch_size=None, backend=None, using='default',
+                 threads=1, max_pending=None):
+        self.model_class = model_class
+        self.field_names = fields
+        self.backend = resolve_backend(backend, using=using)
+        self.using = using
+        self.batch_size = int(batch_size or BULK_WRITERS[self.backend].default_batch_size)
+
+        self.queue = Queue.Queue(maxsize=max_pending or 2 * threads)
+        self.batch = []
+        self.rows_written = 0
+        self.write_time = 0.0
+        self.wait_time = 0.0
+
+        self._lock = threading.Lock()
+        self._error = None
+        self._aborted = False
+
+        self.threads = []
+        for i in range(threads):
+            thread = threading.Thread(target=self._run, name='bulk-writer-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _run(self):
+        writer = None
+        try:
+            while True:
+                rows = self.queue.get()
+                try:
+                    if rows is None:
+                        return
+                    if self._error is not None or self._aborted:
+                        continue
+
+                    if writer is None:
+                        writer = BULK_WRITERS[self.backend](self.model_class, self.field_names,
+                                                            batch_size=self.batch_size, using=self.using)
+                    writer.batch = rows
+                    writer.flush()
+                except Exception:
+                    with self._lock:
+                        if self._error is None:
+                            self._error = sys.exc_info()
+                finally:
+                    self.queue.task_done()
+        finally:
+            if writer is not None:
+                with self._lock:
+                    self.rows_written += writer.rows_written
+                    self.write_time += writer.write_time
+            connections[self.using].close()
+
+    def _check(self):
+        if self._error is not None:
+            from django.utils import six
+            six.reraise(*self._error)
+
+    def _put(self, item):
+        start = time.time()
+        self.queue.put(item)
+        self.wait_time += time.time() - start
+
+    def write(self, row):
+        self.batch.append(row)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def write_many(self, rows):
+        self.batch.extend(rows)
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        self._check()
+        if self.batch:
+            rows = self.batch
+            self.batch = []
+            self._put(rows)
+
+    def _stop(self):
+        for thread in self.threads:
+            self._put(None)
+
+        start = time.time()
+        for thread in self.threads:
+            thread.join()
+        self.wait_time += time.time() - start
+        self.threads = []
+
+    def sync(self):
+        """Wait until every batch so far is written."""
+        self.flush()
+        start = time.time()
+        self.queue.join()
+        self.wait_time += time.time() - start
+        self._check()
+
+    def close(self):
+        self.flush()
+        self._stop()
+        self._check()
+
+    @property
+    def blocked_time(self):
+        return self.wait_time
+
+    def timing_summary(self, elapsed):
+        return _timing_summary(self, elapsed)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.batch = []
+            self._aborted = True
+            self._stop()
+
+
+BULK_WRITERS = {
+    'orm': OrmBulkWriter,
+    'executemany': ExecuteManyBulkWriter,
+    'load_data': MysqlLoadDataBulkWriter,
+}
+
+
+def resolve_backend(backend=None, using='default'):
+    if backend is None:
+        backend = getattr(settings, 'TOPICS_BULK_WRITER', 'auto')
+    if backend == 'auto':
+        if connections[using].vendor == 'mysql':
+            backend = 'load_data'
+        else:
+            backend = 'executemany'
+    return backend
+
+
+def resolve_threads(threads=None, using='default'):
+    if threads is None:
+        threads = getattr(settings, 'TOPICS_WRITER_THREADS', 'auto')
+    if threads == 'auto':
+        # SQLite allows one writer at a time, and the pipeline loops
+        # read from the database while they write
+        if connections[using].vendor == 'sqlite':
+            return 0
+        return 1
+    return int(threads)
+
+
+def get_bulk_writer(model_class, fields, batch_size=None, backend=None, using='default', threads=0):
+    """
+    Get a writer for model_class. Pass threads=None to use the
+    TOPICS_WRITER_THREADS setting, or a number of background threads.
+    """
+    backend = resolve_backend(backend, using=using)
+    try:
+        writer_class = BULK_WRITERS[backend]
+    except KeyError:
+        raise ValueError("Unknown bulk writer backend '%s'" % backend)
+
+    if batch_size is None:
+        batch_size = getattr(settings, 'TOPICS_BULK_BATCH_SIZE', None)
+
+    threads = resolve_threads(threads, using=using)
+    if threads > 0:
+        return ThreadedBulkWriter(model_class, fields, batch_size=batch_size, backend=backend,
+                                  using=using, threads=threads)
+
+    return writer_class(model_class, fields, batch_size=batch_size, using=using)
+
+
+def benchmark(dictionary, num_rows=100000, backends=None, batch_size=None):
+    """
+    Time each backend by copying up to num_rows Word rows from the given
+    dictionary into a scratch dictionary, which is deleted afterwards.
+    Returns a list of (backend, rows, seconds).
+    """
+    from models import Dictionary, Word
+
+    if backends is None:
+        backends = ['orm', 'executemany']
+        if connections['default'].vendor == 'mysql':
+            backends.append('load_data')
+
+    source_rows = list(dictionary.words.values_list('text', 'index', 'document_frequency')[:num_rows])
+    fields = ('dictionary', 'text', 'index', 'document_frequency')
+
+    results = []
+    for backend in backends:
+        scratch = Dictionary.objects.create(name='bulk write benchmark (%s)' % backend,
+                                            dataset=dictionary.dataset,
+                                            settings='')
+        try:
+            start = time.time()
+            with get_bulk_writer(Word, fields, batch_size=batch_size, backend=backend) as writer:
+                for text, index, document_frequency in source_rows:
+                    writer.write((scratch.id, text, index, document_frequency))
+            elapsed = time.time() - start
+
+            results.append((backend, len(source_rows), elapsed))
+            logger.info("%s: wrote %d rows in %.2fs (%.0f rows/s)" % (backend, len(source_rows), elapsed,
+                                                                      len(source_rows) / max(elapsed, 1e-9)))
+        finally:
+            scratch.words.all().delete()
+            scratch.delete()
+
+    return results
@@ -0,0 +1,152 @@
+"""
+Caching of topic pages and query results.
+
+A topic model does not change once its pipeline stages finish, so
+anything computed from it can be cached under a key that contains the
+model id and its version. The pipeline stages bump
+TopicModel.version when they write topics, topic vectors or scores
+(see TopicModel.bump_version), which moves readers to new keys; the old
+entries expire on their own.
+
+Entries go to the 'topics' cache in settings.CACHES. Hits and misses are
+counted in the 'topics_stats' cache, which is kept apart so the counters
+are not culled along with old pages (see stats()). The counts are
+approximate: backends other than memcached do not increment atomically,
+and a per-process cache only counts the requests of its own process.
+"""
+
+import hashlib
+
+from django.conf import settings
+from django.core.cache import caches, InvalidCacheBackendError
+from django.db.models import Count, Max, Sum
+from django.http import HttpResponse
+
+import logging
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'topics'
+STATS_KEYS = ('hits', 'misses')
+
+
+def get_cache():
+    try:
+        return caches['topics']
+    except InvalidCacheBackendError:
+        return caches['default']
+
+
+def get_stats_cache():
+    try:
+        return caches['topics_stats']
+    except InvalidCacheBackendError:
+        return get_cache()
+
+
+def get_timeout():
+    return getattr(settings, 'TOPICS_CACHE_TIMEOUT', 24 * 60 * 60)
+
+
+def model_version(model_id):
+    """The current version of a model, or None if there is no such model."""
+    from models import TopicModel
+    versions = TopicModel.objects.filter(pk=model_id).values_list('version', flat=True)
+    return versions[0] if versions else None
+
+
+def models_version():
+    """A version string for the set of all models."""
+    from models import TopicModel
+    stats = TopicModel.objects.aggregate(count=Count('id'), max_id=Max('id'), versions=Sum('version'))
+    return '%d-%d-%d' % (stats['count'], stats['max_id'] or 0, stats['versions'] or 0)
+
+
+def make_key(model_id, version, *parts):
+    """A cache key for model_id at version. Long parts are hashed."""
+    detail = ':'.join(unicode(part) for part in parts).encode('utf-8')
+    if len(detail) > 100:
+        detail = hashlib.sha1(detail).hexdigest()
+    return '%s:%s:%s:%s' % (KEY_PREFIX, model_id, version, detail)
+
+
+def _count(name):
+    cache = get_stats_cache()
+    key = '%s:stats:%s' % (KEY_PREFIX, name)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # not there yet
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+def get_or_set(key, compute, timeout=None):
+    """The cached value of key, or compute() stored under it."""
+    cache = get_cache()
+    value = cache.get(key)
+    if value is not None:
+        _count('hits')
+        return value
+
+    _count('misses')
+    value = compute()
+    cache.set(key, value, get_timeout() if timeout is None else timeout)
+    return value
+
+
+def stats():
+    """Approximate hit and miss counts; see the module docstring."""
+    cache = get_stats_cache()
+    values = cache.get_many(['%s:stats:%s' % (KEY_PREFIX, name) for name in STATS_KEYS])
+    hits, misses = [values.get('%s:stats:%s' % (KEY_PREFIX, name), 0) for name in STATS_KEYS]
+    total = hits + misses
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': float(hits) / total if total else None,
+    }
+
+
+def reset_stats():
+    get_stats_cache().delete_many(['%s:stats:%s' % (KEY_PREFIX, name) for name in STATS_KEYS])
+
+
+def cache_page(view):
+    """
+    Cache the successful responses of a topic page view by url and
+    model version. Views without a model_id url argument are keyed by
+    the version of the whole list of models.
+    """
+    def cached_view(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view(request, *args, **kwargs)
+
+        model_id = kwargs.get('model_id')
+        if model_id is None:
+            model_id, version = 'all', models_version()
+        else:
+            version = model_version(model_id)
+            if version is None:
+                # let the view raise its 404
+                return view(request, *args, **kwargs)
+
+        key = make_key(model_id, version, 'page', request.get_full_path())
+
+        cache = get_cache()
+        cached = cache.get(key)
+        if cached is not None:
+            _count('hits')
+            content, content_type = cached
+            return HttpResponse(content, content_type=content_type)
+
+        _count('misses')
+        response = view(request, *args, **kwargs)
+        if hasattr(response, 'render') and callable(response.render):
+            response = response.render()
+        if response.status_code == 200:
+            cache.set(key, (response.content, response['Content-Type']), get_timeout())
+        return response
+
+    cached_view.__name__ = view.__name__
+    cached_view.__doc__ = view.__doc__
+    return cached_view
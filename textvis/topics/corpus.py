@@ -0,0 +1,398 @@
+"""
+File-backed bag-of-words corpora.
+
+A SparseCorpusStore keeps a dictionary's word vectors on disk as CSR
+matrices instead of one database row per (document, word).
+Each vectorization run writes one segment directory:
+
+    source_ids.bin  int64    source id of each row, ascending
+    indptr.bin      int64    num_docs + 1 row offsets
+    indices.bin     int32    word index of each posting
+    count.bin       float32  raw term counts
+    tfidf.bin       float32  weighted values
+    segment.json    row and posting counts
+
+Segments are written under a temporary name and renamed when complete.
+All arrays are memory-mapped when read. store.corpus() iterates the
+same way as DbWordVectorIterator, so _build_lda, _apply_lda and
+_evaluate_lda accept either one.
+"""
+
+import json
+import os
+import time
+
+from django.conf import settings
+from path import path
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+ARRAYS = (
+    ('source_ids', 'int64'),
+    ('indptr', 'int64'),
+    ('indices', 'int32'),
+    ('count', 'float32'),
+    ('tfidf', 'float32'),
+)
+
+
+def _load_array(filename, dtype):
+    import numpy
+    if path(filename).size == 0:
+        return numpy.zeros(0, dtype=dtype)
+    return numpy.memmap(filename, dtype=dtype, mode='r')
+
+
+def open_segments(segment_paths, freq_field='tfidf'):
+    """Memory-map segment directories (paths or strings) as one SparseCorpus."""
+    segments = []
+    for segment_path in segment_paths:
+        segment_path = path(segment_path)
+        source_ids, indptr, indices, data = [
+            _load_array(segment_path / ('%s.bin' % name), dict(ARRAYS)[name])
+            for name in ('source_ids', 'indptr', 'indices', freq_field)]
+        segments.append((source_ids, indptr, indices, data))
+    return SparseCorpus(segments)
+
+
+class SparseCorpus(object):
+    """
+    Iterates bows over one or more CSR segments. Each segment is a
+    (source_ids, indptr, indices, data) tuple of arrays.
+    """
+
+    def __init__(self, segments):
+        self.segments = segments
+        self.current_source_id = None
+
+    def __iter__(self):
+        for source_ids, indptr, indices, data in self.segments:
+            for row in xrange(len(source_ids)):
+                start, end = indptr[row], indptr[row + 1]
+                self.current_source_id = int(source_ids[row])
+                yield zip(indices[start:end].tolist(), data[start:end].tolist())
+
+    def __len__(self):
+        return sum(len(segment[0]) for segment in self.segments)
+
+    @property
+    def num_postings(self):
+        return sum(int(segment[1][-1] - segment[1][0]) for segment in self.segments if len(segment[0]))
+
+    def since(self, source_id):
+        """The documents with source ids above source_id, without copying."""
+        import numpy
+
+        segments = []
+        for source_ids, indptr, indices, data in self.segments:
+            first = int(numpy.searchsorted(source_ids, source_id, side='right'))
+            if first < len(source_ids):
+                segments.append((source_ids[first:], indptr[first:], indices, data))
+        return SparseCorpus(segments)
+
+
+class VocabularyLimitedCorpus(object):
+    """Drops word indices at or above num_terms from another corpus."""
+
+    def __init__(self, corpus, num_terms):
+        self.corpus = corpus
+        self.num_terms = num_terms
+
+    @property
+    def current_source_id(self):
+        return self.corpus.current_source_id
+
+    def __iter__(self):
+        num_terms = self.num_terms
+        for bow in self.corpus:
+            yield [(index, value) for index, value in bow if index < num_terms]
+
+    def __len__(self):
+        return len(self.corpus)
+
+
+class SegmentWriter(object):
+    """Appends batches of documents to a new segment."""
+
+    def __init__(self, segment_path):
+        import numpy
+
+        self.path = path(segment_path)
+        self.tmp_path = path(self.path + '.tmp-%d' % os.getpid())
+        self.tmp_path.rmtree_p()
+        self.tmp_path.makedirs()
+
+        self.files = dict((name, open(self.tmp_path / ('%s.bin' % name), 'wb')) for name, dtype in ARRAYS)
+        self.dtypes = dict(ARRAYS)
+        self.num_docs = 0
+        self.num_postings = 0
+        self.max_source_id = None
+
+        numpy.zeros(1, dtype=numpy.int64).tofile(self.files['indptr'])
+
+    def _write(self, name, values):
+        import numpy
+        numpy.asarray(values, dtype=self.dtypes[name]).tofile(self.files[name])
+
+    def append(self, source_ids, lengths, indices, counts, weights):
+        """
+        Add documents, given as flat posting arrays plus postings per document.
+        counts may be None for a segment that only needs weights.
+        """
+        import numpy
+
+        if not len(source_ids):
+            return
+
+        ends = numpy.cumsum(numpy.asarray(lengths, dtype=numpy.int64)) + self.num_postings
+        self._write('source_ids', source_ids)
+        self._write('indptr', ends)
+        self._write('indices', indices)
+        if counts is not None:
+            self._write('count', counts)
+        self._write('tfidf', weights)
+
+        self.num_docs += len(source_ids)
+        self.num_postings = int(ends[-1])
+        self.max_source_id = int(source_ids[-1])
+
+    def close(self):
+        for f in self.files.values():
+            f.close()
+
+        with open(self.tmp_path / 'segment.json', 'w') as f:
+            json.dump(dict(num_docs=self.num_docs,
+                           num_postings=self.num_postings,
+                           max_source_id=self.max_source_id), f)
+
+        self.path.rmtree_p()
+        self.tmp_path.rename(self.path)
+        logger.info("Wrote corpus segment %s (%d documents, %d postings)" % (self.path, self.num_docs, self.num_postings))
+
+    def abort(self):
+        for f in self.files.values():
+            f.close()
+        self.tmp_path.rmtree_p()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SparseCorpusStore(object):
+
+    def __init__(self, dictionary, directory=None):
+        if directory is None:
+            directory = settings.TOPICS_DATA_DIR / 'corpora'
+        self.dictionary = dictionary
+        self.path = path(directory) / ('dictionary_%d' % dictionary.id)
+
+    def segment_paths(self):
+        if not self.path.exists():
+            return []
+        return sorted(d for d in self.path.dirs('segment-*') if '.tmp-' not in d.name)
+
+    def exists(self):
+        return len(self.segment_paths()) > 0
+
+    def max_source_id(self):
+        """Highest source id in any complete segment."""
+        max_source_id = None
+        for segment_path in self.segment_paths():
+            with open(segment_path / 'segment.json') as f:
+                segment_max = json.load(f).get('max_source_id')
+            if segment_max is not None:
+                max_source_id = max(max_source_id, segment_max)
+        return max_source_id
+
+    def new_segment(self):
+        self.path.makedirs_p()
+        return SegmentWriter(self.path / ('segment-%05d' % len(self.segment_paths())))
+
+    def corpus(self, freq_field='tfidf'):
+        return open_segments(self.segment_paths(), freq_field=freq_field)
+
+    def disk_size(self):
+        return sum(f.size for f in self.path.walkfiles()) if self.path.exists() else 0
+
+    def delete(self):
+        self.path.rmtree_p()
+
+    def import_from_db(self, wv_class, batch_size=100000):
+        """Copy a dictionary's word vectors from the database into a new segment."""
+        import numpy
+
+        rows = wv_class.objects.filter(dictionary=self.dictionary)\
+            .order_by('source', 'word_index')\
+            .values_list('source', 'word_index', 'count', 'tfidf')
+
+        def write_rows(writer, batch):
+            # tweet ids do not fit in a float64, so keep them separate
+            sources = numpy.array([row[0] for row in batch], dtype=numpy.int64)
+            values = numpy.array([row[1:] for row in batch], dtype=numpy.float64)
+            starts = numpy.flatnonzero(numpy.r_[True, sources[1:] != sources[:-1]])
+            lengths = numpy.diff(numpy.r_[starts, len(sources)])
+            writer.append(sources[starts], lengths, values[:, 0], values[:, 1], values[:, 2])
+
+        with self.new_segment() as writer:
+            batch = []
+            for row in rows.iterator():
+                # only cut batches between documents
+                if len(batch) >= batch_size and row[0] != batch[-1][0]:
+                    write_rows(writer, batch)
+                    batch = []
+                batch.append(row)
+            if batch:
+                write_rows(writer, batch)
+
+
+class CorpusCache(object):
+    """
+    Reads a bow corpus once and replays it for every later pass.
+
+    Corpora with up to max_memory_postings postings are kept in numpy
+    arrays; larger ones (or ones of unknown size) are written to a
+    temporary segment under TOPICS_DATA_DIR/cache and memory-mapped.
+    Call cleanup() to delete the temporary files.
+    """
+
+    batch_size = 10000
+
+    def __init__(self, source, num_postings=None, max_memory_postings=None, directory=None):
+        if max_memory_postings is None:
+            max_memory_postings = getattr(settings, 'TOPICS_CORPUS_CACHE_MEMORY_POSTINGS', 20000000)
+        if directory is None:
+            directory = settings.TOPICS_DATA_DIR / 'cache'
+
+        self.source = source
+        self.in_memory = num_postings is not None and num_postings <= max_memory_postings
+        self.directory = path(directory)
+        self.tmp_dir = None
+        self.corpus = None
+
+    def _batches(self):
+        """Read the source in batches of flat (source_ids, lengths, indices, data) arrays."""
+        import numpy
+
+        source_ids = []
+        lengths = []
+        postings = []
+
+        def arrays():
+            flat = numpy.array(postings, dtype=numpy.float64).reshape(-1, 2)
+            return (numpy.array(source_ids, dtype=numpy.int64),
+                    numpy.array(lengths, dtype=numpy.int64),
+                    flat[:, 0].astype(numpy.int32),
+                    flat[:, 1].astype(numpy.float32))
+
+        for bow in self.source:
+            source_ids.append(self.source.current_source_id)
+            lengths.append(len(bow))
+            postings.extend(bow)
+
+            if len(source_ids) >= self.batch_size:
+                yield arrays()
+                source_ids, lengths, postings = [], [], []
+
+        if source_ids:
+            yield arrays()
+
+    def materialize(self):
+        import numpy
+        import tempfile
+
+        if self.corpus is not None:
+            return self.corpus
+
+        start = time.time()
+
+        if self.in_memory:
+            logger.info("Caching corpus in memory")
+            parts = list(self._batches())
+            if parts:
+                source_ids, lengths, indices, data = [numpy.concatenate(arrays) for arrays in zip(*parts)]
+            else:
+                source_ids, lengths = numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0, dtype=numpy.int64)
+                indices, data = numpy.zeros(0, dtype=numpy.int32), numpy.zeros(0, dtype=numpy.float32)
+            indptr = numpy.r_[0, numpy.cumsum(lengths)]
+            self.corpus = SparseCorpus([(source_ids, indptr, indices, data)])
+        else:
+            self.directory.makedirs_p()
+            self.tmp_dir = path(tempfile.mkdtemp(prefix='corpus-', dir=self.directory))
+            logger.info("Caching corpus in %s" % self.tmp_dir)
+
+            segment_path = self.tmp_dir / 'segment-00000'
+            with SegmentWriter(segment_path) as writer:
+                for source_ids, lengths, indices, data in self._batches():
+                    writer.append(source_ids, lengths, indices, None, data)
+
+            self.corpus = open_segments([segment_path])
+
+        logger.info("Cached %d documents in %.1fs" % (len(self.corpus), time.time() - start))
+        return self.corpus
+
+    def segment_paths(self):
+        """Where the materialized corpus is on disk, or None if it is in memory."""
+        if self.tmp_dir is None:
+            return None
+        return [self.tmp_dir / 'segment-00000']
+
+    def cleanup(self):
+        self.corpus = None
+        if self.tmp_dir is not None:
+            logger.info("Removing corpus cache %s" % self.tmp_dir)
+            self.tmp_dir.rmtree_p()
+            self.tmp_dir = None
+
+
+def _db_table_size(wv_class):
+    from django.db import connection
+    if connection.vendor != 'mysql':
+        return None
+
+    cursor = connection.cursor()
+    cursor.execute("SELECT data_length + index_length FROM information_schema.tables "
+                   "WHERE table_schema = DATABASE() AND table_name = %s", [wv_class._meta.db_table])
+    row = cursor.fetchone()
+    return int(row[0]) if row else None
+
+
+def benchmark(dictionary, wv_class, lda_topics=10):
+    """
+    Compare the database word-vector table with the sparse store:
+    disk size, one full pass over the corpus, and one LDA training pass.
+    """
+    from gensim.models import LdaModel
+    from tasks import DbWordVectorIterator
+
+    store = SparseCorpusStore(dictionary)
+    if not store.exists():
+        logger.info("Importing word vectors into %s" % store.path)
+        store.import_from_db(wv_class)
+
+    results = []
+    for label, corpus in (('db', DbWordVectorIterator(dictionary, wv_class)),
+                          ('sparse', store.corpus())):
+        start = time.time()
+        num_docs = 0
+        for bow in corpus:
+            num_docs += 1
+        iteration_time = time.time() - start
+
+        start = time.time()
+        LdaModel(corpus=corpus, num_topics=lda_topics, id2word=dictionary.gensim_dictionary, passes=1)
+        lda_time = time.time() - start
+
+        size = _db_table_size(wv_class) if label == 'db' else store.disk_size()
+        results.append((label, num_docs, size, iteration_time, lda_time))
+        logger.info("%s: %d documents, %s bytes, %.1fs per pass, %.1fs per LDA pass" % (
+            label, num_docs, size, iteration_time, lda_time))
+
+    return results
@@ -0,0 +1,195 @@
+"""
+Perplexity evaluation on a sample of documents.
+
+Models can be trained with a held-out split: a document is held out
+when a hash of its source id (salted with a seed) falls below the
+holdout fraction. The split depends only on the source id, so it is the
+same on every run and newly streamed documents split the same way.
+
+Evaluation runs on the held-out documents if the model has a split, and
+otherwise on the whole corpus. Either set can be cut down to a sample of
+about sample_size documents, picked the same way with a second hash.
+
+The sample is cut into chunks and the variational bound of each chunk
+is computed in parallel. The chunk estimates of the per-word bound give
+the overall estimate and a t-based confidence interval. Like
+lda.log_perplexity, results are per-word log bounds; perplexity is
+2 ** -bound.
+"""
+
+from parallel import chunked, ordered_imap, make_pool, resolve_workers
+import inference
+
+import logging
+logger = logging.getLogger(__name__)
+
+_MASK64 = (1 << 64) - 1
+
+
+def unit_hash(source_id, seed=0):
+    """Map a source id to a number in [0, 1) that only depends on source_id and seed."""
+    x = (int(source_id) * 0x9E3779B97F4A7C15 + (seed + 1) * 0xBF58476D1CE4E5B9) & _MASK64
+    x ^= x >> 31
+    x = (x * 0x94D049BB133111EB) & _MASK64
+    x ^= x >> 29
+    return x / float(1 << 64)
+
+
+class SplitCorpus(object):
+    """
+    The training part (or with held_out, the held-out part)
+    of another corpus. gensim checks len() against the documents it
+    reads, so the length is counted exactly, once: from the source id
+    arrays of a SparseCorpus, or else with a pass over the corpus.
+    """
+
+    def __init__(self, corpus, fraction, seed=0, held_out=False):
+        self.corpus = corpus
+        self.fraction = fraction
+        self.seed = seed
+        self.held_out = held_out
+        self._length = None
+
+    @property
+    def current_source_id(self):
+        return self.corpus.current_source_id
+
+    def __iter__(self):
+        corpus = self.corpus
+        fraction, seed, held_out = self.fraction, self.seed, self.held_out
+        for bow in corpus:
+            if (unit_hash(corpus.current_source_id, seed) < fraction) == held_out:
+                yield bow
+
+    def _source_ids(self):
+        segments = getattr(self.corpus, 'segments', None)
+        if segments is not None:
+            for segment in segments:
+                for source_id in segment[0].tolist():
+                    yield source_id
+        else:
+            corpus = self.corpus
+            for bow in corpus:
+                yield corpus.current_source_id
+
+    def __len__(self):
+        if self._length is None:
+            fraction, seed, held_out = self.fraction, self.seed, self.held_out
+            self._length = sum(1 for source_id in self._source_ids()
+                               if (unit_hash(source_id, seed) < fraction) == held_out)
+        return self._length
+
+
+def iter_sample(corpus, sample_size=None, holdout_fraction=0, seed=0):
+    """
+    The documents to evaluate on, and about how many there are.
+    Returns (documents, expected_count).
+
+    A sample takes every document whose hash falls below
+    sample_size / expected_count, so it is spread over the whole corpus
+    and its size is only about sample_size.
+    """
+    if holdout_fraction:
+        documents = SplitCorpus(corpus, holdout_fraction, seed=seed, held_out=True)
+        expected = len(corpus) * holdout_fraction
+    else:
+        documents = corpus
+        expected = len(corpus)
+
+    if not sample_size or sample_size >= expected:
+        return iter(documents), int(round(expected))
+
+    rate = float(sample_size) / expected
+
+    def sampled():
+        for bow in documents:
+            # salted differently from the held-out split
+            if unit_hash(corpus.current_source_id, seed + 1) < rate:
+                yield bow
+
+    return sampled(), sample_size
+
+
+def chunk_bound(lda, chunk, total_docs):
+    """
+    Per-word bound of a chunk, scaled as if it came from a set of
+    total_docs documents (see LdaModel.log_perplexity).
+    Returns (bound, num_words).
+    """
+    num_words = sum(count for document in chunk for _, count in document)
+    if not chunk or not num_words:
+        return None, 0
+
+    subsample_ratio = float(total_docs) / len(chunk)
+    bound = lda.bound(chunk, subsample_ratio=subsample_ratio)
+    return bound / (subsample_ratio * num_words), num_words
+
+
+def _bound_chunk(args):
+    chunk, total_docs = args
+    return chunk_bound(inference.worker_model(), chunk, total_docs)
+
+
+def _t_quantile(confidence, dof):
+    from scipy import stats
+    return stats.t.ppf(0.5 + confidence / 2.0, dof)
+
+
+def evaluate_perplexity(lda, model_path, documents, total_docs, workers=1, chunk_size=2000,
+                        confidence=0.95):
+    """
+    Per-word bound over documents, with a confidence interval from the
+    spread of the chunk estimates. model_path is where lda is saved, for
+    the worker processes.
+
+    Returns a dict with bound, lower, upper, num_docs and num_words.
+    lower and upper are None with fewer than two chunks.
+    """
+    import numpy
+
+    workers = resolve_workers(workers)
+    total_docs = max(total_docs, 1)
+
+    bounds = []
+    weights = []
+    num_docs = [0]
+
+    def chunks():
+        for chunk in chunked(documents, chunk_size):
+            num_docs[0] += len(chunk)
+            yield chunk, total_docs
+
+    def collect(results):
+        for bound, num_words in results:
+            if num_words:
+                bounds.append(bound)
+                weights.append(num_words)
+
+    if workers <= 1:
+        collect(chunk_bound(lda, chunk, total) for chunk, total in chunks())
+    else:
+        logger.info("Evaluating with %d worker processes" % workers)
+        pool = make_pool(workers,
+                         initializer=inference.init_worker_model,
+                         initargs=(model_path, type(lda)))
+        try:
+            collect(ordered_imap(pool, _bound_chunk, chunks(), max_pending=2 * workers))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+
+    result = dict(bound=None, lower=None, upper=None,
+                  num_docs=num_docs[0], num_words=float(sum(weights)))
+    if not bounds:
+        return result
+
+    bounds = numpy.array(bounds)
+    result['bound'] = float(numpy.average(bounds, weights=weights))
+
+    if len(bounds) > 1:
+        margin = _t_quantile(confidence, len(bounds) - 1) * bounds.std(ddof=1) / numpy.sqrt(len(bounds))
+        result['lower'] = result['bound'] - float(margin)
+        result['upper'] = result['bound'] + float(margin)
+
+    return result
@@ -0,0 +1,65 @@
+"""
+Top example documents for topics, collected during topic inference.
+
+ExampleIndex keeps a bounded min-heap of (probability, source_id) for
+each topic, and for each (topic, word) pair where the word is one of
+the topic's saved TopicWords and occurs in the document. The heaps are
+saved as TopicExample rows, so the topic pages look examples up by
+topic (and word) instead of sorting the whole topic vector table.
+"""
+
+import heapq
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class ExampleIndex(object):
+
+    def __init__(self, topic_words, examples_per_topic=100, examples_per_word=20):
+        """
+        topic_words maps each topic index to a {word_index: word_id}
+        dict of the words to keep examples for.
+        """
+        self.topic_words = topic_words
+        self.examples_per_topic = examples_per_topic
+        self.examples_per_word = examples_per_word
+
+        self.topic_heaps = {}
+        self.word_heaps = {}
+
+    @staticmethod
+    def _push(heaps, key, size, item):
+        heap = heaps.get(key)
+        if heap is None:
+            heaps[key] = [item]
+        elif len(heap) < size:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+
+    def add(self, source_id, bow, mixture):
+        push = self._push
+        for topic_index, prob in mixture:
+            item = (prob, source_id)
+            push(self.topic_heaps, topic_index, self.examples_per_topic, item)
+
+            words = self.topic_words.get(topic_index)
+            if words:
+                for word_index, _ in bow:
+                    if word_index in words:
+                        push(self.word_heaps, (topic_index, word_index), self.examples_per_word, item)
+
+    def rows(self, topic_ids):
+        """
+        (topic_id, word_id, source_id, probability, rank) rows, best
+        first. topic_ids maps topic indices to Topic ids.
+        """
+        for topic_index, heap in self.topic_heaps.iteritems():
+            for rank, (prob, source_id) in enumerate(sorted(heap, reverse=True)):
+                yield (topic_ids[topic_index], None, source_id, prob, rank)
+
+        for (topic_index, word_index), heap in self.word_heaps.iteritems():
+            word_id = self.topic_words[topic_index][word_index]
+            for rank, (prob, source_id) in enumerate(sorted(heap, reverse=True)):
+                yield (topic_ids[topic_index], word_id, source_id, prob, rank)
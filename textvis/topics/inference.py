@@ -0,0 +1,85 @@
+"""
+Batched topic inference.
+
+Documents are grouped into chunks and each chunk goes through a single
+lda.inference call. With workers > 1 the chunks are spread over a
+process pool, where each worker loads the saved model once with
+mmap='r', so the large arrays are shared pages and are never pickled.
+
+gensim starts inference from a random gamma, so mixtures agree with
+lda[bow] to within the convergence tolerance, not bit for bit.
+"""
+
+from parallel import chunked, ordered_imap, make_pool, resolve_workers
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def infer_topics(lda, bows, eps=0.01):
+    """
+    Topic mixtures for a list of bows: the same (topic, probability)
+    lists as lda[bow], leaving out topics below eps.
+    """
+    import numpy
+
+    if not bows:
+        return []
+
+    gamma, _ = lda.inference(bows)
+    theta = gamma / gamma.sum(axis=1)[:, numpy.newaxis]
+
+    mixtures = []
+    for row in theta:
+        topics = numpy.flatnonzero(row >= eps)
+        mixtures.append(zip(topics.tolist(), row[topics].tolist()))
+    return mixtures
+
+
+_worker_lda = None
+def init_worker_model(model_path, model_class):
+    """Pool initializer: load the saved model once per worker process."""
+    global _worker_lda
+    _worker_lda = model_class.load(model_path, mmap='r')
+
+def worker_model():
+    return _worker_lda
+
+def _infer_chunk(chunk):
+    return infer_topics(_worker_lda, [bow for source_id, bow in chunk])
+
+
+def iter_topic_mixtures(lda, model_path, corpus, workers=1, chunk_size=2000):
+    """
+    Yield (source_id, bow, mixture) for every document in corpus, in order.
+    model_path is where lda is saved, for the worker processes.
+    """
+    workers = resolve_workers(workers)
+
+    def documents():
+        for bow in corpus:
+            yield corpus.current_source_id, bow
+
+    if workers <= 1:
+        for chunk in chunked(documents(), chunk_size):
+            mixtures = infer_topics(lda, [bow for source_id, bow in chunk])
+            for (source_id, bow), mixture in zip(chunk, mixtures):
+                yield source_id, bow, mixture
+        return
+
+    logger.info("Inferring topics with %d worker processes" % workers)
+
+    # fork before the corpus starts reading from the database
+    pool = make_pool(workers,
+                     initializer=init_worker_model,
+                     initargs=(model_path, type(lda)))
+    try:
+        chunks = chunked(documents(), chunk_size)
+        for chunk, mixtures in ordered_imap(pool, _infer_chunk, chunks,
+                                            max_pending=2 * workers, with_chunks=True):
+            for (source_id, bow), mixture in zip(chunk, mixtures):
+                yield source_id, bow, mixture
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
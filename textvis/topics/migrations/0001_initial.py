@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+from django.conf import settings
+import twitter_stream.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('textprizm', '0001_initial'),
+        migrations.swappable_dependency(settings.TWITTER_STREAM_TWEET_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Dictionary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(max_length=100)),
+                ('dataset', models.CharField(max_length=100)),
+                ('settings', models.TextField()),
+                ('time', models.DateTimeField(auto_now_add=True)),
+                ('num_docs', twitter_stream.fields.PositiveBigIntegerField(default=0)),
+                ('num_pos', twitter_stream.fields.PositiveBigIntegerField(default=0)),
+                ('num_nnz', twitter_stream.fields.PositiveBigIntegerField(default=0)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='TextPrizmTopic',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('probability', models.FloatField()),
+                ('source', models.ForeignKey(to='textprizm.Message')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='TextPrizmWord',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('word_index', models.IntegerField()),
+                ('count', models.FloatField()),
+                ('tfidf', models.FloatField()),
+                ('dictionary', models.ForeignKey(to='topics.Dictionary', db_index=False)),
+                ('source', models.ForeignKey(related_name='words', to='textprizm.Message')),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='Topic',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(max_length=100)),
+                ('description', models.CharField(max_length=200)),
+                ('index', models.IntegerField()),
+                ('alpha', models.FloatField()),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='TopicModel',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(max_length=100)),
+                ('description', models.CharField(max_length=200)),
+                ('time', models.DateTimeField(auto_now_add=True)),
+                ('perplexity', models.FloatField(default=0)),
+                ('dictionary', models.ForeignKey(to='topics.Dictionary')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='TopicWord',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('word_index', models.IntegerField()),
+                ('probability', models.FloatField()),
+                ('topic', models.ForeignKey(related_name='words', to='topics.Topic')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='TweetTopic',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('probability', models.FloatField()),
+                ('source', twitter_stream.fields.PositiveBigAutoForeignKey(to=settings.TWITTER_STREAM_TWEET_MODEL)),
+                ('topic', models.ForeignKey(to='topics.Topic')),
+                ('topic_model', models.ForeignKey(to='topics.TopicModel', db_index=False)),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='TweetWord',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('word_index', models.IntegerField()),
+                ('count', models.FloatField()),
+                ('tfidf', models.FloatField()),
+                ('dictionary', models.ForeignKey(to='topics.Dictionary', db_index=False)),
+                ('source', twitter_stream.fields.PositiveBigAutoForeignKey(related_name='words', to=settings.TWITTER_STREAM_TWEET_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='Word',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('index', models.IntegerField()),
+                ('text', models.CharField(max_length=100)),
+                ('document_frequency', models.IntegerField()),
+                ('dictionary', models.ForeignKey(related_name='words', to='topics.Dictionary')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AddField(
+            model_name='tweetword',
+            name='word',
+            field=models.ForeignKey(to='topics.Word'),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='tweetword',
+            index_together=set([('dictionary', 'source')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='tweettopic',
+            index_together=set([('topic_model', 'source')]),
+        ),
+        migrations.AddField(
+            model_name='topicword',
+            name='word',
+            field=models.ForeignKey(to='topics.Word'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='model',
+            field=models.ForeignKey(related_name='topics', to='topics.TopicModel'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='textprizmword',
+            name='word',
+            field=models.ForeignKey(to='topics.Word'),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='textprizmword',
+            index_together=set([('dictionary', 'source')]),
+        ),
+        migrations.AddField(
+            model_name='textprizmtopic',
+            name='topic',
+            field=models.ForeignKey(to='topics.Topic'),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='textprizmtopic',
+            name='topic_model',
+            field=models.ForeignKey(to='topics.TopicModel', db_index=False),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='textprizmtopic',
+            index_together=set([('topic_model', 'source')]),
+        ),
+    ]
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+import twitter_stream.fields
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('topics', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicExample',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('source_id', twitter_stream.fields.PositiveBigIntegerField()),
+                ('probability', models.FloatField()),
+                ('rank', models.IntegerField()),
+                ('topic', models.ForeignKey(related_name='examples', to='topics.Topic')),
+                ('word', models.ForeignKey(related_name='+', default=None, to='topics.Word', null=True)),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.CreateModel(
+            name='TopicWordGrid',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('data', models.BinaryField()),
+                ('model', models.OneToOneField(related_name='word_grid', to='topics.TopicModel')),
+            ],
+            options={
+            },
+            bases=(models.Model,),
+        ),
+        migrations.AlterIndexTogether(
+            name='topicexample',
+            index_together=set([('topic', 'word', 'probability', 'source_id'), ('topic', 'word', 'rank')]),
+        ),
+        migrations.AddField(
+            model_name='dictionary',
+            name='bows_watermark',
+            field=twitter_stream.fields.PositiveBigIntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='dictionary',
+            name='corpus_max_source_id',
+            field=twitter_stream.fields.PositiveBigIntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='dictionary',
+            name='corpus_min_source_id',
+            field=twitter_stream.fields.PositiveBigIntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='dictionary',
+            name='corpus_num_docs',
+            field=twitter_stream.fields.PositiveBigIntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='dictionary',
+            name='corpus_num_postings',
+            field=twitter_stream.fields.PositiveBigIntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='dictionary',
+            name='source_watermark',
+            field=twitter_stream.fields.PositiveBigIntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='document_count',
+            field=models.IntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='prevalence',
+            field=models.FloatField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='eval_confidence',
+            field=models.FloatField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='eval_documents',
+            field=models.IntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='eval_sample_size',
+            field=models.IntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='examples_indexed',
+            field=models.BooleanField(default=False),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='holdout_fraction',
+            field=models.FloatField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='holdout_seed',
+            field=models.IntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='parent',
+            field=models.ForeignKey(related_name='versions', blank=True, to='topics.TopicModel', null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='perplexity_lower',
+            field=models.FloatField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='perplexity_upper',
+            field=models.FloatField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='source_watermark',
+            field=twitter_stream.fields.PositiveBigIntegerField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='training_config',
+            field=models.TextField(default=b'', blank=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='training_time',
+            field=models.FloatField(default=None, null=True),
+            preserve_default=True,
+        ),
+        migrations.AddField(
+            model_name='topicmodel',
+            name='version',
+            field=models.PositiveIntegerField(default=0),
+            preserve_default=True,
+        ),
+        migrations.AlterIndexTogether(
+            name='textprizmtopic',
+            index_together=set([('topic_model', 'source'), ('topic', 'probability', 'source')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='tweettopic',
+            index_together=set([('topic_model', 'source'), ('topic', 'probability', 'source')]),
+        ),
+    ]
@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import models, connection, transaction
 from django.conf import settings
 from django.apps import apps as django_apps
 
 from twitter_stream.fields import PositiveBigAutoForeignKey, PositiveBigIntegerField
 
+from collections import namedtuple
+import time
+
 # import the logging library
 import logging
 
@@ -22,26 +25,133 @@ class Dictionary(models.Model):
     num_pos = PositiveBigIntegerField(default=0)
     num_nnz = PositiveBigIntegerField(default=0)
 
+    # Statistics of the vectorized corpus (documents with at least one word).
+    # Maintained by _vectorize_corpus; None means unknown.
+    corpus_num_docs = PositiveBigIntegerField(null=True, default=None)
+    corpus_num_postings = PositiveBigIntegerField(null=True, default=None)
+    corpus_min_source_id = PositiveBigIntegerField(null=True, default=None)
+    corpus_max_source_id = PositiveBigIntegerField(null=True, default=None)
+
+    # Highest source id whose text has been counted in the dictionary
+    source_watermark = PositiveBigIntegerField(null=True, default=None)
+    # Highest source id that _vectorize_corpus has processed
+    bows_watermark = PositiveBigIntegerField(null=True, default=None)
+
+    # Bump when the layout of the cached dictionary file changes
+    CACHE_VERSION = 3
+
     @property
     def gensim_dictionary(self):
         if not hasattr(self, '_gensim_dict'):
-            setattr(self, '_gensim_dict', self._make_gensim_dictionary())
+            gensim_dict = self._load_cached_gensim_dictionary()
+            if gensim_dict is None:
+                gensim_dict = self._make_gensim_dictionary()
+                if not hasattr(self, '_pruned_dfs'):
+                    setattr(self, '_pruned_dfs', None)
+                self._save_cached_gensim_dictionary(gensim_dict)
+            setattr(self, '_gensim_dict', gensim_dict)
         return getattr(self, '_gensim_dict')
 
-    def get_word_id(self, bow_index):
+    @property
+    def index2id(self):
+        """
+        Array mapping bow index to Word id, -1 where there is no word.
+        Gensim indices are compact, so this is much smaller than a dict.
+        """
         if not hasattr(self, '_index2id'):
             g = self.gensim_dictionary
+        return self._index2id
+
+    @property
+    def pruned_dfs(self):
+        """
+        Document frequencies of the tokens left out of the dictionary,
+        by token. None if they are unknown, which happens when the
+        cached dictionary had to be rebuilt from the database.
+        """
+        if not hasattr(self, '_gensim_dict'):
+            g = self.gensim_dictionary
+        return self._pruned_dfs
+
+    def get_word_id(self, bow_index):
+        index2id = self.index2id
+        if 0 <= bow_index < len(index2id):
+            word_id = index2id[bow_index]
+            if word_id >= 0:
+                return int(word_id)
+        return None
+
+    def get_word_ids(self, bow_indices):
+        """Vectorized get_word_id. Unknown indices map to -1."""
+        import numpy
+
+        index2id = self.index2id
+        bow_indices = numpy.asarray(bow_indices, dtype=numpy.int64)
+        valid = (bow_indices >= 0) & (bow_indices < len(index2id))
+
+        word_ids = numpy.empty(len(bow_indices), dtype=numpy.int64)
+        word_ids.fill(-1)
+        word_ids[valid] = index2id[bow_indices[valid]]
+        return word_ids
+
+    def _cache_path(self):
+        return settings.TOPICS_DATA_DIR / 'dictionaries' / ('dictionary_%d.pickle' % self.id)
+
+    def _cache_header(self):
+        """Identifies the database state a cached dictionary was built from."""
+        from spool import settings_fingerprint
+        return dict(version=self.CACHE_VERSION,
+                    settings=settings_fingerprint(self.settings),
+                    num_docs=self.num_docs,
+                    num_pos=self.num_pos,
+                    num_nnz=self.num_nnz,
+                    num_words=self.words.count())
+
+    def _load_cached_gensim_dictionary(self):
+        import cPickle as pickle
+
+        cache_path = self._cache_path()
+        if not cache_path.exists():
+            return None
+
         try:
-            return self._index2id[bow_index]
-        except KeyError:
+            with open(cache_path, 'rb') as f:
+                header = pickle.load(f)
+                if header != self._cache_header():
+                    logger.info("Cached dictionary %s is out of date" % cache_path)
+                    return None
+                gensim_dict, index2id, pruned_dfs = pickle.load(f)
+        except (IOError, EOFError, pickle.UnpicklingError) as e:
+            logger.warn("Could not read cached dictionary %s: %s" % (cache_path, e))
             return None
 
+        logger.info("Loaded gensim dictionary from %s" % cache_path)
+        setattr(self, '_index2id', index2id)
+        setattr(self, '_pruned_dfs', pruned_dfs)
+        return gensim_dict
+
+    def _save_cached_gensim_dictionary(self, gensim_dict):
+        import cPickle as pickle
+        import os
+
+        cache_path = self._cache_path()
+        cache_path.parent.makedirs_p()
+
+        # write then rename, so readers never see a partial file
+        tmp_path = cache_path + '.tmp-%d' % os.getpid()
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self._cache_header(), f, pickle.HIGHEST_PROTOCOL)
+            pickle.dump((gensim_dict, self._index2id, getattr(self, '_pruned_dfs', None)),
+                        f, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_path, cache_path)
+
+        logger.info("Saved gensim dictionary to %s" % cache_path)
+
     def _make_gensim_dictionary(self):
 
         logger.info("Building gensim dictionary from database")
 
-        setattr(self, '_index2id', {})
-
+        import numpy
         from gensim import corpora
 
         gensim_dict = corpora.Dictionary()
@@ -49,10 +159,21 @@ class Dictionary(models.Model):
         gensim_dict.num_pos = self.num_pos
         gensim_dict.num_nnz = self.num_nnz
 
-        for word in self.words.all():
-            self._index2id[word.index] = word.id
-            gensim_dict.token2id[word.text] = word.index
-            gensim_dict.dfs[word.index] = word.document_frequency
+        indices = []
+        word_ids = []
+
+        # plain tuples; building a Word instance per row is slow
+        words = self.words.values_list('id', 'index', 'text', 'document_frequency')
+        for word_id, index, text, document_frequency in words.iterator():
+            indices.append(index)
+            word_ids.append(word_id)
+            gensim_dict.token2id[text] = index
+            gensim_dict.dfs[index] = document_frequency
+
+        index2id = numpy.empty(max(indices) + 1 if indices else 0, dtype=numpy.int64)
+        index2id.fill(-1)
+        index2id[indices] = word_ids
+        setattr(self, '_index2id', index2id)
 
         logger.info("Dictionary contains %d words" % len(gensim_dict.token2id))
 
@@ -67,38 +188,22 @@ class Dictionary(models.Model):
 
         logger.info("Saving gensim dictionary '%s' in the database" % self.name)
 
-        batch = []
+        from bulk import get_bulk_writer
+
         count = 0
         print_freq = 10000
-        batch_size = 1000
         total_words = len(gensim_dict.token2id)
 
-        for token, id in gensim_dict.token2id.iteritems():
-            word = Word(dictionary=self,
-                        text=token,
-                        index=id,
-                        document_frequency=gensim_dict.dfs[id])
-            batch.append(word)
-            count += 1
-
-            if len(batch) > batch_size:
-                Word.objects.bulk_create(batch)
-                batch = []
-
-                if settings.DEBUG:
-                    # prevent memory leaks
-                    from django.db import connection
-
-                    connection.queries = []
+        fields = ('dictionary', 'text', 'index', 'document_frequency')
+        with get_bulk_writer(Word, fields) as writer:
+            for token, id in gensim_dict.token2id.iteritems():
+                writer.write((self.id, token, id, gensim_dict.dfs[id]))
+                count += 1
 
-            if count % print_freq == 0:
-                logger.info("Saved %d / %d words in the database dictionary" % (count, total_words))
+                if count % print_freq == 0:
+                    logger.info("Saved %d / %d words in the database dictionary" % (count, total_words))
 
-        if len(batch):
-            Word.objects.bulk_create(batch)
-            count += len(batch)
-
-            logger.info("Saved %d / %d words in the database dictionary" % (count, total_words))
+        logger.info("Saved %d / %d words in the database dictionary" % (count, total_words))
 
         return self
 
@@ -112,10 +217,16 @@ class Dictionary(models.Model):
 
         # Remove extremely rare words
         logger.info("Dictionary contains %d words. Filtering..." % len(dictionary.token2id))
+        all_dfs = dict((token, dictionary.dfs[index]) for token, index in dictionary.token2id.iteritems())
         dictionary.filter_extremes(no_below=minimum_frequency, no_above=0.5, keep_n=None)
         dictionary.compactify()
         logger.info("Dictionary contains %d words." % len(dictionary.token2id))
 
+        # kept so that _update_from_texts can tell when a pruned word qualifies
+        pruned_dfs = dict((token, df) for token, df in all_dfs.iteritems()
+                          if token not in dictionary.token2id)
+        del all_dfs
+
         dict_model = cls(name=name,
                          dataset=dataset,
                          settings=settings)
@@ -123,156 +234,575 @@ class Dictionary(models.Model):
 
         dict_model._populate_from_gensim_dictionary(dictionary)
 
-        return dict_model
-
-    def _vectorize_corpus(self, queryset, tokenizer, wv_class, textfield='text'):
+        # writes the cached dictionary, with the pruned document frequencies
+        setattr(dict_model, '_pruned_dfs', pruned_dfs)
+        dict_model.gensim_dictionary
 
-        import math
+        return dict_model
 
-        logger.info("Saving document word vectors in corpus.")
+    def _update_from_texts(self, tokenized_items, minimum_frequency=2, no_above=0.5, reprune=False):
+        """
+        Add (source_id, words) pairs for documents newer than source_watermark.
+
+        Document frequencies and counts are updated in place. Unknown words
+        are added, after the current highest index so existing word vectors
+        stay valid, once their document frequency over all documents so far
+        is within the limits used when the dictionary was built. With
+        reprune, known words now outside those limits are deleted
+        (see _reprune).
+        """
+        import numpy
+        from django.db import transaction
+        from bulk import get_bulk_writer
 
-        total_documents = self.num_docs
         gdict = self.gensim_dictionary
+        token2id = gdict.token2id
+        dfs = gdict.dfs
+
+        pruned_dfs = self.pruned_dfs
+        if pruned_dfs is None:
+            logger.warn("Document frequencies of pruned words are unknown, "
+                        "so only new documents count towards adding them")
+            pruned_dfs = {}
+            setattr(self, '_pruned_dfs', pruned_dfs)
+
+        old_dfs = {}
+        new_dfs = {}
+        watermark = self.source_watermark
+        num_new_docs = 0
+
+        for source_id, words in tokenized_items:
+            unique_words = set(words)
+            for word in unique_words:
+                index = token2id.get(word)
+                if index is None:
+                    new_dfs[word] = new_dfs.get(word, 0) + 1
+                else:
+                    if index not in old_dfs:
+                        old_dfs[index] = dfs[index]
+                    dfs[index] += 1
+
+            gdict.num_docs += 1
+            gdict.num_pos += len(words)
+            gdict.num_nnz += len(unique_words)
+            num_new_docs += 1
+            watermark = source_id
+
+        # never reuse the index of a pruned word
+        first_new_index = max(max(token2id.itervalues()) + 1 if token2id else 0, len(self.index2id))
+        next_index = first_new_index
+        max_df = no_above * gdict.num_docs
+        for word in sorted(new_dfs):
+            df = pruned_dfs.pop(word, 0) + new_dfs[word]
+            if minimum_frequency <= df <= max_df:
+                token2id[word] = next_index
+                dfs[next_index] = df
+                next_index += 1
+            else:
+                pruned_dfs[word] = df
+        del new_dfs
+
+        logger.info("Adding %d documents: %d new words, %d words with new counts" % (
+            num_new_docs, next_index - first_new_index, len(old_dfs)))
+
+        repruned = False
+        with transaction.atomic():
+            fields = ('dictionary', 'text', 'index', 'document_frequency')
+            with get_bulk_writer(Word, fields) as writer:
+                for token, index in token2id.iteritems():
+                    if index >= first_new_index:
+                        writer.write((self.id, token, index, dfs[index]))
+
+            index2id = self.index2id
+            cursor = connection.cursor()
+            cursor.executemany("UPDATE %s SET document_frequency = %%s WHERE id = %%s" %
+                               connection.ops.quote_name(Word._meta.db_table),
+                               [(dfs[index], int(index2id[index])) for index in old_dfs])
+
+            index2id = numpy.concatenate([index2id, numpy.empty(next_index - len(index2id), dtype=numpy.int64)])
+            index2id[first_new_index:] = -1
+            new_words = self.words.filter(index__gte=first_new_index).values_list('index', 'id')
+            for index, word_id in new_words.iterator():
+                index2id[index] = word_id
+            setattr(self, '_index2id', index2id)
+
+            if reprune:
+                repruned = self._reprune(minimum_frequency, no_above=no_above)
+
+            self.num_docs = gdict.num_docs
+            self.num_pos = gdict.num_pos
+            self.num_nnz = gdict.num_nnz
+            self.source_watermark = watermark
+            self.save()
+
+        if repruned:
+            from corpus import SparseCorpusStore
+            store = SparseCorpusStore(self)
+            if store.exists():
+                # the segments still contain the deleted words; build_bows starts over
+                logger.info("Deleting corpus segments in %s" % store.path)
+                store.delete()
+
+        gdict.id2token = {}
+        self._save_cached_gensim_dictionary(gdict)
+
+        return num_new_docs
+
+    def _reprune(self, minimum_frequency, no_above=0.5):
+        """
+        Delete the words outside the given limits, with their word vectors.
+        Words in the topics of saved models are kept, so the models,
+        their word grids and examples stay valid. Returns True if any
+        word was deleted; the corpus statistics and bows watermark are
+        then reset, because the stored corpus has changed.
+        """
+        gdict = self.gensim_dictionary
+        max_df = no_above * gdict.num_docs
+        bad_indices = set(index for index, df in gdict.dfs.iteritems()
+                          if df < minimum_frequency or df > max_df)
+        if not bad_indices:
+            return False
+
+        used_indices = set(TopicWord.objects.filter(word__dictionary=self)
+                           .values_list('word__index', flat=True).distinct())
+        if bad_indices & used_indices:
+            logger.info("Keeping %d words used by saved topic models" % len(bad_indices & used_indices))
+        bad_indices = sorted(bad_indices - used_indices)
+        if not bad_indices:
+            return False
+
+        logger.info("Re-pruning %d words from the dictionary" % len(bad_indices))
+
+        # Plain deletes: the ORM would first collect every related row.
+        word_ids = [int(self._index2id[index]) for index in bad_indices if self._index2id[index] >= 0]
+        quote_name = connection.ops.quote_name
+        tables = [(wv_class._meta.db_table, 'word_id') for wv_class in django_apps.get_models()
+                  if issubclass(wv_class, AbstractWordVector)]
+        tables.append((Word._meta.db_table, 'id'))
+
+        cursor = connection.cursor()
+        for start in range(0, len(word_ids), 500):
+            batch = word_ids[start:start + 500]
+            for table, column in tables:
+                cursor.execute("DELETE FROM %s WHERE %s IN (%s)" % (
+                    quote_name(table), quote_name(column), ', '.join(['%s'] * len(batch))), batch)
+
+        id2token = dict((index, token) for token, index in gdict.token2id.iteritems())
+        for index in bad_indices:
+            token = id2token[index]
+            self._pruned_dfs[token] = gdict.dfs.pop(index)
+            del gdict.token2id[token]
+        self._index2id[bad_indices] = -1
+
+        self.bows_watermark = None
+        self._set_corpus_stats(None, None, None, None)
+        return True
+
+    CORPUS_STATS_FIELDS = ('corpus_num_docs', 'corpus_num_postings',
+                           'corpus_min_source_id', 'corpus_max_source_id',
+                           'bows_watermark')
+
+    def _set_corpus_stats(self, num_docs, num_postings, min_source_id, max_source_id):
+        self.corpus_num_docs = num_docs
+        self.corpus_num_postings = num_postings
+        self.corpus_min_source_id = min_source_id
+        self.corpus_max_source_id = max_source_id
+        self.save(update_fields=self.CORPUS_STATS_FIELDS)
+
+    def _refresh_corpus_stats(self, wv_class=None, corpus_store=None):
+        """Recompute the corpus statistics from the stored word vectors."""
+        if corpus_store is not None:
+            corpus = corpus_store.corpus()
+            source_ids = [segment[0] for segment in corpus.segments if len(segment[0])]
+            self._set_corpus_stats(len(corpus), corpus.num_postings,
+                                   int(source_ids[0][0]) if source_ids else None,
+                                   int(source_ids[-1][-1]) if source_ids else None)
+        else:
+            from django.db.models import Count, Min, Max
+            stats = wv_class.objects.filter(dictionary=self).aggregate(
+                num_docs=Count('source', distinct=True), num_postings=Count('id'),
+                min_source_id=Min('source'), max_source_id=Max('source'))
+            self._set_corpus_stats(stats['num_docs'], stats['num_postings'],
+                                   stats['min_source_id'], stats['max_source_id'])
+
+        logger.info("Corpus for dictionary %d has %d documents and %d word vectors" % (
+            self.id, self.corpus_num_docs, self.corpus_num_postings))
+
+    def _vectorize_corpus(self, bows, wv_class, total_count, weighting=None, batch_size=1000,
+                          corpus_store=None, export_db=True, append=False, checkpoint_every=100000):
+        """
+        Save word vectors for a stream of (source_id, bow) pairs.
+        Weights are computed batch_size documents at a time;
+        see weighting.py for the available schemes.
+
+        The vectors go to a new segment of corpus_store if given (created
+        with the first document), and to the wv_class table unless
+        export_db is False.
+
+        The corpus statistics are reset, or added to if append is True,
+        and bows_watermark moves to the last source id in bows. Without a
+        corpus_store, bows_watermark is also saved every checkpoint_every
+        documents, once the word vectors up to it are committed, so an
+        interrupted run can resume from there (see TaskContext._recover_bows).
+        A new run with writer threads starts from a bows_watermark of 0,
+        as nothing is committed in source order until its first checkpoint.
+        """
+
+        from bulk import get_bulk_writer, resolve_threads
+        from weighting import TermWeighting, DEFAULT_SCHEME
+
+        weighting = weighting or DEFAULT_SCHEME
+
+        logger.info("Saving document word vectors in corpus (%s weighting)." % weighting)
+
+        term_weighting = TermWeighting(weighting, self.gensim_dictionary.dfs, self.num_docs)
         count = 0
-        total_count = queryset.count()
-        batch = []
-        batch_size = 1000
         print_freq = 10000
 
-        for obj in queryset.iterator():
-            text = getattr(obj, textfield)
-            bow = gdict.doc2bow(tokenizer.tokenize(text))
-
-            for word_index, word_freq in bow:
-                word_id = self.get_word_id(word_index)
-                document_freq = gdict.dfs[word_index]
-                tfidf = word_freq * math.log(total_documents, document_freq)
-                batch.append(wv_class.create(dictionary=self,
-                                             word_id=word_id,
-                                             word_index=word_index,
-                                             count=word_freq,
-                                             tfidf=tfidf,
-                                             source_obj=obj))
-            count += 1
+        if append and self.corpus_num_docs is not None:
+            stats = [self.corpus_num_docs, self.corpus_num_postings,
+                     self.corpus_min_source_id, self.corpus_max_source_id]
+        else:
+            stats = [0, 0, None, None]
 
-            if len(batch) > batch_size:
-                wv_class.objects.bulk_create(batch)
-                batch = []
+        if not append and export_db and corpus_store is None:
+            self.bows_watermark = 0 if resolve_threads() > 0 else None
 
-                if settings.DEBUG:
-                    # prevent memory leaks
-                    from django.db import connection
+        # unknown until the run completes, in case it is interrupted
+        self._set_corpus_stats(None, None, None, None)
 
-                    connection.queries = []
+        start = time.time()
 
-            if count % print_freq == 0:
-                logger.info("Saved word-vectors for %d / %d documents" % (count, total_count))
+        writer = get_bulk_writer(wv_class, wv_class.bulk_fields, threads=None) if export_db else None
+        segment = None
+        checkpoint_count = 0
 
-        if len(batch):
-            wv_class.objects.bulk_create(batch)
-            logger.info("Saved word-vectors for %d / %d documents" % (count, total_count))
-
-        logger.info("Created %d word vector entries" % count)
-
-
-    def _build_lda(self, name, corpus, num_topics=30, words_to_save=200):
+        try:
+            source_ids = []
+            batch = []
+            last_source_id = None
+            for source_id, bow in bows:
+                source_ids.append(source_id)
+                batch.append(bow)
+                count += 1
+                last_source_id = source_id
+
+                if len(batch) >= batch_size:
+                    if segment is None and corpus_store is not None:
+                        segment = corpus_store.new_segment()
+                    self._write_word_vectors(writer, segment, term_weighting, source_ids, batch, stats)
+                    source_ids = []
+                    batch = []
+
+                    if corpus_store is None and writer is not None and count - checkpoint_count >= checkpoint_every:
+                        # background writer threads may commit batches out of order
+                        writer.sync()
+                        self.bows_watermark = last_source_id
+                        self.save(update_fields=['bows_watermark'])
+                        checkpoint_count = count
+
+                if count % print_freq == 0:
+                    logger.info("Saved word-vectors for %d / %d documents" % (count, total_count))
+
+            if batch and segment is None and corpus_store is not None:
+                segment = corpus_store.new_segment()
+            self._write_word_vectors(writer, segment, term_weighting, source_ids, batch, stats)
+        except Exception:
+            import sys
+            from django.utils import six
+
+            exc_info = sys.exc_info()
+            for sink in (writer, segment):
+                if sink is not None:
+                    sink.__exit__(*exc_info)
+            six.reraise(*exc_info)
+
+        for sink in (writer, segment):
+            if sink is not None:
+                sink.close()
+
+        if last_source_id is not None:
+            self.bows_watermark = last_source_id
+        self._set_corpus_stats(*stats)
+
+        logger.info("Saved word-vectors for %d / %d documents" % (count, total_count))
+        if writer is not None:
+            logger.info("Created %d word vector entries" % writer.rows_written)
+            logger.info("Vectorization took %s" % writer.timing_summary(time.time() - start))
+        else:
+            logger.info("Vectorization took %.1fs" % (time.time() - start))
+
+    def _write_word_vectors(self, writer, segment, term_weighting, source_ids, bows, stats):
+        """
+        Write a batch of documents and add them to stats, a list of
+        [num_docs, num_postings, min_source_id, max_source_id].
+        """
+        import numpy
+
+        lengths = numpy.array([len(bow) for bow in bows], dtype=numpy.int64)
+        postings = [posting for bow in bows for posting in bow]
+        if not postings:
+            return
+
+        postings = numpy.array(postings, dtype=numpy.int64)
+        indices = postings[:, 0]
+        counts = postings[:, 1]
+        source_ids = numpy.array(source_ids, dtype=numpy.int64)
+
+        written = source_ids[lengths > 0]
+        stats[0] += len(written)
+        stats[1] += len(postings)
+        stats[2] = int(written.min()) if stats[2] is None else min(stats[2], int(written.min()))
+        stats[3] = int(written.max()) if stats[3] is None else max(stats[3], int(written.max()))
+
+        weights = term_weighting.weigh(indices, counts, lengths)
+
+        if segment is not None:
+            # documents without postings get no row, as in the database
+            nonempty = lengths > 0
+            segment.append(source_ids[nonempty], lengths[nonempty], indices, counts, weights)
+
+        if writer is not None:
+            word_ids = self.get_word_ids(indices)
+            sources = numpy.repeat(source_ids, lengths)
+            writer.write_many(zip([self.id] * len(postings), word_ids.tolist(), indices.tolist(),
+                                  counts.tolist(), weights.tolist(), sources.tolist()))
+
+
+    def _build_lda(self, name, corpus, num_topics=30, words_to_save=200, holdout_fraction=0, holdout_seed=0,
+                   training=None):
+        """
+        Train a new model. training is a TrainingConfig
+        (see training.py); the default sizes workers to the machine.
+        """
         from gensim.models import LdaMulticore
+        from training import TrainingConfig
 
         gdict = self.gensim_dictionary
 
-        lda = LdaMulticore(corpus=corpus,
-                           num_topics=num_topics,
-                           workers=3,
-                           id2word=gdict)
+        if holdout_fraction:
+            from evaluation import SplitCorpus
+            corpus = SplitCorpus(corpus, holdout_fraction, seed=holdout_seed)
 
-        model = TopicModel(name=name, dictionary=self)
-        model.save()
+        if training is None:
+            training = TrainingConfig()
+        training = training.resolve(corpus, num_topics, gdict)
+        logger.info("Training %d topics with %r" % (num_topics, training))
 
-        topics = []
-        for i in range(num_topics):
-            topic = lda.show_topic(i, topn=words_to_save)
-            alpha = lda.alpha[i]
+        start = time.time()
+        lda = LdaMulticore(corpus=corpus,
+                           num_topics=num_topics,
+                           id2word=gdict,
+                           **training.lda_options())
+        training_time = time.time() - start
+        logger.info("Training took %.1fs (%.0f docs/s)" % (
+            training_time, len(corpus) * training.passes / max(training_time, 1e-9)))
 
-            topicm = Topic(model=model, name="?", alpha=alpha, index=i)
-            topicm.save()
-            topics.append(topicm)
+        model = self._save_topic_model(name, lda, words_to_save=words_to_save,
+                                       holdout_fraction=holdout_fraction, holdout_seed=holdout_seed,
+                                       training_time=training_time, training_config=training.to_json())
 
-            words = []
-            for prob, word_text in topic:
-                word_index = gdict.token2id[word_text]
-                word_id = self.get_word_id(word_index)
-                tw = TopicWord(topic=topicm,
-                               word_id=word_id, word_index=word_index,
-                               probability=prob)
-                words.append(tw)
-            TopicWord.objects.bulk_create(words)
+        return (model, lda)
 
-            if settings.DEBUG:
-                # prevent memory leaks
-                from django.db import connection
+    def _update_lda(self, model, corpus, lda=None, words_to_save=200):
+        """
+        Train an existing model further on new documents only, using
+        gensim's online update. The result is saved as a new TopicModel
+        whose parent is the original.
+        """
+        from corpus import VocabularyLimitedCorpus
 
-                connection.queries = []
+        if lda is None:
+            # recover the lda, in memory since it is trained further
+            lda = model.load_from_file(cached=False)
+
+        # words added to the dictionary since training are unknown to the model
+        corpus = VocabularyLimitedCorpus(corpus, lda.num_terms)
+
+        # keep the parent's held-out documents out of training
+        if model.holdout_fraction:
+            from evaluation import SplitCorpus
+            corpus = SplitCorpus(corpus, model.holdout_fraction, seed=model.holdout_seed)
+
+        logger.info("Updating model %d with %d new documents" % (model.id, len(corpus)))
+        start = time.time()
+        lda.update(corpus)
+        training_time = time.time() - start
+
+        new_model = self._save_topic_model(model.name, lda, words_to_save=words_to_save, parent=model,
+                                           holdout_fraction=model.holdout_fraction,
+                                           holdout_seed=model.holdout_seed,
+                                           training_time=training_time,
+                                           training_config=model.training_config)
+        return (new_model, lda)
+
+    def _save_topic_model(self, name, lda, words_to_save=200, parent=None, holdout_fraction=0, holdout_seed=0,
+                          training_time=None, training_config=''):
+        """
+        Store lda as a TopicModel with its topics and each topic's top
+        words_to_save words, in one transaction.
+        """
+        import numpy
+        from bulk import get_bulk_writer
+
+        # topic-word probabilities, normalized the way lda.show_topic does
+        topic_words = lda.state.get_lambda()
+        topic_words = topic_words / topic_words.sum(axis=1)[:, numpy.newaxis]
+
+        num_topics, num_terms = topic_words.shape
+        topn = min(words_to_save, num_terms)
+        rows = numpy.arange(num_topics)[:, numpy.newaxis]
+
+        # top-n columns of each row, then sorted by descending probability
+        top_indices = numpy.argpartition(-topic_words, topn - 1, axis=1)[:, :topn]
+        order = numpy.argsort(-topic_words[rows, top_indices], axis=1)
+        top_indices = top_indices[rows, order]
+        top_probabilities = topic_words[rows, top_indices]
+
+        top_word_ids = self.get_word_ids(top_indices.ravel()).reshape(top_indices.shape)
+
+        with transaction.atomic():
+            model = TopicModel(name=name, dictionary=self, parent=parent,
+                               source_watermark=self.bows_watermark,
+                               holdout_fraction=holdout_fraction, holdout_seed=holdout_seed,
+                               training_time=training_time, training_config=training_config)
+            model.save()
+
+            # the writers must share this connection, so no writer threads
+            with get_bulk_writer(Topic, ('model', 'name', 'description', 'index', 'alpha')) as writer:
+                for i in range(num_topics):
+                    writer.write((model.id, "?", "", i, float(lda.alpha[i])))
+
+            topic_ids = list(model.topics.order_by('index').values_list('id', flat=True))
+
+            with get_bulk_writer(TopicWord, ('topic', 'word', 'word_index', 'probability')) as writer:
+                for topic_id, word_ids, word_indices, probabilities in zip(
+                        topic_ids, top_word_ids.tolist(), top_indices.tolist(), top_probabilities.tolist()):
+                    writer.write_many(zip([topic_id] * topn, word_ids, word_indices, probabilities))
+
+            TopicWordGrid.build(model)
+            model.bump_version()
 
         model.save_to_file(lda)
 
-        return (model, lda)
+        return model
 
-    def _apply_lda(self, model, corpus, topicvector_class, lda=None):
+    def _apply_lda(self, model, corpus, topicvector_class, lda=None, workers=1, chunk_size=2000):
 
         if lda is None:
             # recover the lda
             lda = model.load_from_file()
 
+        from bulk import get_bulk_writer
+        from inference import iter_topic_mixtures
+        from examples import ExampleIndex
+
         total_documents = len(corpus)
         count = 0
-        batch = []
-        batch_size = 1000
         print_freq = 10000
 
-        topics = list(model.topics.order_by('index'))
+        topic_ids = list(model.topics.order_by('index').values_list('id', flat=True))
+
+        # collect the best examples of each topic and of each of its saved words
+        topic_words = {}
+        for topic_index, word_index, word_id in TopicWord.objects.filter(topic__model=model)\
+                .values_list('topic__index', 'word_index', 'word_id').iterator():
+            topic_words.setdefault(topic_index, {})[word_index] = word_id
+        example_index = ExampleIndex(topic_words)
+
+        probability_sums = [0.0] * len(topic_ids)
+        document_counts = [0] * len(topic_ids)
 
         # Go through the bows and get their topic mixtures
-        for bow in corpus:
-            mixture = lda[bow]
-            source_id = corpus.current_source_id
+        start = time.time()
+
+        with get_bulk_writer(topicvector_class, topicvector_class.bulk_fields, threads=None) as writer:
+            mixtures = iter_topic_mixtures(lda, model.model_path(), corpus,
+                                           workers=workers, chunk_size=chunk_size)
+            for source_id, bow, mixture in mixtures:
+                for topic_index, prob in mixture:
+                    writer.write((model.id, topic_ids[topic_index], prob, source_id))
+                    probability_sums[topic_index] += prob
+                    document_counts[topic_index] += 1
+                example_index.add(source_id, bow, mixture)
+
+                count += 1
 
-            for topic_index, prob in mixture:
-                topic = topics[topic_index]
-                itemtopic = topicvector_class(topic_model=model,
-                                              topic=topic,
-                                              probability=prob,
-                                              source_id=source_id)
-                batch.append(itemtopic)
+                if count % print_freq == 0:
+                    logger.info("Saved topic-vectors for %d / %d documents (%.0f docs/s)" % (
+                        count, total_documents, count / (time.time() - start)))
 
-            count += 1
+        logger.info("Saved topic-vectors for %d / %d documents" % (count, total_documents))
+        logger.info("Topic inference took %s" % writer.timing_summary(time.time() - start))
 
-            if len(batch) > batch_size:
-                topicvector_class.objects.bulk_create(batch)
-                batch = []
+        self._save_examples(model, example_index, topic_ids)
 
-                if settings.DEBUG:
-                    # prevent memory leaks
-                    from django.db import connection
+        with transaction.atomic():
+            for topic_id, probability_sum, document_count in zip(topic_ids, probability_sums, document_counts):
+                Topic.objects.filter(pk=topic_id).update(prevalence=probability_sum / max(count, 1),
+                                                         document_count=document_count)
+            model.bump_version()
 
-                    connection.queries = []
+    def _save_examples(self, model, example_index, topic_ids):
+        from bulk import get_bulk_writer
 
-            if count % print_freq == 0:
-                logger.info("Saved topic-vectors for %d / %d documents" % (count, total_documents))
+        with transaction.atomic():
+            TopicExample.objects.filter(topic__model=model).delete()
 
-        if len(batch):
-            topicvector_class.objects.bulk_create(batch)
-            logger.info("Saved topic-vectors for %d / %d documents" % (count, total_documents))
+            with get_bulk_writer(TopicExample, ('topic', 'word', 'source_id', 'probability', 'rank')) as writer:
+                for row in example_index.rows(topic_ids):
+                    writer.write(row)
 
-    def _evaluate_lda(self, model, corpus, lda=None):
+            model.examples_indexed = True
+            model.save(update_fields=['examples_indexed'])
+
+        logger.info("Saved %d topic examples" % writer.rows_written)
+
+    def _evaluate_lda(self, model, corpus, lda=None, sample_size=None, workers=1, chunk_size=2000,
+                      confidence=0.95):
+        """
+        Per-word perplexity bound on the model's held-out documents, or on
+        the whole corpus if it has none, optionally cut down to a sample
+        of about sample_size documents. See evaluation.py.
+        """
+        from evaluation import iter_sample, evaluate_perplexity
 
         if lda is None:
             # recover the lda
             lda = model.load_from_file()
 
-        logger.info("Calculating model perplexity on entire corpus...")
-        model.perplexity = lda.log_perplexity(corpus)
-        logger.info("Perplexity: %f" % model.perplexity)
-        model.save()
+        if model.holdout_fraction:
+            logger.info("Calculating model perplexity on held-out documents (%.1f%%)..." % (
+                100 * model.holdout_fraction))
+        else:
+            logger.info("Calculating model perplexity on entire corpus...")
+
+        # words added to the dictionary since training are unknown to the model
+        from corpus import VocabularyLimitedCorpus
+        corpus = VocabularyLimitedCorpus(corpus, lda.num_terms)
+
+        start = time.time()
+        documents, total_docs = iter_sample(corpus, sample_size=sample_size,
+                                            holdout_fraction=model.holdout_fraction,
+                                            seed=model.holdout_seed)
+        result = evaluate_perplexity(lda, model.model_path(), documents, total_docs,
+                                     workers=workers, chunk_size=chunk_size, confidence=confidence)
+
+        if result['bound'] is None:
+            logger.warn("No documents to evaluate model %d on" % model.id)
+            return
+
+        model.set_evaluation(result, sample_size=sample_size, confidence=confidence)
+        model.save(update_fields=TopicModel.EVALUATION_FIELDS)
+        model.bump_version()
+
+        if result['lower'] is not None:
+            logger.info("Perplexity: %f (%d%% CI %f to %f) on %d documents in %.1fs" % (
+                model.perplexity, 100 * confidence, model.perplexity_lower, model.perplexity_upper,
+                model.eval_documents, time.time() - start))
+        else:
+            logger.info("Perplexity: %f on %d documents in %.1fs" % (
+                model.perplexity, model.eval_documents, time.time() - start))
 
 class Word(models.Model):
     dictionary = models.ForeignKey(Dictionary, related_name='words')
@@ -288,13 +818,73 @@ class TopicModel(models.Model):
     time = models.DateTimeField(auto_now_add=True)
     perplexity = models.FloatField(default=0)
 
-    def load_from_file(self):
-        from gensim.models import LdaMulticore
-
-        return LdaMulticore.load("lda_out_%d.model" % self.id)
+    # the model this one was updated from, if any
+    parent = models.ForeignKey('self', null=True, blank=True, related_name='versions')
+    # highest source id in the corpus when the model was trained
+    source_watermark = PositiveBigIntegerField(null=True, default=None)
+
+    # share of documents held out of training, and the seed of the split
+    holdout_fraction = models.FloatField(default=0)
+    holdout_seed = models.IntegerField(default=0)
+
+    # what perplexity was measured on: the requested sample size (None for
+    # all), the number of documents used, and a confidence interval
+    eval_sample_size = models.IntegerField(null=True, default=None)
+    eval_documents = models.IntegerField(null=True, default=None)
+    eval_confidence = models.FloatField(null=True, default=None)
+    perplexity_lower = models.FloatField(null=True, default=None)
+    perplexity_upper = models.FloatField(null=True, default=None)
+
+    # whether _apply_lda has filled in TopicExamples
+    examples_indexed = models.BooleanField(default=False)
+
+    # bumped whenever the pipeline writes data for this model; part of
+    # every cache key for it (see caching.py)
+    version = models.PositiveIntegerField(default=0)
+
+    # seconds spent in gensim training, and its settings as JSON
+    training_time = models.FloatField(null=True, default=None)
+    training_config = models.TextField(blank=True, default='')
+
+    def model_path(self):
+        from artifacts import model_path
+        return model_path(self.id)
+
+    def bump_version(self):
+        """Invalidate everything cached for this model."""
+        TopicModel.objects.filter(pk=self.pk).update(version=models.F('version') + 1)
+        self.version = TopicModel.objects.values_list('version', flat=True).get(pk=self.pk)
+
+    # set by set_evaluation
+    EVALUATION_FIELDS = ['perplexity', 'perplexity_lower', 'perplexity_upper',
+                         'eval_confidence', 'eval_sample_size', 'eval_documents']
+
+    def set_evaluation(self, result, sample_size=None, confidence=0.95):
+        """Record the result of evaluation.evaluate_perplexity."""
+        if result['bound'] is None:
+            return
+        self.perplexity = result['bound']
+        self.perplexity_lower = result['lower']
+        self.perplexity_upper = result['upper']
+        self.eval_confidence = confidence
+        self.eval_sample_size = sample_size
+        self.eval_documents = result['num_docs']
+
+    def load_from_file(self, cached=True):
+        """
+        The saved lda, memory-mapped. With cached, it may be a model
+        shared with other callers in this process (see artifacts.py),
+        so use cached=False to get a copy you can train further.
+        """
+        import artifacts
+
+        if cached:
+            return artifacts.model_cache.get(self.id)
+        return artifacts.load_model(self.id, mmap=None)
 
     def save_to_file(self, gensim_lda):
-        gensim_lda.save("lda_out_%d.model" % self.id)
+        from artifacts import save_model
+        save_model(self.id, gensim_lda)
 
 
 class Topic(models.Model):
@@ -304,6 +894,11 @@ class Topic(models.Model):
     index = models.IntegerField()
     alpha = models.FloatField()
 
+    # mean probability of the topic over the corpus, and the number of
+    # documents it was saved for; set by _apply_lda
+    prevalence = models.FloatField(null=True, default=None)
+    document_count = models.IntegerField(null=True, default=None)
+
 
 class TopicWord(models.Model):
     word = models.ForeignKey(Word)
@@ -312,11 +907,158 @@ class TopicWord(models.Model):
     topic = models.ForeignKey(Topic, related_name='words')
 
 
+class TopicExample(models.Model):
+    """
+    The highest probability sources of a topic (word is None), and of
+    the topic among sources containing one of its words. Filled in by
+    _apply_lda; see examples.py.
+    """
+    topic = models.ForeignKey(Topic, related_name='examples')
+    word = models.ForeignKey(Word, null=True, default=None, related_name='+')
+    source_id = PositiveBigIntegerField()
+    probability = models.FloatField()
+    rank = models.IntegerField()
+
+    class Meta:
+        # the second index serves get_examples_page, scanned backwards
+        index_together = [['topic', 'word', 'rank'],
+                          ['topic', 'word', 'probability', 'source_id']]
+
+    @staticmethod
+    def _set_sources(examples, topicvector_class):
+        """Set each example's source, dropping examples whose source is gone."""
+        sources = topicvector_class.get_sources([example.source_id for example in examples])
+        for example in examples:
+            example.source = sources.get(example.source_id)
+        return [example for example in examples if example.source is not None]
+
+    @classmethod
+    def get_examples(cls, topic, topicvector_class, word=None, limit=20):
+        """The best examples in rank order, with their sources."""
+        examples = list(cls.objects.filter(topic=topic, word=word).order_by('rank')[:limit])
+        return cls._set_sources(examples, topicvector_class)
+
+    @classmethod
+    def get_examples_page(cls, topic, topicvector_class, word=None, after=None, page_size=20):
+        """
+        One page of the indexed examples, paged like
+        AbstractTopicVector.get_examples_page. This is how the examples
+        of a topic word are browsed, without joining the word vectors.
+        """
+        examples = cls.objects.filter(topic=topic, word=word)
+
+        if after is not None:
+            probability, source_id = after
+            examples = examples.filter(models.Q(probability__lt=probability) |
+                                       models.Q(probability=probability, source_id__lt=source_id))
+
+        examples = list(examples.order_by('-probability', '-source_id')[:page_size + 1])
+
+        next_cursor = None
+        if len(examples) > page_size:
+            examples = examples[:page_size]
+            next_cursor = (examples[-1].probability, examples[-1].source_id)
+        return cls._set_sources(examples, topicvector_class), next_cursor
+
+
+class TopicWordGrid(models.Model):
+    """
+    A model's topics and their ranked words, precomputed for the model
+    page so it can be served with one read. data is zlib-compressed JSON:
+
+        {"topics": [[topic_id, index], ...],
+         "rows": [[cell or null for each topic], ...]}
+
+    where rows[rank] holds each topic's word at that rank and a cell is
+    [topicword_id, text, probability, document_frequency].
+    """
+    model = models.OneToOneField(TopicModel, related_name='word_grid')
+    data = models.BinaryField()
+
+    Cell = namedtuple('Cell', ['id', 'topic_id', 'text', 'probability', 'document_frequency', 'url'])
+
+    @classmethod
+    def build(cls, model):
+        """Create or replace the grid of model from its TopicWords."""
+        import json
+        import zlib
+
+        topics = list(model.topics.order_by('index').values_list('id', 'index'))
+        columns = dict((topic_id, column) for column, (topic_id, index) in enumerate(topics))
+
+        words = TopicWord.objects.filter(topic__model=model)\
+            .order_by('topic__index', '-probability')\
+            .values_list('topic_id', 'id', 'word__text', 'probability', 'word__document_frequency')
+
+        rows = []
+        ranks = [0] * len(topics)
+        for topic_id, topicword_id, text, probability, document_frequency in words.iterator():
+            column = columns[topic_id]
+            rank = ranks[column]
+            ranks[column] += 1
+            if rank == len(rows):
+                rows.append([None] * len(topics))
+            rows[rank][column] = [topicword_id, text, probability, document_frequency]
+
+        data = zlib.compress(json.dumps({'topics': topics, 'rows': rows}, separators=(',', ':')))
+
+        cls.objects.filter(model=model).delete()
+        return cls.objects.create(model=model, data=data)
+
+    @classmethod
+    def get_for_model(cls, model):
+        """The grid of model, built now if it was saved without one."""
+        try:
+            return cls.objects.get(model=model)
+        except cls.DoesNotExist:
+            return cls.build(model)
+
+    def _load(self):
+        if not hasattr(self, '_decoded'):
+            import json
+            import zlib
+            self._decoded = json.loads(zlib.decompress(bytes(self.data)))
+        return self._decoded
+
+    @property
+    def topics(self):
+        """(topic_id, index) of each column."""
+        return self._load()['topics']
+
+    @property
+    def num_rows(self):
+        return len(self._load()['rows'])
+
+    def get_rows(self, start=0, stop=None, word_url=None):
+        """
+        Rows start to stop as lists of Cells (None where a topic has no
+        word at that rank). word_url(topic_id, topicword_id), if given,
+        fills in Cell.url.
+        """
+        topic_ids = [topic_id for topic_id, index in self.topics]
+
+        rows = []
+        for row in self._load()['rows'][start:stop]:
+            cells = []
+            for topic_id, cell in zip(topic_ids, row):
+                if cell is None:
+                    cells.append(None)
+                else:
+                    topicword_id, text, probability, document_frequency = cell
+                    url = word_url(topic_id, topicword_id) if word_url else None
+                    cells.append(self.Cell(topicword_id, topic_id, text, probability, document_frequency, url))
+            rows.append(cells)
+        return rows
+
+
 class AbstractWordVector(models.Model):
     class Meta:
         abstract = True
         index_together = ['dictionary', 'source']
 
+    # column order of the row tuples given to bulk writers
+    bulk_fields = ('dictionary', 'word', 'word_index', 'count', 'tfidf', 'source')
+
     dictionary = models.ForeignKey(Dictionary, db_index=False)
     word = models.ForeignKey(Word)
     word_index = models.IntegerField()
@@ -324,27 +1066,82 @@ class AbstractWordVector(models.Model):
     tfidf = models.FloatField()
 
     @classmethod
-    def create(cls, dictionary, word_id, word_index, source_obj, count, tfidf):
+    def create(cls, dictionary, word_id, word_index, source_id, count, tfidf):
         return cls(dictionary=dictionary,
                    word_id=word_id, word_index=word_index,
                    count=count, tfidf=tfidf,
-                   source=source_obj)
+                   source_id=source_id)
 
 
 class AbstractTopicVector(models.Model):
     class Meta:
         abstract = True
-        index_together = ['topic_model', 'source']
+        # the second index serves get_examples_page, scanned backwards
+        index_together = [['topic_model', 'source'],
+                          ['topic', 'probability', 'source']]
+
+    # column order of the row tuples given to bulk writers
+    bulk_fields = ('topic_model', 'topic', 'probability', 'source')
 
     topic_model = models.ForeignKey(TopicModel, db_index=False)
     topic = models.ForeignKey(Topic)
     probability = models.FloatField()
 
+    # relations of the source that source_fields reads
+    source_related = ()
+
+    @classmethod
+    def source_fields(cls, source):
+        """(user name, text, created time) of a source, as the templates read them."""
+        return source.user_name, source.text, source.created_at
+
+    @classmethod
+    def get_sources(cls, source_ids):
+        """Sources by id, loaded with their source_related objects."""
+        source_class = cls._meta.get_field('source').rel.to
+        return source_class.objects.select_related(*cls.source_related).in_bulk(list(source_ids))
+
     @classmethod
     def get_examples(cls, topic):
         examples = cls.objects.filter(topic=topic)
         return examples.order_by('-probability')
 
+    @classmethod
+    def get_examples_page(cls, topic, after=None, page_size=20):
+        """
+        One page of a topic's examples by descending probability, then
+        source. after is the (probability, source_id) of the last example
+        on the previous page, so every page is an index range scan.
+        Returns (examples, cursor of the next page or None).
+        """
+        examples = cls.objects.filter(topic=topic)
+
+        if after is not None:
+            probability, source_id = after
+            examples = examples.filter(models.Q(probability__lt=probability) |
+                                       models.Q(probability=probability, source__lt=source_id))
+
+        related = ['source'] + ['source__' + name for name in cls.source_related]
+        examples = list(examples.order_by('-probability', '-source')
+                        .select_related(*related)[:page_size + 1])
+
+        next_cursor = None
+        if len(examples) > page_size:
+            examples = examples[:page_size]
+            next_cursor = (examples[-1].probability, examples[-1].source_id)
+        return examples, next_cursor
+
+    @staticmethod
+    def format_cursor(cursor):
+        """Cursor as a string for urls; repr keeps the float exact."""
+        return '%r:%d' % cursor
+
+    @staticmethod
+    def parse_cursor(value):
+        """Inverse of format_cursor. Raises ValueError on bad input."""
+        probability, source_id = value.split(':')
+        return float(probability), int(source_id)
+
 class TextPrizmWord(AbstractWordVector):
     source = models.ForeignKey('textprizm.Message', related_name='words')
 
@@ -356,6 +1153,12 @@ class TweetWord(AbstractWordVector):
 class TextPrizmTopic(AbstractTopicVector):
     source = models.ForeignKey('textprizm.Message')
 
+    source_related = ('participant',)
+
+    @classmethod
+    def source_fields(cls, message):
+        return message.participant.name, message.message, message.time
+
 
 class TweetTopic(AbstractTopicVector):
     source = PositiveBigAutoForeignKey(settings.TWITTER_STREAM_TWEET_MODEL)
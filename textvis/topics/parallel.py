@@ -0,0 +1,82 @@
+"""
+Helpers for fanning pipeline work out over a process pool.
+
+Work is fed to the pool in chunks, with a bounded number of chunks
+in flight at once, and results come back in submission order.
+This keeps memory bounded on huge database streams and makes the
+output identical to a serial run.
+"""
+
+from collections import deque
+import itertools
+import multiprocessing
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def cpu_count():
+    try:
+        return multiprocessing.cpu_count()
+    except NotImplementedError:
+        return 1
+
+
+def resolve_workers(workers):
+    """
+    Turn a worker setting into a process count.
+    'auto' (or 0/None) uses one process per core.
+    """
+    if workers in (None, 0, 'auto'):
+        return cpu_count()
+    return max(1, int(workers))
+
+
+def chunked(iterable, chunk_size):
+    """Split an iterable into lists of at most chunk_size items."""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def ordered_imap(pool, func, chunks, max_pending, with_chunks=False):
+    """
+    Like pool.imap, but never reads more than max_pending chunks
+    ahead of the consumer. (Pool.imap drains its input eagerly.)
+    With with_chunks, yields (chunk, result) pairs.
+    """
+    pending = deque()
+
+    def pop():
+        chunk, result = pending.popleft()
+        if with_chunks:
+            return chunk, result.get()
+        return result.get()
+
+    for chunk in chunks:
+        pending.append((chunk, pool.apply_async(func, (chunk,))))
+        if len(pending) >= max_pending:
+            yield pop()
+
+    while pending:
+        yield pop()
+
+
+def close_db_connections():
+    """
+    Forked workers must not share the parent's database socket.
+    Close it before forking; Django reconnects on demand.
+    """
+    from django.db import connections
+    for conn in connections.all():
+        conn.close()
+
+
+def make_pool(workers, initializer=None, initargs=()):
+    close_db_connections()
+    return multiprocessing.Pool(processes=workers,
+                                initializer=initializer,
+                                initargs=initargs)
@@ -0,0 +1,215 @@
+"""
+On-disk token spool, so a corpus is only tokenized once.
+
+While the dictionary is built, every document's tokens are interned
+into a spool-local vocabulary and appended to flat binary files:
+
+    source_ids.bin  int64, one per document (ascending)
+    offsets.bin     int64, num_docs + 1 offsets into tokens.bin
+    tokens.bin      int32, spool vocabulary ids
+    vocab.json      the spool vocabulary
+    header.json     format version, dictionary settings and counts
+
+The files are memory-mapped for the BoW pass. A spool lives in a
+directory named after a hash of the dictionary settings, so changing
+the settings invalidates it.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+
+from django.conf import settings
+from path import path
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def settings_fingerprint(settings_str):
+    if isinstance(settings_str, unicode):
+        settings_str = settings_str.encode('utf-8')
+    return hashlib.sha1(settings_str).hexdigest()
+
+
+class TokenSpool(object):
+    VERSION = 1
+    flush_size = 1000000
+
+    def __init__(self, name, dict_settings, directory=None):
+        self.name = name
+        self.settings = dict_settings
+        self.fingerprint = settings_fingerprint(dict_settings)
+
+        if directory is None:
+            directory = settings.TOPICS_DATA_DIR / 'spools'
+        self.directory = path(directory)
+        self.path = self.directory / ('spool-%s' % self.fingerprint)
+
+        self._header = None
+
+    @property
+    def header(self):
+        if self._header is None:
+            header_file = self.path / 'header.json'
+            if not header_file.exists():
+                return None
+            with open(header_file) as f:
+                self._header = json.load(f)
+        return self._header
+
+    def is_valid(self):
+        header = self.header
+        return (header is not None and
+                header.get('version') == self.VERSION and
+                header.get('settings') == self.settings)
+
+    @property
+    def num_docs(self):
+        return self.header['num_docs']
+
+    @property
+    def max_source_id(self):
+        return self.header['max_source_id']
+
+    def record(self, tokenized_items):
+        """
+        Pass (source_id, words) pairs through unchanged,
+        spooling them to disk along the way.
+
+        The spool only becomes visible once the input is exhausted.
+        Items must arrive in ascending source id order.
+        """
+        import numpy
+
+        self.directory.makedirs_p()
+        tmp_path = path(self.path + '.tmp-%d' % os.getpid())
+        tmp_path.rmtree_p()
+        tmp_path.makedirs()
+
+        vocab = {}
+        source_ids = []
+        lengths = []
+        tokens = []
+        num_docs = 0
+        num_tokens = 0
+        max_source_id = None
+
+        files = dict((name, open(tmp_path / ('%s.bin' % name), 'wb'))
+                     for name in ('source_ids', 'offsets', 'tokens'))
+
+        def flush():
+            numpy.asarray(source_ids, dtype=numpy.int64).tofile(files['source_ids'])
+            numpy.asarray(tokens, dtype=numpy.int32).tofile(files['tokens'])
+            ends = numpy.cumsum(numpy.asarray(lengths, dtype=numpy.int64)) + (num_tokens - sum(lengths))
+            ends.tofile(files['offsets'])
+            del source_ids[:]
+            del lengths[:]
+            del tokens[:]
+
+        try:
+            numpy.zeros(1, dtype=numpy.int64).tofile(files['offsets'])
+
+            for source_id, words in tokenized_items:
+                for word in words:
+                    token_id = vocab.get(word)
+                    if token_id is None:
+                        token_id = vocab[word] = len(vocab)
+                    tokens.append(token_id)
+
+                source_ids.append(source_id)
+                lengths.append(len(words))
+                num_docs += 1
+                num_tokens += len(words)
+                max_source_id = source_id
+
+                if len(tokens) >= self.flush_size:
+                    flush()
+
+                yield source_id, words
+
+            flush()
+            for f in files.values():
+                f.close()
+
+            id2token = [None] * len(vocab)
+            for word, token_id in vocab.iteritems():
+                id2token[token_id] = word
+            with open(tmp_path / 'vocab.json', 'w') as f:
+                json.dump(id2token, f)
+
+            header = dict(version=self.VERSION,
+                          name=self.name,
+                          settings=self.settings,
+                          num_docs=num_docs,
+                          num_tokens=num_tokens,
+                          max_source_id=max_source_id)
+            with open(tmp_path / 'header.json', 'w') as f:
+                json.dump(header, f)
+
+            self.path.rmtree_p()
+            tmp_path.rename(self.path)
+            self._header = header
+            logger.info("Spooled %d tokens from %d documents to %s" % (num_tokens, num_docs, self.path))
+
+            self.remove_stale()
+
+        finally:
+            for f in files.values():
+                f.close()
+            tmp_path.rmtree_p()
+
+    def remove_stale(self):
+        """Delete spools for this context that were built with other settings."""
+        for spool_dir in self.directory.dirs('spool-*'):
+            if spool_dir == self.path:
+                continue
+            try:
+                with open(spool_dir / 'header.json') as f:
+                    name = json.load(f).get('name')
+            except (IOError, ValueError):
+                continue
+            if name == self.name:
+                logger.info("Removing stale token spool %s" % spool_dir)
+                shutil.rmtree(spool_dir, ignore_errors=True)
+
+    def _load_array(self, name, dtype):
+        import numpy
+        filename = self.path / ('%s.bin' % name)
+        if filename.size == 0:
+            return numpy.zeros(0, dtype=dtype)
+        return numpy.memmap(filename, dtype=dtype, mode='r')
+
+    def iter_bows(self, gensim_dict, min_source_id=None):
+        """
+        Yield (source_id, bow) pairs, with the same bows as gensim's
+        doc2bow on the spooled tokens, without touching the database.
+        Documents with ids at or below min_source_id are skipped.
+        """
+        import numpy
+
+        if not self.is_valid():
+            raise RuntimeError("Token spool %s is missing or stale" % self.path)
+
+        with open(self.path / 'vocab.json') as f:
+            id2token = json.load(f)
+
+        # translate spool token ids to dictionary indices in one lookup
+        token2id = gensim_dict.token2id
+        spool2index = numpy.array([token2id.get(token, -1) for token in id2token] or [-1],
+                                  dtype=numpy.int64)
+
+        source_ids = self._load_array('source_ids', numpy.int64)
+        offsets = self._load_array('offsets', numpy.int64)
+        tokens = self._load_array('tokens', numpy.int32)
+
+        start_doc = 0
+        if min_source_id is not None:
+            start_doc = int(numpy.searchsorted(source_ids, min_source_id, side='right'))
+
+        for doc in xrange(start_doc, len(source_ids)):
+            indices = spool2index[tokens[offsets[doc]:offsets[doc + 1]]]
+            indices = indices[indices >= 0]
+            word_indices, counts = numpy.unique(indices, return_counts=True)
+            yield int(source_ids[doc]), zip(word_indices.tolist(), counts.tolist())
@@ -0,0 +1,142 @@
+"""
+Train models for several topic counts at once.
+
+The corpus is read once into memory-mapped segments (see corpus.py),
+and each worker process maps the same files, so the page cache holds
+one copy however many models train. Every job trains a single-process
+LdaModel, so the pool size is the number of cores in use; it is capped
+by max_workers.
+
+Workers save their models to a temporary directory and score them on
+the held-out documents (or a sample, see evaluation.py). The parent
+process stores each one as a TopicModel as it finishes, so workers never
+touch the database.
+"""
+
+import json
+import shutil
+import tempfile
+import time
+
+from django.conf import settings
+from path import path
+
+from parallel import cpu_count, make_pool
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+def resolve_max_workers(max_workers, num_jobs):
+    """Worker processes for a sweep: 'auto' leaves one core free."""
+    if max_workers in (None, 0, 'auto'):
+        max_workers = cpu_count() - 1
+    return max(1, min(int(max_workers), num_jobs))
+
+
+_worker = {}
+def _init_sweep_worker(segment_paths, id2word, options, evaluation, tmp_dir):
+    from corpus import open_segments
+    _worker.update(corpus=open_segments(segment_paths), id2word=id2word,
+                   options=options, evaluation=evaluation, tmp_dir=tmp_dir)
+
+
+def _train(num_topics):
+    from gensim.models import LdaModel
+    from evaluation import SplitCorpus, iter_sample, evaluate_perplexity
+
+    corpus = _worker['corpus']
+    evaluation = _worker['evaluation']
+
+    training_corpus = corpus
+    if evaluation['holdout_fraction']:
+        training_corpus = SplitCorpus(corpus, evaluation['holdout_fraction'], seed=evaluation['holdout_seed'])
+
+    start = time.time()
+    lda = LdaModel(corpus=training_corpus, num_topics=num_topics, id2word=_worker['id2word'],
+                   **_worker['options'])
+    training_time = time.time() - start
+
+    model_path = '%s/lda-%d.model' % (_worker['tmp_dir'], num_topics)
+    lda.save(model_path)
+
+    documents, total_docs = iter_sample(corpus, sample_size=evaluation['sample_size'],
+                                        holdout_fraction=evaluation['holdout_fraction'],
+                                        seed=evaluation['holdout_seed'])
+    result = evaluate_perplexity(lda, model_path, documents, total_docs,
+                                 chunk_size=evaluation['chunk_size'],
+                                 confidence=evaluation['confidence'])
+
+    return num_topics, model_path, training_time, len(training_corpus), result
+
+
+def run_sweep(dictionary, name, segment_paths, topic_counts, training, max_workers='auto',
+              holdout_fraction=0, holdout_seed=0, sample_size=None, chunk_size=2000, confidence=0.95,
+              words_to_save=200):
+    """
+    Train one model per topic count on the corpus in segment_paths.
+    training is a TrainingConfig; its workers setting is ignored.
+    Returns a list of (num_topics, model, docs_per_second) in topic count order.
+    """
+    from gensim.models import LdaModel
+
+    topic_counts = sorted(set(int(count) for count in topic_counts))
+    workers = resolve_max_workers(max_workers, len(topic_counts))
+
+    options = training.lda_options()
+    del options['workers'], options['batch']
+    training_config = json.dumps(dict(options, workers=1), sort_keys=True)
+
+    evaluation = dict(holdout_fraction=holdout_fraction, holdout_seed=holdout_seed,
+                      sample_size=sample_size, chunk_size=chunk_size, confidence=confidence)
+
+    cache_dir = settings.TOPICS_DATA_DIR / 'cache'
+    cache_dir.makedirs_p()
+    tmp_dir = tempfile.mkdtemp(prefix='sweep-', dir=cache_dir)
+
+    logger.info("Training %d models (%s topics) with %d worker processes" % (
+        len(topic_counts), ', '.join(str(count) for count in topic_counts), workers))
+
+    results = []
+    pool = make_pool(workers,
+                     initializer=_init_sweep_worker,
+                     initargs=([path(p) for p in segment_paths], dictionary.gensim_dictionary,
+                               options, evaluation, tmp_dir))
+    try:
+        for num_topics, model_path, training_time, num_docs, result in pool.imap_unordered(_train, topic_counts):
+            lda = LdaModel.load(model_path)
+            model = dictionary._save_topic_model(name, lda, words_to_save=words_to_save,
+                                                 holdout_fraction=holdout_fraction, holdout_seed=holdout_seed,
+                                                 training_time=training_time,
+                                                 training_config=training_config)
+            model.set_evaluation(result, sample_size=sample_size, confidence=confidence)
+            model.save(update_fields=model.EVALUATION_FIELDS)
+            model.bump_version()
+
+            docs_per_second = num_docs * training.passes / max(training_time, 1e-9)
+            results.append((num_topics, model, docs_per_second))
+            logger.info("%d topics: model %d, perplexity %s, trained in %.1fs" % (
+                num_topics, model.id, model.perplexity, training_time))
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    results.sort()
+    return results
+
+
+REPORT_COLUMNS = ('model', 'num_topics', 'bound', 'lower', 'upper', 'perplexity', 'documents',
+                  'training_time', 'docs_per_second')
+
+
+def report_rows(results):
+    """One row per model, in the order of REPORT_COLUMNS."""
+    rows = []
+    for num_topics, model, docs_per_second in results:
+        rows.append((model.id, num_topics, model.perplexity,
+                     model.perplexity_lower, model.perplexity_upper,
+                     2 ** -model.perplexity, model.eval_documents,
+                     model.training_time, docs_per_second))
+    return rows
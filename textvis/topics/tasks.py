@@ -1,6 +1,12 @@
 from django.conf import settings
 from models import Dictionary, TextPrizmWord, TweetWord, Word, TweetTopic, TextPrizmTopic
 from django.apps import apps as django_apps
+from django.db.models import Count, Max
+from parallel import chunked, ordered_imap, make_pool, resolve_workers
+from spool import TokenSpool
+from corpus import SparseCorpusStore, CorpusCache, open_segments
+from training import TrainingConfig
+from weighting import DEFAULT_SCHEME
 
 import nltk
 
@@ -36,65 +42,229 @@ class DbTextIterator(object):
 
             yield getattr(obj, self.textfield)
 
+    def iter_items(self):
+        """
+        Yield (pk, text) pairs in primary key order,
+        without building a model instance per row.
+        """
+        self.current_position = 0
+        qset = self.queryset.order_by('pk').values_list('pk', self.textfield)
+        for pk, text in qset.iterator():
+            self.current = pk
+            self.current_position += 1
+            if self.current_position % 10000 == 0:
+                logger.info("Iterating through database texts: item %d" % self.current_position)
+
+            yield pk, text
+
 
 class DbWordVectorIterator(object):
-    def __init__(self, dictionary, wv_class, freq_field='tfidf'):
+    """
+    Iterates a dictionary's word vectors from the database, one bow per
+    source document, in source order. While iterating, current_source_id
+    is the source of the bow just yielded.
+
+    Rows are read as plain (source, word_index, freq) tuples, at most
+    page_size at a time, so client memory stays flat however big the
+    corpus gets. Modes:
+
+        keyset  repeated LIMIT queries, each starting after the last
+                complete document of the previous page
+        server  one query streamed through a MySQL server-side cursor
+                (SSCursor) on a dedicated connection
+    """
+
+    def __init__(self, dictionary, wv_class, freq_field='tfidf', mode='keyset', page_size=100000, after=None):
         self.dictionary = dictionary
         self.wv_class = wv_class
         self.freq_field = freq_field
+        self.mode = mode
+        self.page_size = page_size
+        self.after = after
         self.current_source_id = None
-        self.current_vector = None
+
+    def _queryset(self):
+        qset = self.wv_class.objects.filter(dictionary=self.dictionary)
+        if self.after is not None:
+            qset = qset.filter(source__gt=self.after)
+        return qset.order_by('source').values_list('source', 'word_index', self.freq_field)
+
+    def _iter_keyset_pages(self):
+        qset = self._queryset()
+        after = None
+        while True:
+            page = qset if after is None else qset.filter(source__gt=after)
+            rows = list(page[:self.page_size])
+            if not rows:
+                return
+
+            if len(rows) == self.page_size:
+                # the last document may continue on the next page
+                last = rows[-1][0]
+                cut = len(rows)
+                while cut > 0 and rows[cut - 1][0] == last:
+                    cut -= 1
+
+                if cut > 0:
+                    rows = rows[:cut]
+                else:
+                    # a single document larger than a page
+                    rows = list(qset.filter(source=last))
+
+            yield rows
+            after = rows[-1][0]
+
+    def _iter_server_cursor_pages(self):
+        from django.db import connection
+        import MySQLdb.cursors
+
+        if connection.vendor != 'mysql':
+            raise RuntimeError("Server-side cursors need MySQL")
+
+        sql, params = self._queryset().query.sql_with_params()
+
+        # a streaming cursor ties up its connection until it is drained
+        raw_connection = connection.get_new_connection(connection.get_connection_params())
+        try:
+            cursor = raw_connection.cursor(MySQLdb.cursors.SSCursor)
+            cursor.execute(sql, params)
+
+            carry = []
+            while True:
+                rows = cursor.fetchmany(self.page_size)
+                if not rows:
+                    break
+
+                rows = carry + list(rows)
+                last = rows[-1][0]
+                cut = len(rows)
+                while cut > 0 and rows[cut - 1][0] == last:
+                    cut -= 1
+
+                carry = rows[cut:]
+                if cut > 0:
+                    yield rows[:cut]
+
+            if carry:
+                yield carry
+
+            cursor.close()
+        finally:
+            raw_connection.close()
 
     def __iter__(self):
-        qset = self.wv_class.objects.filter(dictionary=self.dictionary).order_by('source')
+        import numpy
+
+        if self.mode == 'server':
+            pages = self._iter_server_cursor_pages()
+        elif self.mode == 'keyset':
+            pages = self._iter_keyset_pages()
+        else:
+            raise ValueError("Unknown word vector iteration mode '%s'" % self.mode)
+
         self.current_source_id = None
-        self.current_vector = []
         current_position = 0
-        for wv in qset.iterator():
-            source_id = wv.source_id
-            word_idx = wv.word_index
-            freq = getattr(wv, self.freq_field)
-
-            if self.current_source_id is None:
-                self.current_source_id = source_id
-                self.current_vector = []
-
-            if self.current_source_id != source_id:
-                yield self.current_vector
-                self.current_vector = []
-                self.current_source_id = source_id
-                current_position += 1
+        for rows in pages:
+            # split the page into documents in one pass
+            sources = numpy.fromiter((row[0] for row in rows), dtype=numpy.int64, count=len(rows))
+            starts = numpy.flatnonzero(numpy.r_[True, sources[1:] != sources[:-1]]).tolist()
+            ends = starts[1:] + [len(rows)]
+            postings = [(word_idx, freq) for source_id, word_idx, freq in rows]
 
+            for start, end in zip(starts, ends):
+                self.current_source_id = rows[start][0]
+                yield postings[start:end]
+
+                current_position += 1
                 if current_position % 10000 == 0:
-                    logger.info("Iterating through database word-vectors: item %d" % current_position)
+                    logger.info("Iterating through database word-vectors: item %d / %s" % (
+                        current_position, self.dictionary.corpus_num_docs))
 
-            self.current_vector.append((word_idx, freq))
+    def __len__(self):
+        if self.after is not None:
+            return self.wv_class.objects.filter(dictionary=self.dictionary, source__gt=self.after)\
+                .aggregate(Count('source', distinct=True))['source__count']
 
-        # one more extra one
-        yield self.current_vector
+        # recorded during vectorization; only counted here if unknown
+        if self.dictionary.corpus_num_docs is None:
+            self.dictionary._refresh_corpus_stats(wv_class=self.wv_class)
+        return self.dictionary.corpus_num_docs
 
-    def __len__(self):
-        from django.db.models import Count
-        count = self.wv_class.objects.filter(dictionary=self.dictionary).aggregate(Count('source', distinct=True))
-        if count:
-            return count['source__count']
 
 
+class WatermarkTracker(object):
+    """Passes (source_id, item) pairs through, remembering the last source id."""
+
+    def __init__(self, items):
+        self.items = items
+        self.last_source_id = None
+
+    def __iter__(self):
+        for source_id, item in self.items:
+            self.last_source_id = source_id
+            yield source_id, item
+
+
+_worker_tokenizer = None
+def _init_tokenizer_worker(tokenizer_class, stoplist):
+    global _worker_tokenizer
+    _worker_tokenizer = tokenizer_class(stoplist=stoplist)
+
+def _tokenize_chunk(items):
+    tokenize = _worker_tokenizer.tokenize
+    return [(key, tokenize(text)) for key, text in items]
+
 
 class Tokenizer(object):
-    def __init__(self, texts=None, stoplist=None):
+    """
+    Splits texts into lists of words.
+
+    With workers > 1, texts are tokenized in a process pool,
+    chunk_size texts at a time. At most two chunks per worker
+    are in flight, and results come back in input order.
+    """
+
+    def __init__(self, texts=None, stoplist=None, workers=1, chunk_size=1000):
         self.texts = texts
-        self.stoplist = stoplist
+        self.stoplist = frozenset(stoplist) if stoplist is not None else frozenset()
+        self.workers = resolve_workers(workers)
+        self.chunk_size = chunk_size
         self.max_length = Word._meta.get_field('text').max_length
-        if self.stoplist is None:
-            self.stoplist = []
 
     def __iter__(self):
         if self.texts is None:
             raise RuntimeError("Tokenizer can only iterate if given texts")
 
-        for text in self.texts:
-            yield self.tokenize(text)
+        if self.workers <= 1:
+            for text in self.texts:
+                yield self.tokenize(text)
+        else:
+            items = ((None, text) for text in self.texts)
+            for key, words in self.tokenize_items(items):
+                yield words
+
+    def tokenize_items(self, items):
+        """Tokenize (key, text) pairs, yielding (key, words) in input order."""
+        if self.workers <= 1:
+            for key, text in items:
+                yield key, self.tokenize(text)
+            return
+
+        logger.info("Tokenizing with %d worker processes" % self.workers)
+
+        # The pool is forked before items starts reading from the database
+        pool = make_pool(self.workers,
+                         initializer=_init_tokenizer_worker,
+                         initargs=(self.__class__, self.stoplist))
+        try:
+            chunks = chunked(items, self.chunk_size)
+            for results in ordered_imap(pool, _tokenize_chunk, chunks, max_pending=2 * self.workers):
+                for result in results:
+                    yield result
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
 
     def tokenize(self, text):
         words = []
@@ -113,8 +283,47 @@ class WordTokenizer(Tokenizer):
         return nltk.word_tokenize(text)
 
 class TaskContext(object):
-
-    def __init__(self, name, queryset, textfield, word_vector_class, topic_vector_class, tokenizer, minimum_frequency=2, stoplist=None):
+    """
+    Settings and entry points for running the topic pipeline on one dataset.
+
+    Options:
+        minimum_frequency     drop words found in fewer documents than this
+        stoplist              words to leave out of the dictionary
+        tokenizer_workers     processes for tokenization ('auto' for one per core)
+        tokenizer_chunk_size  texts handed to a tokenizer process at a time
+        use_token_spool       spool tokens to disk while building the dictionary,
+                              so build_bows does not tokenize again
+        weighting             word vector weighting, 'legacy' or a SMART code
+                              such as 'ntc' (see weighting.py)
+        corpus_backend        where word vectors are kept: 'db' (the word vector
+                              table) or 'sparse' (CSR files, see corpus.py)
+        export_db             with the sparse backend, also fill the word vector table
+        db_read_mode          how the word vector table is read: 'keyset' pages
+                              or a MySQL 'server' side cursor
+        cache_corpus          read the word vector table once per run and replay
+                              it for later stages (from memory if it is small,
+                              else from temporary files); see cleanup()
+        inference_workers     processes for topic inference in apply_lda
+                              and bound computation in evaluate_lda
+        inference_chunk_size  documents per batched inference call
+        holdout_fraction      share of documents build_lda leaves out of
+                              training, for evaluate_lda (see evaluation.py)
+        holdout_seed          seed for the held-out split
+        eval_sample_size      evaluate_lda uses about this many documents
+                              (None for all)
+        lda_workers           LdaMulticore worker processes, or 'auto'
+        lda_chunksize         documents per training chunk, or 'auto' to
+                              time a few sizes on a sample first
+        lda_passes            passes over the corpus
+        lda_batch             batch instead of online training
+    """
+
+    def __init__(self, name, queryset, textfield, word_vector_class, topic_vector_class, tokenizer, minimum_frequency=2, stoplist=None,
+                 tokenizer_workers=1, tokenizer_chunk_size=1000, use_token_spool=True, weighting=DEFAULT_SCHEME,
+                 corpus_backend='db', export_db=True, db_read_mode='keyset', cache_corpus=True,
+                 inference_workers=1, inference_chunk_size=2000,
+                 holdout_fraction=0, holdout_seed=0, eval_sample_size=None,
+                 lda_workers='auto', lda_chunksize=2000, lda_passes=1, lda_batch=False):
         self.name = name
         self.queryset = queryset
         self.textfield = textfield
@@ -123,6 +332,24 @@ class TaskContext(object):
         self.tokenizer = tokenizer
         self.stoplist = stoplist
         self.minimum_frequency=minimum_frequency
+        self.tokenizer_workers = tokenizer_workers
+        self.tokenizer_chunk_size = tokenizer_chunk_size
+        self.use_token_spool = use_token_spool
+        self.weighting = weighting
+        self.corpus_backend = corpus_backend
+        self.export_db = export_db
+        self.db_read_mode = db_read_mode
+        self.cache_corpus = cache_corpus
+        self.inference_workers = inference_workers
+        self.inference_chunk_size = inference_chunk_size
+        self.holdout_fraction = holdout_fraction
+        self.holdout_seed = holdout_seed
+        self.eval_sample_size = eval_sample_size
+        self.lda_workers = lda_workers
+        self.lda_chunksize = lda_chunksize
+        self.lda_passes = lda_passes
+        self.lda_batch = lda_batch
+        self._corpus_caches = {}
 
     def queryset_str(self):
         return str(self.queryset.query)
@@ -135,6 +362,9 @@ class TaskContext(object):
             stoplist=self.stoplist is not None,
             minimum_frequency=self.minimum_frequency
         )
+        if self.weighting != DEFAULT_SCHEME:
+            # word vectors are stored with the dictionary
+            settings['weighting'] = self.weighting
 
         import json
         return json.dumps(settings, sort_keys=True)
@@ -146,45 +376,269 @@ class TaskContext(object):
         return results.last()
 
 
+    def get_tokenizer(self, texts=None):
+        return self.tokenizer(texts, stoplist=self.stoplist,
+                              workers=self.tokenizer_workers,
+                              chunk_size=self.tokenizer_chunk_size)
+
+    def get_token_spool(self):
+        return TokenSpool(self.name, self.get_dict_settings())
+
     def build_dictionary(self):
 
         texts = DbTextIterator(self.queryset, textfield=self.textfield)
 
-        tokenized_texts = self.tokenizer(texts, stoplist=self.stoplist)
+        tokenized_items = self.get_tokenizer().tokenize_items(texts.iter_items())
+        if self.use_token_spool:
+            # keep the tokens around for build_bows
+            tokenized_items = self.get_token_spool().record(tokenized_items)
 
-        return Dictionary._create_from_texts(tokenized_texts=tokenized_texts,
-                                             name=self.name,
-                                             minimum_frequency=self.minimum_frequency,
-                                             dataset=self.queryset.model.__name__,
-                                             settings=self.get_dict_settings())
+        watermark = WatermarkTracker(tokenized_items)
+        tokenized_texts = (words for source_id, words in watermark)
 
-    def bows_exist(self, dictionary):
-        return self.word_vector_class.objects.filter(dictionary=dictionary).exists()
+        dictionary = Dictionary._create_from_texts(tokenized_texts=tokenized_texts,
+                                                   name=self.name,
+                                                   minimum_frequency=self.minimum_frequency,
+                                                   dataset=self.queryset.model.__name__,
+                                                   settings=self.get_dict_settings())
 
+        dictionary.source_watermark = watermark.last_source_id
+        dictionary.save(update_fields=['source_watermark'])
+        return dictionary
 
-    def build_bows(self, dictionary):
+    def update_dictionary(self, dictionary, reprune=False):
+        """
+        Add documents newer than the dictionary's source watermark.
+        Returns the number of documents added.
+        """
+        queryset = self.queryset
+        if dictionary.source_watermark is not None:
+            queryset = queryset.filter(pk__gt=dictionary.source_watermark)
 
-        texts = DbTextIterator(self.queryset, textfield=self.textfield)
-        tokenized_texts = self.tokenizer(texts, stoplist=self.stoplist)
+        logger.info("Updating dictionary %d with documents after %s" % (dictionary.id, dictionary.source_watermark))
 
-        dictionary._vectorize_corpus(queryset=self.queryset,
-                                     tokenizer=tokenized_texts,
-                                     wv_class=self.word_vector_class,
-                                     textfield=self.textfield)
+        texts = DbTextIterator(queryset, textfield=self.textfield)
+        tokenized_items = self.get_tokenizer().tokenize_items(texts.iter_items())
 
-    def build_lda(self, dictionary, num_topics=30):
-        corpus = DbWordVectorIterator(dictionary, self.word_vector_class)
-        return dictionary._build_lda(self.name, corpus, num_topics=num_topics)
+        return dictionary._update_from_texts(tokenized_items,
+                                             minimum_frequency=self.minimum_frequency,
+                                             reprune=reprune)
+
+    def get_corpus_store(self, dictionary):
+        if self.corpus_backend == 'sparse':
+            return SparseCorpusStore(dictionary)
+        return None
+
+    def get_corpus(self, dictionary, after=None):
+        """The dictionary's bows, optionally only for sources after the given id."""
+        store = self.get_corpus_store(dictionary)
+        if store is not None:
+            # already file-backed
+            corpus = store.corpus()
+            return corpus if after is None else corpus.since(after)
+
+        if after is not None:
+            if dictionary.id in self._corpus_caches:
+                return self._corpus_caches[dictionary.id].materialize().since(after)
+            return DbWordVectorIterator(dictionary, self.word_vector_class, mode=self.db_read_mode, after=after)
+
+        corpus = DbWordVectorIterator(dictionary, self.word_vector_class, mode=self.db_read_mode)
+        if not self.cache_corpus:
+            return corpus
+
+        if dictionary.id not in self._corpus_caches:
+            self._corpus_caches[dictionary.id] = CorpusCache(corpus, num_postings=dictionary.corpus_num_postings)
+        return self._corpus_caches[dictionary.id].materialize()
+
+    def cleanup(self):
+        """Drop cached corpora and their temporary files."""
+        for cache in self._corpus_caches.values():
+            cache.cleanup()
+        self._corpus_caches = {}
 
-    def apply_lda(self, dictionary, model, lda=None):
-        corpus = DbWordVectorIterator(dictionary, self.word_vector_class)
-        return dictionary._apply_lda(model, corpus, topicvector_class=self.topic_vector_class, lda=lda)
+    def bows_exist(self, dictionary):
+        store = self.get_corpus_store(dictionary)
+        if store is not None:
+            return store.exists()
+        return self.word_vector_class.objects.filter(dictionary=dictionary).exists()
 
-    def evaluate_lda(self, dictionary, model, lda=None):
-        corpus = DbWordVectorIterator(dictionary, self.word_vector_class)
-        return dictionary._evaluate_lda(model, corpus, lda=lda)
+    def iter_bows(self, dictionary, after=None):
+        """
+        Yield (source_id, bow) pairs for the dataset, optionally only
+        for sources after the given id.
+        Documents in the token spool are read from there,
+        anything newer is read from the database and tokenized.
+        """
+        gdict = dictionary.gensim_dictionary
+        queryset = self.queryset
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after)
+
+        spool = self.get_token_spool()
+        if self.use_token_spool and spool.is_valid():
+            logger.info("Reading tokens from spool %s" % spool.path)
+            for item in spool.iter_bows(gdict, min_source_id=after):
+                yield item
+
+            if spool.max_source_id is not None:
+                queryset = queryset.filter(pk__gt=spool.max_source_id)
+
+        texts = DbTextIterator(queryset, textfield=self.textfield)
+        for source_id, words in self.get_tokenizer().tokenize_items(texts.iter_items()):
+            yield source_id, gdict.doc2bow(words)
+
+    def _recover_bows(self, dictionary, store, export_db):
+        """
+        Clean up after an interrupted build_bows and return the id
+        of the last source whose word vectors are complete.
+        """
+        after = dictionary.bows_watermark
+        word_vectors = self.word_vector_class.objects.filter(dictionary=dictionary)
+
+        if store is not None:
+            # segments only appear once complete
+            store_max = store.max_source_id()
+            if store_max is not None:
+                after = max(after, store_max)
+            if export_db:
+                (word_vectors if after is None else word_vectors.filter(source__gt=after)).delete()
+        elif after is None:
+            # Written in source order by a single writer, as were dictionaries
+            # vectorized before checkpoints existed: only the last source
+            # may be incomplete.
+            last = word_vectors.aggregate(last=Max('source'))['last']
+            if last is not None:
+                word_vectors.filter(source=last).delete()
+                after = word_vectors.aggregate(last=Max('source'))['last']
+        else:
+            # With writer threads, batches after the last checkpoint may
+            # have been committed out of order, so they all go. A watermark
+            # of 0 is a threaded run that had no checkpoint yet.
+            word_vectors.filter(source__gt=after).delete()
+            if after == 0:
+                after = None
+
+        logger.info("Resuming vectorization after source %s" % after)
+        dictionary.bows_watermark = after
+        dictionary._refresh_corpus_stats(wv_class=self.word_vector_class, corpus_store=store)
+        return after
 
-def get_chat_context(name):
+    def build_bows(self, dictionary):
+        """
+        Vectorize the documents that have no word vectors yet, so this
+        resumes an interrupted run and picks up newly added documents.
+        """
+        store = self.get_corpus_store(dictionary)
+        export_db = self.export_db or self.corpus_backend == 'db'
+
+        if dictionary.corpus_num_docs is None:
+            # never finished (or predates the corpus statistics)
+            after = self._recover_bows(dictionary, store, export_db)
+        else:
+            after = dictionary.bows_watermark
+
+        queryset = self.queryset if after is None else self.queryset.filter(pk__gt=after)
+        total_count = queryset.count()
+        if total_count == 0 and dictionary.corpus_num_docs is not None:
+            logger.info("No documents after source %s to vectorize" % after)
+            return
+
+        dictionary._vectorize_corpus(bows=self.iter_bows(dictionary, after=after),
+                                     wv_class=self.word_vector_class,
+                                     total_count=total_count,
+                                     weighting=self.weighting,
+                                     corpus_store=store,
+                                     export_db=export_db,
+                                     append=after is not None)
+
+    def get_training_config(self, **overrides):
+        options = dict(workers=self.lda_workers, chunksize=self.lda_chunksize,
+                       passes=self.lda_passes, batch=self.lda_batch)
+        options.update(overrides)
+        return TrainingConfig(**options)
+
+    def build_lda(self, dictionary, num_topics=30, training=None):
+        corpus = self.get_corpus(dictionary)
+        if training is None:
+            training = self.get_training_config()
+        return dictionary._build_lda(self.name, corpus, num_topics=num_topics,
+                                     holdout_fraction=self.holdout_fraction,
+                                     holdout_seed=self.holdout_seed,
+                                     training=training)
+
+    def update_lda(self, dictionary, model, lda=None, after=None):
+        """
+        Continue training model on documents vectorized since it was
+        trained, or on those after the given source id. Returns the new
+        (model, lda), or (model, lda) unchanged if there is nothing new.
+        """
+        if after is None:
+            after = model.source_watermark
+        if after is None:
+            # the model would be trained on its own documents again
+            logger.warn("Model %d does not record the documents it was trained on; "
+                        "pass the source id to update after" % model.id)
+            return (model, lda)
+
+        if after == dictionary.bows_watermark:
+            logger.info("No new documents for model %d" % model.id)
+            return (model, lda)
+
+        corpus = self.get_corpus(dictionary, after=after)
+        return dictionary._update_lda(model, corpus, lda=lda)
+
+    def get_corpus_segments(self, dictionary):
+        """
+        Paths of the dictionary's corpus as memory-mappable segments,
+        for worker processes. Copies the word vector table to a temporary
+        segment if needed; see cleanup().
+        """
+        store = self.get_corpus_store(dictionary)
+        if store is not None:
+            return store.segment_paths()
+
+        cache = self._corpus_caches.get(dictionary.id)
+        if cache is None or cache.in_memory:
+            corpus = DbWordVectorIterator(dictionary, self.word_vector_class, mode=self.db_read_mode)
+            cache = CorpusCache(corpus, max_memory_postings=0)
+            self._corpus_caches[dictionary.id] = cache
+
+        cache.materialize()
+        return cache.segment_paths()
+
+    def sweep_lda(self, dictionary, topic_counts, max_workers='auto'):
+        """
+        Train a model for each topic count in parallel (see sweep.py).
+        Returns a list of (num_topics, model, docs_per_second).
+        """
+        from sweep import run_sweep
+
+        segment_paths = self.get_corpus_segments(dictionary)
+
+        training = self.get_training_config(workers=1)
+        if training.chunksize == 'auto':
+            training = training.resolve(open_segments(segment_paths), sorted(topic_counts)[len(topic_counts) // 2],
+                                        dictionary.gensim_dictionary)
+
+        return run_sweep(dictionary, self.name, segment_paths, topic_counts,
+                         training, max_workers=max_workers,
+                         holdout_fraction=self.holdout_fraction, holdout_seed=self.holdout_seed,
+                         sample_size=self.eval_sample_size, chunk_size=self.inference_chunk_size)
+
+    def apply_lda(self, dictionary, model, lda=None, after=None):
+        corpus = self.get_corpus(dictionary, after=after)
+        return dictionary._apply_lda(model, corpus, topicvector_class=self.topic_vector_class, lda=lda,
+                                     workers=self.inference_workers,
+                                     chunk_size=self.inference_chunk_size)
+
+    def evaluate_lda(self, dictionary, model, lda=None, after=None):
+        corpus = self.get_corpus(dictionary, after=after)
+        return dictionary._evaluate_lda(model, corpus, lda=lda,
+                                        sample_size=self.eval_sample_size,
+                                        workers=self.inference_workers,
+                                        chunk_size=self.inference_chunk_size)
+
+def get_chat_context(name, **options):
 
     Message = django_apps.get_model('textprizm.Message')
     queryset = Message.objects.filter(type=0, participant_id__gt=2)
@@ -196,10 +650,11 @@ def get_chat_context(name):
                        topic_vector_class=TextPrizmTopic,
                        tokenizer=WordTokenizer,
                        stoplist=get_stoplist(),
-                       minimum_frequency=4)
+                       minimum_frequency=4,
+                       **options)
 
 
-def get_twitter_context(name):
+def get_twitter_context(name, **options):
 
     Tweet = django_apps.get_model(settings.TWITTER_STREAM_TWEET_MODEL)
     queryset = Tweet.objects.all()
@@ -211,5 +666,6 @@ def get_twitter_context(name):
                        topic_vector_class=TweetTopic,
                        tokenizer=WordTokenizer,
                        stoplist=get_stoplist(),
-                       minimum_frequency=4)
+                       minimum_frequency=4,
+                       **options)
 
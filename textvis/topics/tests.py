@@ -1,3 +1,1082 @@
+from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
 
-# Create your tests here.
+import json
+import numpy
+import tempfile
+from path import path
+
+import artifacts
+import bulk
+import caching
+from corpus import SparseCorpus, SparseCorpusStore, CorpusCache
+from examples import ExampleIndex
+from evaluation import unit_hash, SplitCorpus, iter_sample, evaluate_perplexity
+from inference import infer_topics, iter_topic_mixtures
+from models import Dictionary, Word, TopicModel, Topic, TopicWord, TopicWordGrid, TopicExample, TextPrizmWord, TextPrizmTopic
+from parallel import chunked
+from spool import TokenSpool
+from sweep import resolve_max_workers, run_sweep, report_rows, REPORT_COLUMNS
+from tasks import TaskContext, Tokenizer, WordTokenizer, DbWordVectorIterator
+from training import TrainingConfig, auto_workers, take_sample, calibrate_chunksize
+from weighting import TermWeighting
+from textvis.textprizm.models import DataSet, Session, Participant, Message
+
+
+def make_dictionary(texts=(('a', 'b'), ('a', 'c'), ('b', 'c'), ('d', 'e'), ('d', 'f'), ('g', 'h'))):
+    return Dictionary._create_from_texts([list(text) for text in texts], name='test', dataset='test',
+                                         settings='{}', minimum_frequency=2)
+
+
+def make_corpus(documents):
+    """A SparseCorpus of (source_id, bow) pairs."""
+    source_ids = numpy.array([source_id for source_id, bow in documents], dtype=numpy.int64)
+    indptr = numpy.r_[0, numpy.cumsum([len(bow) for source_id, bow in documents])].astype(numpy.int64)
+    postings = numpy.array([posting for source_id, bow in documents for posting in bow],
+                           dtype=numpy.float64).reshape(-1, 2)
+    return SparseCorpus([(source_ids, indptr, postings[:, 0].astype(numpy.int32),
+                          postings[:, 1].astype(numpy.float32))])
+
+
+def make_context(**options):
+    return TaskContext('test', TextPrizmWord.objects.none(), 'message',
+                       TextPrizmWord, TextPrizmTopic, WordTokenizer, **options)
+
+
+class TopicsTestCase(TestCase):
+    """Gives each test an empty TOPICS_DATA_DIR and topics cache."""
+
+    def setUp(self):
+        caching.get_cache().clear()
+        caching.reset_stats()
+        self.data_dir = path(tempfile.mkdtemp(prefix='topics-test-'))
+        self.data_dir_settings = override_settings(TOPICS_DATA_DIR=self.data_dir,
+                                                   TOPICS_MODELS_DIR=self.data_dir / 'models')
+        self.data_dir_settings.enable()
+
+    def tearDown(self):
+        self.data_dir_settings.disable()
+        self.data_dir.rmtree_p()
+
+
+class TokenizerTest(TestCase):
+    texts = ['The quick brown fox', 'jumps over', '', 'THE lazy dog'] * 5
+
+    def test_tokenize(self):
+        tokenizer = Tokenizer(stoplist=['the'])
+        self.assertEqual(tokenizer.tokenize('The quick  FOX'), ['quick', 'fox'])
+        self.assertEqual(len(tokenizer.tokenize('x' * 500)[0]), tokenizer.max_length - 1)
+
+    def test_pool_keeps_order(self):
+        items = list(enumerate(self.texts))
+        serial = list(Tokenizer(stoplist=['the']).tokenize_items(items))
+        pooled = list(Tokenizer(stoplist=['the'], workers=2, chunk_size=3).tokenize_items(iter(items)))
+        self.assertEqual(pooled, serial)
+        self.assertEqual(serial[3], (3, ['lazy', 'dog']))
+
+    def test_iterate_texts(self):
+        self.assertEqual(list(Tokenizer(self.texts, workers=2, chunk_size=3)),
+                         [text.lower().split() for text in self.texts])
+
+    def test_chunked(self):
+        self.assertEqual(list(chunked(xrange(7), 3)), [[0, 1, 2], [3, 4, 5], [6]])
+        self.assertEqual(list(chunked([], 3)), [])
+
+
+class TermWeightingTest(TestCase):
+
+    def test_legacy(self):
+        weighting = TermWeighting('legacy', {0: 2, 1: 10}, 100)
+        weights = weighting.weigh([0, 1], [3, 1], [2])
+        numpy.testing.assert_allclose(weights, [3 * numpy.log(100) / numpy.log(2),
+                                                numpy.log(100) / numpy.log(10)])
+
+    def test_legacy_rare_words_are_finite(self):
+        # index 2 has no document frequency at all
+        weighting = TermWeighting('legacy', {0: 1, 1: 5, 3: 4}, 100)
+        weights = weighting.weigh([0, 2], [1, 1], [2])
+        self.assertTrue(numpy.isfinite(weights).all())
+        numpy.testing.assert_allclose(weights, numpy.log(100) / numpy.log(2))
+
+    def test_ntc_has_unit_length(self):
+        weighting = TermWeighting('ntc', {0: 1, 1: 5, 2: 50}, 100)
+        weights = weighting.weigh([0, 1, 2, 1], [2, 1, 1, 4], [3, 1])
+        self.assertAlmostEqual(numpy.sum(weights[:3] ** 2), 1.0)
+        self.assertAlmostEqual(weights[3], 1.0)
+
+    def test_augmented_tf(self):
+        weighting = TermWeighting('ann', {0: 1, 1: 1}, 10)
+        weights = weighting.weigh([0, 1], [4, 2], [2])
+        numpy.testing.assert_allclose(weights, [1.0, 0.75])
+
+    def test_unknown_scheme(self):
+        self.assertRaises(ValueError, TermWeighting, 'xyz', {}, 10)
+
+
+class DictionaryUpdateTest(TopicsTestCase):
+
+    def setUp(self):
+        super(DictionaryUpdateTest, self).setUp()
+        self.dictionary = make_dictionary()
+
+    def reload(self):
+        # drops the loaded gensim dictionary, so the cached file is read
+        return Dictionary.objects.get(pk=self.dictionary.pk)
+
+    def word_dfs(self):
+        return dict(self.dictionary.words.values_list('text', 'document_frequency'))
+
+    def test_created(self):
+        self.assertEqual(self.word_dfs(), {'a': 2, 'b': 2, 'c': 2, 'd': 2})
+        self.assertEqual(self.reload().pruned_dfs, {'e': 1, 'f': 1, 'g': 1, 'h': 1})
+
+    def test_pruned_words_count_their_old_documents(self):
+        dictionary = self.reload()
+        added = dictionary._update_from_texts([(7, ['e', 'x']), (8, ['x', 'a']), (9, ['y'])],
+                                              minimum_frequency=2)
+        self.assertEqual(added, 3)
+
+        self.assertEqual(self.word_dfs(), {'a': 3, 'b': 2, 'c': 2, 'd': 2, 'e': 2, 'x': 2})
+        # new words go after the existing ones, in token order
+        indices = dict(dictionary.words.values_list('text', 'index'))
+        self.assertEqual((indices['e'], indices['x']), (4, 5))
+
+        dictionary = self.reload()
+        self.assertEqual(dictionary.num_docs, 9)
+        self.assertEqual(dictionary.source_watermark, 9)
+        self.assertEqual(dictionary.pruned_dfs, {'f': 1, 'g': 1, 'h': 1, 'y': 1})
+        self.assertEqual(dictionary.gensim_dictionary.dfs[indices['e']], 2)
+        self.assertEqual(dictionary.get_word_id(indices['x']), dictionary.words.get(text='x').id)
+
+    def test_unknown_pruned_words(self):
+        dictionary = self.reload()
+        dictionary._cache_path().remove()
+        dictionary = self.reload()
+        self.assertIsNone(dictionary.pruned_dfs)
+
+        dictionary._update_from_texts([(7, ['e']), (8, ['e', 'f'])], minimum_frequency=2)
+        self.assertEqual(self.word_dfs()['e'], 2)
+        self.assertNotIn('f', self.word_dfs())
+
+    def test_reprune_keeps_topic_words(self):
+        model = TopicModel.objects.create(dictionary=self.dictionary, name='test', description='')
+        topic = Topic.objects.create(model=model, name='', description='', index=0, alpha=0.1)
+        word_b = self.dictionary.words.get(text='b')
+        TopicWord.objects.create(topic=topic, word=word_b, word_index=word_b.index, probability=0.5)
+        index_a = self.dictionary.words.get(text='a').index
+
+        dictionary = self.reload()
+        dictionary._update_from_texts([(source_id, ['a', 'b']) for source_id in range(7, 11)],
+                                      minimum_frequency=2, reprune=True)
+
+        # 'a' and 'b' are now in 6 of 10 documents
+        self.assertEqual(set(self.word_dfs()), set(['b', 'c', 'd']))
+        self.assertEqual(TopicWord.objects.get().word_id, word_b.id)
+
+        dictionary = self.reload()
+        self.assertEqual(dictionary.pruned_dfs['a'], 6)
+        self.assertIsNone(dictionary.corpus_num_docs)
+        self.assertIsNone(dictionary.get_word_id(index_a))
+
+
+class VectorizeTest(TopicsTestCase):
+
+    def setUp(self):
+        super(VectorizeTest, self).setUp()
+        self.dictionary = make_dictionary()
+        self.context = make_context()
+
+    def bows(self, source_ids, fail=False):
+        for source_id in source_ids:
+            yield source_id, [(0, 1), (1, 2)]
+        if fail:
+            raise RuntimeError("interrupted")
+
+    def test_no_documents_no_segment(self):
+        store = SparseCorpusStore(self.dictionary)
+        self.dictionary._vectorize_corpus(self.bows([]), TextPrizmWord, 0,
+                                          corpus_store=store, export_db=False, append=True)
+        self.assertEqual(store.segment_paths(), [])
+
+    def test_segment(self):
+        store = SparseCorpusStore(self.dictionary)
+        self.dictionary._vectorize_corpus(self.bows([3, 5, 8]), TextPrizmWord, 3, batch_size=2,
+                                          corpus_store=store, export_db=False)
+        self.assertEqual(len(store.segment_paths()), 1)
+        self.assertEqual(store.max_source_id(), 8)
+        self.assertEqual((self.dictionary.corpus_num_docs, self.dictionary.corpus_num_postings), (3, 6))
+        self.assertEqual(self.dictionary.bows_watermark, 8)
+
+    def test_resume_from_checkpoint(self):
+        with self.assertRaises(RuntimeError):
+            self.dictionary._vectorize_corpus(self.bows(range(1, 6), fail=True), TextPrizmWord, 5,
+                                              batch_size=2, checkpoint_every=2)
+
+        dictionary = Dictionary.objects.get(pk=self.dictionary.pk)
+        self.assertEqual(dictionary.bows_watermark, 4)
+        self.assertIsNone(dictionary.corpus_num_docs)
+
+        # as if a writer thread had committed a later batch first
+        TextPrizmWord.objects.create(dictionary=dictionary, word_id=dictionary.get_word_id(0),
+                                     word_index=0, count=1, tfidf=1.0, source_id=7)
+
+        after = self.context._recover_bows(dictionary, None, True)
+        self.assertEqual(after, 4)
+        self.assertEqual(sorted(set(TextPrizmWord.objects.values_list('source_id', flat=True))), [1, 2, 3, 4])
+        self.assertEqual((dictionary.corpus_num_docs, dictionary.corpus_max_source_id), (4, 4))
+
+    def write_rows(self, source_ids):
+        for source_id in source_ids:
+            TextPrizmWord.objects.create(dictionary=self.dictionary, word_id=self.dictionary.get_word_id(0),
+                                         word_index=0, count=1, tfidf=1.0, source_id=source_id)
+
+    def test_resume_without_checkpoint(self):
+        # vectorized before checkpoints and corpus statistics existed
+        self.write_rows([1, 2, 2, 5, 5])
+        self.assertIsNone(self.dictionary.bows_watermark)
+
+        after = self.context._recover_bows(self.dictionary, None, True)
+        self.assertEqual(after, 2)
+        self.assertEqual(list(TextPrizmWord.objects.values_list('source_id', flat=True).order_by('source')),
+                         [1, 2, 2])
+        self.assertEqual(self.dictionary.corpus_num_docs, 2)
+
+    def test_threaded_run_without_checkpoint(self):
+        # how _vectorize_corpus marks a new run with writer threads
+        self.dictionary.bows_watermark = 0
+        self.write_rows([1, 2])
+        self.assertIsNone(self.context._recover_bows(self.dictionary, None, True))
+        self.assertFalse(TextPrizmWord.objects.exists())
+
+
+class UpdateLdaTest(TopicsTestCase):
+
+    def test_model_without_watermark_is_not_updated(self):
+        dictionary = make_dictionary()
+        dictionary.bows_watermark = 10
+        model = TopicModel.objects.create(dictionary=dictionary, name='test', description='')
+
+        self.assertEqual(make_context().update_lda(dictionary, model), (model, None))
+        self.assertEqual(TopicModel.objects.count(), 1)
+
+    def test_no_new_documents(self):
+        dictionary = make_dictionary()
+        dictionary.bows_watermark = 10
+        model = TopicModel.objects.create(dictionary=dictionary, name='test', description='',
+                                          source_watermark=10)
+
+        self.assertEqual(make_context().update_lda(dictionary, model), (model, None))
+
+
+class EvaluationTest(TestCase):
+
+    def setUp(self):
+        self.corpus = make_corpus([(source_id, [(source_id % 5, 1.0), (5 + source_id % 3, 2.0)])
+                                   for source_id in range(1, 1001)])
+
+    def source_ids(self, documents):
+        return [self.corpus.current_source_id for bow in documents]
+
+    def test_unit_hash(self):
+        hashes = [unit_hash(source_id) for source_id in range(1000)]
+        self.assertTrue(all(0 <= h < 1 for h in hashes))
+        self.assertEqual(hashes[7], unit_hash(7))
+        self.assertNotEqual(unit_hash(7, seed=1), unit_hash(7))
+        self.assertAlmostEqual(numpy.mean(hashes), 0.5, delta=0.05)
+
+    def test_split(self):
+        training = SplitCorpus(self.corpus, 0.2, seed=3)
+        held_out = SplitCorpus(self.corpus, 0.2, seed=3, held_out=True)
+        training_ids = set(self.source_ids(training))
+        held_out_ids = set(self.source_ids(held_out))
+
+        self.assertFalse(training_ids & held_out_ids)
+        self.assertEqual(len(training_ids | held_out_ids), 1000)
+        self.assertAlmostEqual(len(held_out_ids), 200, delta=50)
+        self.assertEqual((len(training), len(held_out)), (len(training_ids), len(held_out_ids)))
+        self.assertEqual(held_out_ids, set(self.source_ids(held_out)))
+
+    def test_sample_spans_the_corpus(self):
+        documents, expected = iter_sample(self.corpus, sample_size=100)
+        source_ids = self.source_ids(documents)
+
+        self.assertEqual(expected, 100)
+        self.assertAlmostEqual(len(source_ids), 100, delta=40)
+        self.assertTrue(max(source_ids) > 900)
+
+    def test_no_sample(self):
+        documents, expected = iter_sample(self.corpus, holdout_fraction=0.5)
+        self.assertEqual(expected, 500)
+        self.assertEqual(set(self.source_ids(documents)),
+                         set(self.source_ids(SplitCorpus(self.corpus, 0.5, held_out=True))))
+
+    def test_evaluate_perplexity(self):
+        from gensim.models import LdaModel
+
+        lda = LdaModel(corpus=self.corpus, num_topics=2, passes=1)
+        documents, expected = iter_sample(self.corpus, sample_size=300)
+        result = evaluate_perplexity(lda, None, documents, expected, chunk_size=50)
+
+        self.assertTrue(result['bound'] < 0)
+        self.assertTrue(result['lower'] <= result['bound'] <= result['upper'])
+        self.assertEqual(result['num_words'], 3.0 * result['num_docs'])
+
+
+class ModelPageTest(TopicsTestCase):
+
+    def setUp(self):
+        super(ModelPageTest, self).setUp()
+        dictionary = make_dictionary()
+        self.model = TopicModel.objects.create(dictionary=dictionary, name='test', description='')
+        words = list(dictionary.words.order_by('index'))
+        for index in range(2):
+            topic = Topic.objects.create(model=self.model, name='', description='', index=index, alpha=0.5)
+            for rank, word in enumerate(words[index:index + 3]):
+                TopicWord.objects.create(topic=topic, word=word, word_index=word.index,
+                                         probability=0.5 - 0.1 * rank)
+
+    def test_grid(self):
+        grid = TopicWordGrid.build(self.model)
+        self.assertEqual(grid.num_rows, 3)
+        self.assertEqual([index for topic_id, index in grid.topics], [0, 1])
+
+        rows = grid.get_rows(1, 2)
+        self.assertEqual(len(rows), 1)
+        self.assertEqual([cell.probability for cell in rows[0]], [0.5 - 0.1] * 2)
+        self.assertEqual(TopicWordGrid.get_for_model(self.model).pk, grid.pk)
+
+    def test_word_links(self):
+        response = self.client.get(reverse('topics_model', kwargs=dict(model_id=self.model.id)))
+        self.assertEqual(response.status_code, 200)
+
+        cells = [cell for row in response.context['word_rows'] for cell in row]
+        self.assertEqual(len(cells), 6)
+        for cell in cells:
+            self.assertEqual(cell.url, reverse('topics_topic_word', kwargs=dict(
+                model_id=self.model.id, topic_id=cell.topic_id, word_id=cell.id)))
+            self.assertContains(response, cell.url)
+
+
+class ExampleDataTestCase(TopicsTestCase):
+    """A chat topic model with one topic, seven examples and one topic word."""
+
+    def setUp(self):
+        super(ExampleDataTestCase, self).setUp()
+        dictionary = make_dictionary()
+        self.model = TopicModel.objects.create(dictionary=dictionary, name='test', description='',
+                                               examples_indexed=True)
+        self.topic = Topic.objects.create(model=self.model, name='', description='', index=0, alpha=0.5)
+        self.word = dictionary.words.get(text='a')
+        self.topicword = TopicWord.objects.create(topic=self.topic, word=self.word, word_index=self.word.index,
+                                                  probability=0.5)
+
+        now = timezone.now()
+        session = Session.objects.create(set=DataSet.objects.create(name='test', created=now),
+                                         started=now, ended=now)
+        participant = Participant.objects.create(name='someone', description='')
+        for idx in range(7):
+            message = Message.objects.create(session=session, idx=idx, time=now, type=0,
+                                             participant=participant, message='message %d' % idx)
+            # pairs of equal probabilities, ordered by source id
+            probability = 0.9 - 0.1 * (idx // 2)
+            TextPrizmTopic.objects.create(topic_model=self.model, topic=self.topic,
+                                          probability=probability, source=message)
+            if idx % 2 == 0:
+                TopicExample.objects.create(topic=self.topic, word=self.word, source_id=message.id,
+                                            probability=probability, rank=idx // 2)
+
+    def examples_url(self, name, **kwargs):
+        return reverse(name, kwargs=dict(kwargs, model_id=self.model.id, topic_id=self.topic.id))
+
+
+class ExamplePagesTest(ExampleDataTestCase):
+
+    def test_cursor(self):
+        cursor = (0.1 + 0.2, 12345678901234567)
+        self.assertEqual(TextPrizmTopic.parse_cursor(TextPrizmTopic.format_cursor(cursor)), cursor)
+        self.assertRaises(ValueError, TextPrizmTopic.parse_cursor, 'nonsense')
+
+    def test_topic_pages(self):
+        source_ids = []
+        after = None
+        while True:
+            examples, after = TextPrizmTopic.get_examples_page(self.topic, after=after, page_size=3)
+            source_ids.extend(example.source_id for example in examples)
+            if after is None:
+                break
+
+        expected = [source_id for probability, source_id in
+                    sorted(TextPrizmTopic.objects.values_list('probability', 'source_id'), reverse=True)]
+        self.assertEqual(source_ids, expected)
+
+    def test_word_pages(self):
+        examples, after = TopicExample.get_examples_page(self.topic, TextPrizmTopic, word=self.word, page_size=2)
+        self.assertEqual(len(examples), 2)
+        more, last = TopicExample.get_examples_page(self.topic, TextPrizmTopic, word=self.word,
+                                                    after=after, page_size=2)
+        self.assertIsNone(last)
+
+        examples += more
+        self.assertEqual([example.source.message for example in examples],
+                         ['message 0', 'message 2', 'message 4', 'message 6'])
+        with self.assertNumQueries(0):
+            self.assertEqual(TextPrizmTopic.source_fields(examples[0].source)[0], 'someone')
+
+    def test_json_pages(self):
+        url = self.examples_url('topics_topic_word_examples_json', word_id=self.topicword.id)
+        page = json.loads(self.client.get(url, {'size': 3}).content)
+        self.assertEqual([row[2:4] for row in page['examples']],
+                         [['someone', 'message 0'], ['someone', 'message 2'], ['someone', 'message 4']])
+
+        page = json.loads(self.client.get(url, {'size': 3, 'after': page['next']}).content)
+        self.assertEqual([row[3] for row in page['examples']], ['message 6'])
+        self.assertIsNone(page['next'])
+
+    def test_word_pages_need_indexed_examples(self):
+        TopicModel.objects.filter(pk=self.model.pk).update(examples_indexed=False)
+        url = self.examples_url('topics_topic_word_examples', word_id=self.topicword.id)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get(self.examples_url('topics_topic_examples')).status_code, 200)
+
+    def test_pages_of_another_model(self):
+        other_model = TopicModel.objects.create(dictionary=self.model.dictionary, name='other', description='')
+        other_topic = Topic.objects.create(model=other_model, name='', description='', index=0, alpha=0.5)
+
+        for name, kwargs in (('topics_topic', dict(topic_id=other_topic.id)),
+                             ('topics_topic_word', dict(topic_id=other_topic.id, word_id=self.topicword.id))):
+            url = reverse(name, kwargs=dict(kwargs, model_id=self.model.id))
+            self.assertEqual(self.client.get(url).status_code, 404)
+
+    def test_browse_link_only_on_topic_pages(self):
+        topic_page = self.client.get(self.examples_url('topics_topic'))
+        self.assertContains(topic_page, self.examples_url('topics_topic_examples'))
+
+        word_page = self.client.get(self.examples_url('topics_topic_word', word_id=self.topicword.id))
+        self.assertNotContains(word_page, 'Browse all examples')
+
+
+class ApiTest(ExampleDataTestCase):
+
+    def test_topic_examples(self):
+        TopicExample.objects.filter(word__isnull=False).update(word=None)
+        response = self.client.get(self.examples_url('topics_api_topic_examples'), {'n': 2})
+        data = json.loads(response.content)
+
+        self.assertEqual(data['user_name'], ['someone', 'someone'])
+        self.assertEqual(data['text'], ['message 0', 'message 2'])
+        self.assertEqual(data['probability'], [0.9 - 0.1 * 0, 0.9 - 0.1 * 1])
+
+    def test_not_indexed(self):
+        TopicModel.objects.filter(pk=self.model.pk).update(examples_indexed=False)
+        data = json.loads(self.client.get(self.examples_url('topics_api_topic_examples'), {'n': 3}).content)
+        self.assertEqual(data['text'], ['message 1', 'message 0', 'message 3'])
+
+    def test_conditional_get(self):
+        url = reverse('topics_api_model', kwargs=dict(model_id=self.model.id))
+        response = self.client.get(url)
+        self.assertEqual(json.loads(response.content)['topics']['id'], [self.topic.id])
+        etag = response['ETag']
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.model.bump_version()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_model_words(self):
+        data = json.loads(self.client.get(reverse('topics_api_model_words',
+                                                  kwargs=dict(model_id=self.model.id))).content)
+        self.assertEqual(data['words'], ['a'])
+        self.assertEqual(data['topic_words'], [[0]])
+        self.assertEqual(data['topic_probabilities'], [[0.5]])
+
+
+class CachingTest(TopicsTestCase):
+
+    def test_make_key(self):
+        self.assertEqual(caching.make_key(3, 7, 'page', '/x/'), 'topics:3:7:page:/x/')
+        self.assertNotEqual(caching.make_key(3, 7, 'page'), caching.make_key(3, 8, 'page'))
+
+        key = caching.make_key(3, 7, 'page', u'/\xe9' * 100)
+        self.assertTrue(len(key) < 100)
+        self.assertNotEqual(key, caching.make_key(3, 7, 'page', u'/\xe8' * 100))
+
+    def test_get_or_set(self):
+        calls = []
+        compute = lambda: calls.append(1) or 'value'
+        self.assertEqual(caching.get_or_set('k', compute), 'value')
+        self.assertEqual(caching.get_or_set('k', compute), 'value')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(caching.stats(), {'hits': 1, 'misses': 1, 'hit_rate': 0.5})
+
+    def test_stats_survive_cache_clear(self):
+        caching.get_or_set('k', lambda: 'value')
+        caching.get_cache().clear()
+        self.assertEqual(caching.stats()['misses'], 1)
+
+    def test_page_invalidation(self):
+        model = TopicModel.objects.create(dictionary=make_dictionary(), name='test', description='')
+        url = reverse('topics_model', kwargs=dict(model_id=model.id))
+
+        self.client.get(url)
+        self.client.get(url)
+        self.assertEqual((caching.stats()['hits'], caching.stats()['misses']), (1, 1))
+
+        TopicModel.objects.filter(pk=model.pk).update(name='renamed')
+        self.assertNotContains(self.client.get(url), 'renamed')
+
+        model.bump_version()
+        self.assertContains(self.client.get(url), 'renamed')
+        self.assertEqual(caching.stats()['misses'], 2)
+
+
+class TokenSpoolTest(TopicsTestCase):
+    items = [(2, ['a', 'b', 'a']), (5, []), (9, ['c', 'zzz', 'd']), (12, ['b'])]
+
+    def test_round_trip(self):
+        spool = TokenSpool('test', '{"x": 1}')
+        recorded = spool.record(iter(self.items))
+        self.assertEqual(next(recorded), self.items[0])
+        self.assertFalse(spool.is_valid())
+
+        self.assertEqual(list(recorded), self.items[1:])
+        self.assertTrue(spool.is_valid())
+        self.assertEqual((spool.num_docs, spool.max_source_id), (4, 12))
+
+        gdict = make_dictionary().gensim_dictionary
+        self.assertEqual(list(spool.iter_bows(gdict)),
+                         [(source_id, sorted(gdict.doc2bow(words))) for source_id, words in self.items])
+        self.assertEqual([source_id for source_id, bow in spool.iter_bows(gdict, min_source_id=5)], [9, 12])
+
+    def test_settings_change(self):
+        list(TokenSpool('test', '{"x": 1}').record(iter(self.items)))
+        spool = TokenSpool('test', '{"x": 2}')
+        self.assertFalse(spool.is_valid())
+        self.assertRaises(RuntimeError, lambda: list(spool.iter_bows(make_dictionary().gensim_dictionary)))
+
+        list(spool.record(iter(self.items)))
+        self.assertEqual(len(self.data_dir.joinpath('spools').dirs()), 1)
+
+
+class DictionaryCacheTest(TopicsTestCase):
+
+    def test_cached_dictionary(self):
+        dictionary = make_dictionary()
+        self.assertTrue(dictionary._cache_path().exists())
+
+        dictionary = Dictionary.objects.get(pk=dictionary.pk)
+        gdict = dictionary._load_cached_gensim_dictionary()
+        self.assertEqual(sorted(gdict.token2id), ['a', 'b', 'c', 'd'])
+        self.assertEqual(gdict.num_docs, 6)
+
+        Dictionary.objects.filter(pk=dictionary.pk).update(num_docs=7)
+        self.assertIsNone(Dictionary.objects.get(pk=dictionary.pk)._load_cached_gensim_dictionary())
+
+    def test_word_ids(self):
+        dictionary = make_dictionary()
+        words = dict(dictionary.words.values_list('index', 'id'))
+
+        self.assertEqual(dictionary.get_word_id(2), words[2])
+        self.assertIsNone(dictionary.get_word_id(4))
+        self.assertIsNone(dictionary.get_word_id(-1))
+        self.assertEqual(dictionary.get_word_ids([3, 0, 9, -2]).tolist(), [words[3], words[0], -1, -1])
+
+
+class BulkWriterTest(TestCase):
+    fields = ('dictionary', 'text', 'index', 'document_frequency')
+
+    def setUp(self):
+        self.dictionary = Dictionary.objects.create(name='test', dataset='test', settings='{}')
+
+    def rows(self, count):
+        return [(self.dictionary.id, 'word%d' % i, i, i + 1) for i in range(count)]
+
+    def saved_rows(self):
+        return list(Word.objects.order_by('index').values_list('dictionary', 'text', 'index', 'document_frequency'))
+
+    def check_backend(self, backend):
+        with bulk.get_bulk_writer(Word, self.fields, batch_size=4, backend=backend) as writer:
+            for row in self.rows(6):
+                writer.write(row)
+            writer.write_many(self.rows(10)[6:])
+        self.assertEqual(writer.rows_written, 10)
+        self.assertEqual(self.saved_rows(), self.rows(10))
+
+    def test_orm(self):
+        self.check_backend('orm')
+
+    def test_executemany(self):
+        self.check_backend('executemany')
+
+    def test_auto(self):
+        self.assertEqual(bulk.resolve_backend('auto'), 'executemany')
+        self.assertEqual(bulk.resolve_threads('auto'), 0)
+        self.assertIsInstance(bulk.get_bulk_writer(Word, self.fields), bulk.ExecuteManyBulkWriter)
+
+    def test_unknown_backend(self):
+        self.assertRaises(ValueError, bulk.get_bulk_writer, Word, self.fields, backend='nonsense')
+
+    def test_error_drops_pending_rows(self):
+        with self.assertRaises(RuntimeError):
+            with bulk.get_bulk_writer(Word, self.fields, batch_size=4, backend='executemany') as writer:
+                writer.write_many(self.rows(6))
+                writer.write(self.rows(7)[6])
+                raise RuntimeError()
+        self.assertEqual(len(self.saved_rows()), 6)
+
+
+class RecordingBulkWriter(bulk.BulkWriter):
+    """Keeps batches in memory; writer threads cannot see the test database."""
+    batches = []
+    fail = False
+
+    def __init__(self, model_class, fields, batch_size=None, using='default'):
+        super(RecordingBulkWriter, self).__init__(model_class, fields, self._record,
+                                                  batch_size=batch_size, using=using)
+
+    def _record(self, rows):
+        if RecordingBulkWriter.fail:
+            raise RuntimeError("write failed")
+        RecordingBulkWriter.batches.append(rows)
+
+
+class ThreadedBulkWriterTest(TestCase):
+    fields = ('dictionary', 'text', 'index', 'document_frequency')
+
+    def setUp(self):
+        RecordingBulkWriter.batches = []
+        RecordingBulkWriter.fail = False
+        bulk.BULK_WRITERS['recording'] = RecordingBulkWriter
+
+    def tearDown(self):
+        del bulk.BULK_WRITERS['recording']
+
+    def rows(self, count):
+        return [(1, 'word%d' % i, i, 1) for i in range(count)]
+
+    def written(self):
+        return sorted(row for batch in RecordingBulkWriter.batches for row in batch)
+
+    def test_all_rows_written(self):
+        writer = bulk.get_bulk_writer(Word, self.fields, batch_size=3, backend='recording', threads=2)
+        self.assertIsInstance(writer, bulk.ThreadedBulkWriter)
+        with writer:
+            for row in self.rows(8):
+                writer.write(row)
+
+            writer.sync()
+            self.assertEqual(self.written(), self.rows(8))
+            writer.write_many(self.rows(10)[8:])
+
+        self.assertEqual(self.written(), self.rows(10))
+        self.assertEqual(writer.rows_written, 10)
+
+    def test_errors_reach_the_caller(self):
+        RecordingBulkWriter.fail = True
+        writer = bulk.get_bulk_writer(Word, self.fields, batch_size=3, backend='recording', threads=1)
+        writer.write_many(self.rows(3))
+        self.assertRaises(RuntimeError, writer.close)
+
+
+class SparseCorpusTest(TopicsTestCase):
+
+    def setUp(self):
+        super(SparseCorpusTest, self).setUp()
+        self.dictionary = make_dictionary()
+        self.store = SparseCorpusStore(self.dictionary)
+
+    def write_segment(self, documents):
+        with self.store.new_segment() as segment:
+            segment.append(numpy.array([source_id for source_id, bow in documents]),
+                           numpy.array([len(bow) for source_id, bow in documents]),
+                           numpy.array([index for source_id, bow in documents for index, count in bow]),
+                           numpy.array([count for source_id, bow in documents for index, count in bow]),
+                           numpy.array([count / 2.0 for source_id, bow in documents for index, count in bow]))
+
+    def read(self, corpus):
+        return [(corpus.current_source_id, bow) for bow in corpus]
+
+    def test_round_trip(self):
+        self.write_segment([(3, [(0, 2), (2, 1)]), (5, [(1, 4)])])
+        self.write_segment([(8, [(3, 1)]), (13, [(0, 1), (1, 1), (2, 2)])])
+
+        self.assertEqual(len(self.store.segment_paths()), 2)
+        self.assertEqual(self.store.max_source_id(), 13)
+
+        corpus = self.store.corpus()
+        self.assertEqual((len(corpus), corpus.num_postings), (4, 7))
+        self.assertEqual(self.read(corpus), [(3, [(0, 1.0), (2, 0.5)]), (5, [(1, 2.0)]),
+                                             (8, [(3, 0.5)]), (13, [(0, 0.5), (1, 0.5), (2, 1.0)])])
+        self.assertEqual(self.read(self.store.corpus(freq_field='count'))[1], (5, [(1, 4.0)]))
+
+    def test_since(self):
+        self.write_segment([(3, [(0, 2)]), (5, [(1, 4)])])
+        self.write_segment([(8, [(3, 1)]), (13, [(0, 1), (1, 1)])])
+        corpus = self.store.corpus()
+
+        self.assertEqual([source_id for source_id, bow in self.read(corpus.since(4))], [5, 8, 13])
+        self.assertEqual(self.read(corpus.since(8)), [(13, [(0, 0.5), (1, 0.5)])])
+        self.assertEqual(len(corpus.since(0)), 4)
+        self.assertEqual(len(corpus.since(13)), 0)
+
+    def test_interrupted_segment(self):
+        with self.assertRaises(RuntimeError):
+            with self.store.new_segment() as segment:
+                segment.append(numpy.array([1]), numpy.array([1]), numpy.array([0]),
+                               numpy.array([1]), numpy.array([1.0]))
+                raise RuntimeError()
+        self.assertFalse(self.store.exists())
+        self.assertEqual(self.store.path.listdir(), [])
+
+    def test_import_from_db(self):
+        for source_id, index, count in [(4, 0, 1), (4, 2, 3), (6, 1, 2)]:
+            TextPrizmWord.objects.create(dictionary=self.dictionary, word_id=self.dictionary.get_word_id(index),
+                                         word_index=index, count=count, tfidf=count * 0.25, source_id=source_id)
+        self.store.import_from_db(TextPrizmWord)
+        self.assertEqual(self.read(self.store.corpus()), [(4, [(0, 0.25), (2, 0.75)]), (6, [(1, 0.5)])])
+
+
+class WordVectorDataTestCase(TopicsTestCase):
+    documents = [(2, [(0, 1.0)]), (3, [(0, 0.5), (1, 1.5), (2, 2.0)]), (7, [(3, 1.0)]), (9, [(1, 3.0), (2, 0.25)])]
+
+    def setUp(self):
+        super(WordVectorDataTestCase, self).setUp()
+        self.dictionary = make_dictionary()
+        for source_id, bow in self.documents:
+            for index, tfidf in bow:
+                TextPrizmWord.objects.create(dictionary=self.dictionary, word_id=self.dictionary.get_word_id(index),
+                                             word_index=index, count=1, tfidf=tfidf, source_id=source_id)
+        self.dictionary._refresh_corpus_stats(wv_class=TextPrizmWord)
+
+    def read(self, corpus):
+        return [(corpus.current_source_id, sorted(bow)) for bow in corpus]
+
+
+class DbWordVectorIteratorTest(WordVectorDataTestCase):
+
+    def test_pages(self):
+        for page_size in (1, 2, 3, 100):
+            corpus = DbWordVectorIterator(self.dictionary, TextPrizmWord, page_size=page_size)
+            self.assertEqual(self.read(corpus), self.documents)
+
+    def test_after(self):
+        corpus = DbWordVectorIterator(self.dictionary, TextPrizmWord, page_size=2, after=3)
+        self.assertEqual(self.read(corpus), self.documents[2:])
+        self.assertEqual(len(corpus), 2)
+
+    def test_len_from_stats(self):
+        corpus = DbWordVectorIterator(self.dictionary, TextPrizmWord)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(corpus), 4)
+
+    def test_unknown_mode(self):
+        corpus = DbWordVectorIterator(self.dictionary, TextPrizmWord, mode='nonsense')
+        self.assertRaises(ValueError, list, corpus)
+
+
+class CorpusStatsTest(TopicsTestCase):
+
+    def setUp(self):
+        super(CorpusStatsTest, self).setUp()
+        self.dictionary = make_dictionary()
+
+    def stats(self):
+        dictionary = Dictionary.objects.get(pk=self.dictionary.pk)
+        return tuple(getattr(dictionary, name) for name in Dictionary.CORPUS_STATS_FIELDS)
+
+    def test_vectorize_and_append(self):
+        self.dictionary._vectorize_corpus(iter([(4, [(0, 1), (1, 2)]), (6, []), (8, [(2, 1)])]),
+                                          TextPrizmWord, 3)
+        self.assertEqual(self.stats(), (2, 3, 4, 8, 8))
+
+        self.dictionary._vectorize_corpus(iter([(11, [(3, 2)])]), TextPrizmWord, 1, append=True)
+        self.assertEqual(self.stats(), (3, 4, 4, 11, 11))
+
+    def test_refresh(self):
+        self.dictionary._vectorize_corpus(iter([(4, [(0, 1), (1, 2)]), (8, [(2, 1)])]), TextPrizmWord, 2)
+        Dictionary.objects.filter(pk=self.dictionary.pk).update(corpus_num_docs=None, corpus_num_postings=None)
+
+        self.dictionary._refresh_corpus_stats(wv_class=TextPrizmWord)
+        self.assertEqual(self.stats(), (2, 3, 4, 8, 8))
+
+        store = SparseCorpusStore(self.dictionary)
+        store.import_from_db(TextPrizmWord)
+        self.dictionary._refresh_corpus_stats(corpus_store=store)
+        self.assertEqual(self.stats(), (2, 3, 4, 8, 8))
+
+
+class CorpusCacheTest(WordVectorDataTestCase):
+
+    def check_cache(self, max_memory_postings):
+        source = DbWordVectorIterator(self.dictionary, TextPrizmWord)
+        cache = CorpusCache(source, num_postings=self.dictionary.corpus_num_postings,
+                            max_memory_postings=max_memory_postings)
+        corpus = cache.materialize()
+        self.assertIs(cache.materialize(), corpus)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(self.read(corpus), self.documents)
+            self.assertEqual(self.read(corpus), self.documents)
+        return cache
+
+    def test_in_memory(self):
+        cache = self.check_cache(100)
+        self.assertTrue(cache.in_memory)
+        self.assertIsNone(cache.segment_paths())
+
+    def test_on_disk(self):
+        cache = self.check_cache(0)
+        self.assertFalse(cache.in_memory)
+        segment_path = cache.segment_paths()[0]
+        self.assertTrue(segment_path.exists())
+
+        cache.cleanup()
+        self.assertFalse(segment_path.exists())
+
+    def test_context_reads_the_table_once(self):
+        context = make_context()
+        context.get_corpus(self.dictionary)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.read(context.get_corpus(self.dictionary)), self.documents)
+            self.assertEqual(self.read(context.get_corpus(self.dictionary, after=3)), self.documents[2:])
+        context.cleanup()
+
+
+class InferenceTest(TopicsTestCase):
+
+    def setUp(self):
+        from gensim.models import LdaModel
+
+        super(InferenceTest, self).setUp()
+        self.corpus = make_corpus([(source_id, [(source_id % 2, 2.0), (2 + source_id % 2, 1.0)])
+                                   for source_id in range(1, 61)])
+        self.lda = LdaModel(corpus=self.corpus, num_topics=3, passes=2)
+
+    def assertMixturesAlmostEqual(self, first, second):
+        first, second = dict(first), dict(second)
+        for topic in set(first) | set(second):
+            self.assertAlmostEqual(first.get(topic, 0), second.get(topic, 0), delta=0.05)
+
+    def test_matches_lda(self):
+        bows = list(self.corpus)[:10]
+        mixtures = infer_topics(self.lda, bows)
+        self.assertEqual(len(mixtures), 10)
+        for bow, mixture in zip(bows, mixtures):
+            self.assertMixturesAlmostEqual(mixture, self.lda[bow])
+
+    def test_eps(self):
+        self.assertEqual(infer_topics(self.lda, []), [])
+        for mixture in infer_topics(self.lda, list(self.corpus), eps=0.3):
+            self.assertTrue(all(probability >= 0.3 for topic, probability in mixture))
+
+    def test_iterate_in_order(self):
+        documents = list(iter_topic_mixtures(self.lda, None, self.corpus, chunk_size=7))
+        self.assertEqual([source_id for source_id, bow, mixture in documents], range(1, 61))
+        self.assertEqual([bow for source_id, bow, mixture in documents], list(self.corpus))
+
+    def test_workers(self):
+        model_path = self.data_dir / 'lda.model'
+        self.lda.save(model_path)
+
+        single = list(iter_topic_mixtures(self.lda, model_path, self.corpus, chunk_size=7))
+        pooled = list(iter_topic_mixtures(self.lda, model_path, self.corpus, workers=2, chunk_size=7))
+        self.assertEqual([source_id for source_id, bow, mixture in pooled], range(1, 61))
+        for (source_id, bow, mixture), (pooled_id, pooled_bow, pooled_mixture) in zip(single, pooled):
+            self.assertMixturesAlmostEqual(mixture, pooled_mixture)
+
+    def test_apply_lda(self):
+        from gensim.models import LdaModel
+
+        dictionary = make_dictionary()
+        lda = LdaModel(corpus=self.corpus, num_topics=2, id2word=dictionary.gensim_dictionary, passes=2)
+        model = dictionary._save_topic_model('test', lda, words_to_save=4)
+        dictionary._apply_lda(model, self.corpus, TextPrizmTopic, lda=lda, chunk_size=7)
+
+        vectors = TextPrizmTopic.objects.filter(topic_model=model)
+        self.assertEqual(set(vectors.values_list('source_id', flat=True)), set(range(1, 61)))
+        totals = {}
+        for source_id, probability in vectors.values_list('source_id', 'probability'):
+            totals[source_id] = totals.get(source_id, 0) + probability
+        self.assertTrue(all(0.95 < total < 1 + 1e-6 for total in totals.values()))
+
+        topics = model.topics.all()
+        self.assertEqual(sum(topic.document_count for topic in topics), vectors.count())
+        self.assertAlmostEqual(sum(topic.prevalence for topic in topics), 1.0, delta=0.05)
+        self.assertTrue(TopicModel.objects.get(pk=model.pk).examples_indexed)
+
+
+class TrainingConfigTest(TestCase):
+
+    def setUp(self):
+        self.corpus = make_corpus([(source_id, [(source_id % 4, 1.0)]) for source_id in range(1, 101)])
+
+    def test_resolve(self):
+        config = TrainingConfig(workers='3', chunksize='500', passes='2').resolve(self.corpus, 5, None)
+        self.assertEqual((config.workers, config.chunksize, config.passes), (3, 500, 2))
+
+        config = TrainingConfig(chunksize=500).resolve(self.corpus, 5, None)
+        self.assertEqual(config.workers, auto_workers())
+        self.assertTrue(config.workers >= 1)
+
+    def test_resolve_small_corpus(self):
+        # too few documents to time any candidate: one chunk per worker
+        config = TrainingConfig(workers=2, chunksize='auto').resolve(self.corpus, 5, None)
+        self.assertEqual(config.chunksize, 50)
+
+    def test_calibrate_single_candidate(self):
+        sample = take_sample(self.corpus, 60)
+        self.assertEqual(len(sample), 60)
+        self.assertEqual(calibrate_chunksize(sample, 5, None, 2, candidates=(10, 40)), 10)
+
+    def test_lda_options(self):
+        config = TrainingConfig(workers=2, chunksize=1000, passes=3, batch=True)
+        self.assertEqual(config.lda_options(), dict(workers=2, chunksize=1000, passes=3, batch=True,
+                                                    iterations=50, eval_every=10))
+        self.assertEqual(json.loads(config.to_json()), config.lda_options())
+        self.assertEqual(repr(config), "TrainingConfig(batch=True, chunksize=1000, eval_every=10, "
+                                       "iterations=50, passes=3, workers=2)")
+
+
+class SweepTest(TopicsTestCase):
+
+    def test_resolve_max_workers(self):
+        self.assertEqual(resolve_max_workers(4, 2), 2)
+        self.assertEqual(resolve_max_workers('3', 5), 3)
+        self.assertEqual(resolve_max_workers(-1, 5), 1)
+        self.assertTrue(1 <= resolve_max_workers('auto', 3) <= 3)
+
+    def test_run_sweep(self):
+        dictionary = make_dictionary()
+        cache = CorpusCache(make_corpus([(source_id, [(source_id % 2, 2.0), (2 + source_id % 2, 1.0)])
+                                         for source_id in range(1, 101)]), max_memory_postings=0)
+        cache.materialize()
+
+        results = run_sweep(dictionary, 'sweep', cache.segment_paths(), [3, 2, 2],
+                            TrainingConfig(workers=4, chunksize=20), max_workers=2, holdout_fraction=0.2)
+        cache.cleanup()
+
+        self.assertEqual([num_topics for num_topics, model, docs_per_second in results], [2, 3])
+        for num_topics, model, docs_per_second in results:
+            self.assertEqual(model.topics.count(), num_topics)
+            self.assertEqual(json.loads(model.training_config)['workers'], 1)
+            self.assertEqual(model.holdout_fraction, 0.2)
+            self.assertTrue(model.perplexity < 0)
+
+        rows = report_rows(results)
+        self.assertEqual([len(row) for row in rows], [len(REPORT_COLUMNS)] * 2)
+        self.assertEqual([row[:2] for row in rows], [(model.id, num_topics) for num_topics, model, dps in results])
+        self.assertAlmostEqual(rows[0][5], 2 ** -results[0][1].perplexity)
+
+
+class SaveTopicModelTest(TopicsTestCase):
+
+    def setUp(self):
+        from gensim.models import LdaModel
+
+        super(SaveTopicModelTest, self).setUp()
+        self.dictionary = make_dictionary()
+        corpus = make_corpus([(source_id, [(source_id % 2, 2.0), (2 + source_id % 2, 1.0)])
+                              for source_id in range(1, 61)])
+        self.lda = LdaModel(corpus=corpus, num_topics=3, id2word=self.dictionary.gensim_dictionary, passes=2)
+
+    def test_topic_words(self):
+        model = self.dictionary._save_topic_model('test', self.lda, words_to_save=3, training_time=1.5)
+        self.assertEqual(model.training_time, 1.5)
+
+        topic_words = self.lda.state.get_lambda()
+        topic_words = topic_words / topic_words.sum(axis=1)[:, numpy.newaxis]
+
+        topics = list(model.topics.order_by('index'))
+        self.assertEqual([topic.index for topic in topics], [0, 1, 2])
+        for topic in topics:
+            self.assertAlmostEqual(topic.alpha, self.lda.alpha[topic.index])
+
+            words = list(topic.words.order_by('-probability').select_related('word'))
+            expected = numpy.argsort(-topic_words[topic.index])[:3].tolist()
+            self.assertEqual([word.word_index for word in words], expected)
+            self.assertEqual([word.word.index for word in words], expected)
+            for word in words:
+                self.assertAlmostEqual(word.probability, topic_words[topic.index, word.word_index], places=6)
+
+        grid = TopicWordGrid.objects.get(model=model)
+        self.assertEqual(grid.num_rows, 3)
+        self.assertEqual(grid.topics, [[topic.id, topic.index] for topic in topics])
+        self.assertTrue(model.model_path().exists())
+
+    def test_more_words_than_the_vocabulary(self):
+        model = self.dictionary._save_topic_model('test', self.lda, words_to_save=200)
+        self.assertEqual(TopicWord.objects.filter(topic__model=model).count(), 3 * len(self.dictionary.gensim_dictionary))
+        self.assertEqual(TopicWordGrid.get_for_model(model).num_rows, len(self.dictionary.gensim_dictionary))
+
+
+class ArtifactsTest(TopicsTestCase):
+
+    def setUp(self):
+        from gensim.models import LdaModel
+
+        super(ArtifactsTest, self).setUp()
+        corpus = make_corpus([(source_id, [(source_id % 4, 1.0)]) for source_id in range(1, 21)])
+        self.lda = LdaModel(corpus=corpus, num_topics=2)
+
+    def test_save_and_load(self):
+        artifacts.save_model(7, self.lda)
+        self.assertEqual(artifacts.model_path(7), self.data_dir / 'models' / 'model_7' / 'lda.model')
+
+        lda = artifacts.load_model(7)
+        self.assertTrue(isinstance(lda.expElogbeta, numpy.memmap))
+        self.assertTrue(numpy.allclose(lda.expElogbeta, self.lda.expElogbeta))
+
+        # replaced in place
+        artifacts.save_model(7, self.lda)
+        self.assertEqual(artifacts.models_dir().listdir(), [artifacts.artifact_dir(7)])
+        self.assertFalse(isinstance(artifacts.load_model(7, mmap=None).expElogbeta, numpy.memmap))
+
+    def test_legacy_path(self):
+        with self.data_dir:
+            self.lda.save(artifacts.legacy_model_path(8))
+            self.assertEqual(artifacts.model_path(8), artifacts.legacy_model_path(8))
+            self.assertEqual(artifacts.load_model(8).num_topics, 2)
+
+    def test_cache(self):
+        for model_id in (1, 2, 3):
+            artifacts.save_model(model_id, self.lda)
+
+        cache = artifacts.ModelCache(max_size=2)
+        first = cache.get(1)
+        self.assertIs(cache.get(1), first)
+        cache.get(2)
+        cache.get(1)
+        cache.get(3)
+        self.assertEqual(cache.models.keys(), [1, 3])
+        self.assertEqual((cache.hits, cache.misses), (2, 3))
+
+        cache.discard(1)
+        self.assertIsNot(cache.get(1), first)
+
+    def test_save_drops_cached_model(self):
+        artifacts.save_model(4, self.lda)
+        artifacts.model_cache.get(4)
+        artifacts.save_model(4, self.lda)
+        self.assertFalse(4 in artifacts.model_cache.models)
+
+
+class ExampleIndexTest(TestCase):
+
+    def test_rows(self):
+        index = ExampleIndex({0: {1: 101}, 1: {}}, examples_per_topic=3, examples_per_word=2)
+        for source_id, probability in enumerate([0.5, 0.9, 0.1, 0.7, 0.3], 1):
+            bow = [(1, 1.0)] if source_id % 2 else [(2, 1.0)]
+            index.add(source_id, bow, [(0, probability), (1, 1 - probability)])
+
+        rows = sorted(index.rows({0: 10, 1: 11}), key=lambda row: (row[0], row[1], row[4]))
+        self.assertEqual(rows, [
+            (10, None, 2, 0.9, 0), (10, None, 4, 0.7, 1), (10, None, 1, 0.5, 2),
+            (10, 101, 1, 0.5, 0), (10, 101, 5, 0.3, 1),
+            (11, None, 3, 0.9, 0), (11, None, 5, 0.7, 1), (11, None, 1, 0.5, 2),
+        ])
+
+    def test_empty(self):
+        index = ExampleIndex({0: {1: 101}})
+        index.add(1, [(1, 1.0)], [])
+        self.assertEqual(list(index.rows({0: 10})), [])
@@ -0,0 +1,131 @@
+"""
+Training settings for LdaMulticore.
+
+TrainingConfig holds what _build_lda passes to gensim. workers and
+chunksize may be 'auto':
+
+    workers    one process per core, less one for the master process
+               that LdaMulticore runs besides its workers
+    chunksize  timed on a sample from the start of the corpus with a
+               few short training runs; the fastest candidate wins
+               (see calibrate_chunksize)
+
+benchmark() trains on a sample with each of a list of configurations
+and reports documents per second.
+"""
+
+import itertools
+import json
+import time
+
+from parallel import cpu_count
+
+import logging
+logger = logging.getLogger(__name__)
+
+CHUNKSIZE_CANDIDATES = (250, 500, 1000, 2000, 4000)
+
+
+def auto_workers():
+    return max(1, cpu_count() - 1)
+
+
+class TrainingConfig(object):
+
+    def __init__(self, workers='auto', chunksize=2000, passes=1, batch=False, iterations=50,
+                 eval_every=10, calibration_docs=None):
+        self.workers = workers
+        self.chunksize = chunksize
+        self.passes = int(passes)
+        self.batch = bool(batch)
+        self.iterations = int(iterations)
+        self.eval_every = eval_every
+        self.calibration_docs = calibration_docs
+
+    def resolve(self, corpus, num_topics, id2word):
+        """A copy with 'auto' settings replaced by concrete values."""
+        workers = auto_workers() if self.workers == 'auto' else int(self.workers)
+
+        chunksize = self.chunksize
+        if chunksize == 'auto':
+            num_docs = self.calibration_docs or max(10000, 4000 * workers)
+            sample = take_sample(corpus, num_docs)
+            chunksize = calibrate_chunksize(sample, num_topics, id2word, workers,
+                                            iterations=self.iterations)
+        else:
+            chunksize = int(chunksize)
+
+        return TrainingConfig(workers=workers, chunksize=chunksize, passes=self.passes,
+                              batch=self.batch, iterations=self.iterations,
+                              eval_every=self.eval_every)
+
+    def lda_options(self):
+        """Keyword arguments for LdaMulticore."""
+        return dict(workers=self.workers, chunksize=self.chunksize, passes=self.passes,
+                    batch=self.batch, iterations=self.iterations, eval_every=self.eval_every)
+
+    def to_json(self):
+        return json.dumps(self.lda_options(), sort_keys=True)
+
+    def __repr__(self):
+        return "TrainingConfig(%s)" % ', '.join('%s=%r' % item for item in sorted(self.lda_options().iteritems()))
+
+
+def take_sample(corpus, num_docs):
+    """The first num_docs documents of corpus, in memory."""
+    return list(itertools.islice(corpus, num_docs))
+
+
+def time_training(sample, num_topics, id2word, config):
+    """Seconds to train a throwaway model on sample with the given (resolved) config."""
+    from gensim.models import LdaMulticore
+
+    start = time.time()
+    LdaMulticore(corpus=sample, num_topics=num_topics, id2word=id2word, **config.lda_options())
+    return time.time() - start
+
+
+def calibrate_chunksize(sample, num_topics, id2word, workers, candidates=CHUNKSIZE_CANDIDATES, iterations=50):
+    """
+    Time one pass over sample for each candidate chunksize that
+    gives every worker at least one chunk, and return the fastest.
+    """
+    usable = [chunksize for chunksize in candidates if chunksize * workers <= len(sample)]
+    if not usable:
+        return max(1, len(sample) // workers)
+    if len(usable) == 1:
+        return usable[0]
+
+    logger.info("Calibrating chunksize on %d documents with %d workers" % (len(sample), workers))
+
+    best = None
+    for chunksize in usable:
+        config = TrainingConfig(workers=workers, chunksize=chunksize, iterations=iterations, eval_every=None)
+        seconds = time_training(sample, num_topics, id2word, config)
+        logger.info("chunksize %d: %.0f docs/s" % (chunksize, len(sample) / max(seconds, 1e-9)))
+
+        if best is None or seconds < best[1]:
+            best = (chunksize, seconds)
+
+    logger.info("Using chunksize %d" % best[0])
+    return best[0]
+
+
+def benchmark(corpus, id2word, configs, num_topics=30, sample_size=20000):
+    """
+    Train on the first sample_size documents with each config.
+    Returns a list of (config, num_docs, seconds, docs_per_second),
+    counting each pass over a document.
+    """
+    sample = take_sample(corpus, sample_size)
+
+    results = []
+    for config in configs:
+        config = config.resolve(sample, num_topics, id2word)
+        seconds = time_training(sample, num_topics, id2word, config)
+        docs_per_second = len(sample) * config.passes / max(seconds, 1e-9)
+
+        results.append((config, len(sample), seconds, docs_per_second))
+        logger.info("%r: %.1fs, %.0f docs/s" % (config, seconds, docs_per_second))
+
+    return results
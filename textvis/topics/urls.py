@@ -1,11 +1,29 @@
 from django.conf.urls import patterns, include, url
 
+import api
 import views
+from caching import cache_page
 
 urlpatterns = patterns('',
-    url(r'^$', views.TopicModelIndexView.as_view(), name='topics_models'),
-    url(r'^model/(?P<model_id>\d+)/$', views.TopicModelDetailView.as_view(), name='topics_model'),
-    url(r'^model/(?P<model_id>\d+)/topic/(?P<topic_id>\d+)/$', views.TopicDetailView.as_view(), name='topics_topic'),
-    url(r'^model/(?P<model_id>\d+)/topic/(?P<topic_id>\d+)/word/(?P<word_id>\d+)/$', views.TopicWordDetailView.as_view(),
+    url(r'^$', cache_page(views.TopicModelIndexView.as_view()), name='topics_models'),
+    url(r'^model/(?P<model_id>\d+)/$', cache_page(views.TopicModelDetailView.as_view()), name='topics_model'),
+    url(r'^model/(?P<model_id>\d+)/topic/(?P<topic_id>\d+)/$', cache_page(views.TopicDetailView.as_view()), name='topics_topic'),
+    url(r'^model/(?P<model_id>\d+)/topic/(?P<topic_id>\d+)/word/(?P<word_id>\d+)/$', cache_page(views.TopicWordDetailView.as_view()),
         name='topics_topic_word'),
+    url(r'^model/(?P<model_id>\d+)/topic/(?P<topic_id>\d+)/examples/$', cache_page(views.TopicExamplesView.as_view()),
+        name='topics_topic_examples'),
+    url(r'^model/(?P<model_id>\d+)/topic/(?P<topic_id>\d+)/examples\.json$', cache_page(views.TopicExamplesJsonView.as_view()),
+        name='topics_topic_examples_json'),
+    url(r'^model/(?P<model_id>\d+)/topic/(?P<topic_id>\d+)/word/(?P<word_id>\d+)/examples/$',
+        cache_page(views.TopicExamplesView.as_view()), name='topics_topic_word_examples'),
+    url(r'^model/(?P<model_id>\d+)/topic/(?P<topic_id>\d+)/word/(?P<word_id>\d+)/examples\.json$',
+        cache_page(views.TopicExamplesJsonView.as_view()), name='topics_topic_word_examples_json'),
+
+    url(r'^api/models\.json$', api.model_list, name='topics_api_models'),
+    url(r'^api/model/(?P<model_id>\d+)\.json$', api.model_detail, name='topics_api_model'),
+    url(r'^api/model/(?P<model_id>\d+)/words\.json$', api.model_words, name='topics_api_model_words'),
+    url(r'^api/model/(?P<model_id>\d+)/prevalence\.json$', api.model_prevalence, name='topics_api_model_prevalence'),
+    url(r'^api/model/(?P<model_id>\d+)/topic/(?P<topic_id>\d+)/examples\.json$', api.topic_examples,
+        name='topics_api_topic_examples'),
+    url(r'^api/cache\.json$', api.cache_stats, name='topics_api_cache_stats'),
 )
@@ -1,8 +1,18 @@
-from django.shortcuts import render
-from django.views.generic import ListView, DetailView
+from django.core.urlresolvers import reverse
+from django.http import Http404, JsonResponse
+from django.shortcuts import render, get_object_or_404
+from django.views.generic import ListView, DetailView, View
 
 import models
 
+
+def get_topicvector_class(topic_model):
+    #Dumb
+    if 'tweet' in topic_model.dictionary.dataset.lower():
+        return models.TweetTopic
+    else:
+        return models.TextPrizmTopic
+
 # Create your views here.
 class TopicModelIndexView(ListView):
     context_object_name = 'topic_models'
@@ -16,34 +26,39 @@ class TopicModelDetailView(DetailView):
     model = models.TopicModel
     template_name = 'topics/model_detail.html'
 
+    # word ranks shown unless ?rows=all or ?rows=<n>
+    default_rows = 50
+
+    def get_num_rows(self):
+        rows = self.request.GET.get('rows')
+        if rows == 'all':
+            return None
+        try:
+            return max(1, int(rows))
+        except (TypeError, ValueError):
+            return self.default_rows
+
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
         context = super(TopicModelDetailView, self).get_context_data(**kwargs)
+        topic_model = context['topic_model']
 
-        # Add in a QuerySet of words for each topic
-        words_for_topics = {}
-        max_words = 0
-        topics = context['topic_model'].topics.all().prefetch_related('words')
-        for topic in topics:
-            words = list(topic.words.order_by('-probability').prefetch_related('word'))
-            words_for_topics[topic.id] = words
-            max_words = max(max_words, len(words))
-
-        # transpose the word lists
-        word_rows = []
-        for word_i in range(max_words):
-            row = []
+        # the ranked words of all topics, precomputed when the model was saved
+        grid = models.TopicWordGrid.get_for_model(topic_model)
 
-            for topic in topics:
-                words = words_for_topics[topic.id]
-                if word_i < len(words):
-                    row.append(words[word_i])
-                else:
-                    row.append(None)
+        topic_urls = dict((topic_id, reverse('topics_topic', kwargs=dict(model_id=topic_model.id, topic_id=topic_id)))
+                          for topic_id, index in grid.topics)
 
-            word_rows.append(row)
+        def word_url(topic_id, topicword_id):
+            return reverse('topics_topic_word', kwargs=dict(model_id=topic_model.id, topic_id=topic_id,
+                                                            word_id=topicword_id))
 
-        context['word_rows'] = word_rows
+        num_rows = self.get_num_rows()
+        context['topics'] = [dict(id=topic_id, index=index, url=topic_urls[topic_id])
+                             for topic_id, index in grid.topics]
+        context['word_rows'] = grid.get_rows(0, num_rows, word_url=word_url)
+        context['total_rows'] = grid.num_rows
+        context['more_rows'] = num_rows is not None and num_rows < grid.num_rows
 
         return context
 
@@ -54,6 +69,10 @@ class TopicDetailView(DetailView):
     model = models.Topic
     template_name = 'topics/topic_detail.html'
 
+    def get_queryset(self):
+        # pages are cached by the url's model (see caching.cache_page)
+        return models.Topic.objects.filter(model_id=self.kwargs['model_id'])
+
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
         context = super(TopicDetailView, self).get_context_data(**kwargs)
@@ -68,11 +87,11 @@ class TopicDetailView(DetailView):
         context['topic_model'] = topic_model
         context['topic_words'] = topic.words.prefetch_related('word')
 
-        #Dumb
-        if 'tweet' in topic_model.dictionary.dataset.lower():
-            topicvector_class = models.TweetTopic
-        else:
-            topicvector_class = models.TextPrizmTopic
+        topicvector_class = get_topicvector_class(topic_model)
+
+        if topic_model.examples_indexed:
+            context['examples'] = models.TopicExample.get_examples(topic, topicvector_class, word=word)
+            return
 
         examples = topicvector_class.get_examples(topic=topic)
         if word:
@@ -89,9 +108,98 @@ class TopicWordDetailView(DetailView):
     model = models.TopicWord
     template_name = 'topics/topic_detail.html'
 
+    def get_queryset(self):
+        # pages are cached by the url's model (see caching.cache_page)
+        return models.TopicWord.objects.filter(topic_id=self.kwargs['topic_id'],
+                                               topic__model_id=self.kwargs['model_id'])
+
     def get_context_data(self, **kwargs):
         # Call the base implementation first to get a context
         context = super(TopicWordDetailView, self).get_context_data(**kwargs)
         topicword = self.object
         TopicDetailView.get_topic_data(context, topic=self.object.topic, word=topicword.word)
+        context['word_id'] = topicword.id
         return context
+
+
+class ExamplePageMixin(object):
+    """
+    Reads an examples page of a topic (and optional word) for the url kwargs.
+    A topic's examples are paged from its topic vectors; a word's only from
+    its indexed TopicExamples, so they end after ExampleIndex.examples_per_word.
+    """
+    page_size = 20
+    max_page_size = 500
+
+    def get_examples_page(self):
+        topic = get_object_or_404(models.Topic.objects.select_related('model__dictionary'),
+                                  pk=self.kwargs['topic_id'], model_id=self.kwargs['model_id'])
+
+        word = None
+        if 'word_id' in self.kwargs:
+            word = get_object_or_404(models.TopicWord, pk=self.kwargs['word_id'], topic=topic).word
+
+        topicvector_class = get_topicvector_class(topic.model)
+
+        after = self.request.GET.get('after')
+        if after:
+            try:
+                after = topicvector_class.parse_cursor(after)
+            except ValueError:
+                raise Http404("Bad cursor")
+
+        try:
+            page_size = min(self.max_page_size, max(1, int(self.request.GET.get('size', self.page_size))))
+        except ValueError:
+            page_size = self.page_size
+
+        if word is None:
+            examples, next_cursor = topicvector_class.get_examples_page(topic, after=after or None,
+                                                                        page_size=page_size)
+        elif topic.model.examples_indexed:
+            examples, next_cursor = models.TopicExample.get_examples_page(topic, topicvector_class, word=word,
+                                                                          after=after or None,
+                                                                          page_size=page_size)
+        else:
+            raise Http404("This model has no indexed examples for its topic words")
+        if next_cursor is not None:
+            next_cursor = topicvector_class.format_cursor(next_cursor)
+
+        return topic, word, examples, next_cursor
+
+
+class TopicExamplesView(ExamplePageMixin, DetailView):
+    """Page through all of a topic's examples, or the indexed examples of one of its words."""
+    template_name = 'topics/topic_examples.html'
+
+    def get_object(self, queryset=None):
+        self.topic, self.word, self.examples, self.next_cursor = self.get_examples_page()
+        return self.topic
+
+    def get_context_data(self, **kwargs):
+        context = super(TopicExamplesView, self).get_context_data(**kwargs)
+        context['topic'] = self.topic
+        context['topic_model'] = self.topic.model
+        context['word'] = self.word
+        context['word_id'] = self.kwargs.get('word_id')
+        context['examples'] = self.examples
+        context['next_cursor'] = self.next_cursor
+        context['is_first_page'] = not self.request.GET.get('after')
+        return context
+
+
+class TopicExamplesJsonView(ExamplePageMixin, View):
+    """
+    JSON version of TopicExamplesView:
+    {"examples": [[source_id, probability, user_name, text, created_at], ...], "next": cursor or null}
+    """
+
+    def get(self, request, *args, **kwargs):
+        topic, word, examples, next_cursor = self.get_examples_page()
+        topicvector_class = get_topicvector_class(topic.model)
+        rows = []
+        for example in examples:
+            user_name, text, created_at = topicvector_class.source_fields(example.source)
+            rows.append([example.source_id, example.probability, user_name, text,
+                         created_at.isoformat() if created_at else None])
+        return JsonResponse({'examples': rows, 'next': next_cursor})
@@ -0,0 +1,100 @@
+"""
+Term weighting for document word vectors.
+
+Weights are computed for a whole batch of documents at once.
+A batch is given as flat arrays of word indices and counts for
+all of its postings, plus the number of postings in each document.
+
+Schemes:
+
+    legacy  count * log(num_docs) / log(document_frequency),
+            the formula the pipeline has always used; document
+            frequencies below 2 count as 2, so words seen in a single
+            document (or not at all) get a finite weight
+
+    or a three-letter SMART code, as in gensim's TfidfModel:
+
+    term frequency:  n  count
+                     l  1 + log2(count)
+                     a  0.5 + 0.5 * count / max count in the document
+                     b  1
+    document freq:   n  1
+                     t  log2(num_docs / document_frequency)
+                     p  max(0, log2((num_docs - document_frequency) / document_frequency))
+    normalization:   n  none
+                     c  cosine (unit length per document)
+
+gensim's TfidfModel defaults to 'ntc'.
+"""
+
+import numpy
+
+DEFAULT_SCHEME = 'legacy'
+
+
+class TermWeighting(object):
+
+    def __init__(self, scheme, dfs, num_docs):
+        if scheme != 'legacy':
+            if (len(scheme) != 3 or scheme[0] not in 'nlab' or
+                    scheme[1] not in 'ntp' or scheme[2] not in 'nc'):
+                raise ValueError("Unknown term weighting scheme '%s'" % scheme)
+
+        self.scheme = scheme
+        self.num_docs = num_docs
+
+        # document frequency by word index, computed once
+        size = max(dfs.iterkeys()) + 1 if dfs else 0
+        df = numpy.ones(size, dtype=numpy.float64)
+        df[dfs.keys()] = dfs.values()
+        self.idf = self._make_idf(df)
+
+    def _make_idf(self, df):
+        num_docs = float(self.num_docs)
+
+        if self.scheme == 'legacy':
+            # log(1) is 0
+            return numpy.log(num_docs) / numpy.log(numpy.maximum(df, 2))
+
+        idf_code = self.scheme[1]
+        if idf_code == 'n':
+            return numpy.ones_like(df)
+        elif idf_code == 't':
+            return numpy.log2(num_docs / df)
+        else:
+            return numpy.maximum(0, numpy.log2((num_docs - df) / df))
+
+    def weigh(self, indices, counts, lengths):
+        """
+        Weights for a batch of postings.
+        lengths gives the number of postings in each document.
+        """
+        indices = numpy.asarray(indices, dtype=numpy.int64)
+        counts = numpy.asarray(counts, dtype=numpy.float64)
+
+        if self.scheme == 'legacy':
+            return counts * self.idf[indices]
+
+        tf_code, idf_code, norm_code = self.scheme
+        lengths = numpy.asarray(lengths, dtype=numpy.int64)
+        doc_ids = numpy.repeat(numpy.arange(len(lengths)), lengths)
+
+        if tf_code == 'n':
+            tf = counts
+        elif tf_code == 'l':
+            tf = 1 + numpy.log2(counts)
+        elif tf_code == 'a':
+            max_counts = numpy.zeros(len(lengths))
+            numpy.maximum.at(max_counts, doc_ids, counts)
+            tf = 0.5 + 0.5 * counts / max_counts[doc_ids]
+        else:
+            tf = numpy.ones_like(counts)
+
+        weights = tf * self.idf[indices]
+
+        if norm_code == 'c':
+            norms = numpy.sqrt(numpy.bincount(doc_ids, weights=weights * weights, minlength=len(lengths)))
+            norms[norms == 0] = 1
+            weights = weights / norms[doc_ids]
+
+        return weights